@@ -0,0 +1,25 @@
+#!/usr/bin/env nextflow
+
+process ANNOTATE_PEAKS {
+    container 'ghcr.io/bf528/pandas:latest'
+    publishDir "${params.outdir}/homer/annotations/${experiment}", mode: 'copy'
+    label 'process_single'
+
+    input:
+    tuple val(experiment), path(peaks)
+    path(gtf)
+
+    output:
+    tuple val(experiment), path("annotated_peaks.txt"), emit: annotations
+
+    script:
+    """
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.annotate \
+        --peaks ${peaks} --gtf ${gtf} -o annotated_peaks.txt
+    """
+
+    stub:
+    """
+    touch annotated_peaks.txt
+    """
+}
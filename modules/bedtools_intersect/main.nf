@@ -2,15 +2,14 @@
 
 process BEDTOOLS_INTERSECT {
     container 'ghcr.io/bf528/bedtools:latest'
-    publishDir "${params.outdir}/peaks", mode: 'copy'
+    publishDir "${params.outdir}/peaks/${experiment}", mode: 'copy'
     label 'process_single'
 
     input:
-    path(bed1)
-    path(bed2)
+    tuple val(experiment), path(bed1), path(bed2)
 
     output:
-    path("reproducible_peaks.bed"), emit: reproducible_peaks
+    tuple val(experiment), path("reproducible_peaks.bed"), emit: reproducible_peaks
 
     script:
     """
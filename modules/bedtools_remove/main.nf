@@ -2,15 +2,15 @@
 
 process BEDTOOLS_REMOVE {
     container 'ghcr.io/bf528/bedtools:latest'
-    publishDir "${params.outdir}/peaks", mode: 'copy'
+    publishDir "${params.outdir}/peaks/${experiment}", mode: 'copy'
     label 'process_single'
 
     input:
-    path(peaks)
+    tuple val(experiment), path(peaks)
     path(blacklist)
 
     output:
-    path("filtered_peaks.bed"), emit: filtered_peaks
+    tuple val(experiment), path("filtered_peaks.bed"), emit: filtered_peaks
 
     script:
     """
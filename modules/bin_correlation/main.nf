@@ -0,0 +1,42 @@
+#!/usr/bin/env nextflow
+
+process BIN_CORRELATION {
+    container 'ghcr.io/bf528/pandas:latest'
+    publishDir "${params.outdir}/deeptools", mode: 'copy'
+    label 'process_medium'
+
+    input:
+    path(signal)
+    path(blacklist)
+
+    output:
+    path("correlation_heatmap.png"), emit: plot
+    path("correlation_matrix.tab"), emit: matrix_file
+    path("correlation_matrix_bootstrap.tsv"), emit: intervals, optional: true
+
+    script:
+    // multiBigwigSummary .npz with its --outRawCounts table (the bin
+    // coordinates), or chipseq.coverage .bins directories
+    def inputs = signal instanceof List ? signal : [signal]
+    def npz = inputs.find { it.name.endsWith('.npz') }
+    def source = npz ?
+        "--npz ${npz} --regions ${inputs.find { it.name.endsWith('.tab') }}" :
+        "--coverage ${inputs.join(' ')} --bin-size ${params.corr_bin_size}"
+    def bootstrap = params.corr_bootstrap ? "--bootstrap ${params.corr_bootstrap} --workers ${task.cpus}" : ''
+    """
+    CHIPSEQ_CACHE_DIR=.cache PYTHONPATH=${params.scripts_dir} python -m chipseq.correlation \
+        ${source} \
+        --method ${params.corrtype} \
+        --skip-zeros \
+        --blacklist ${blacklist} \
+        ${bootstrap} \
+        -o correlation_matrix.tab \
+        --plot correlation_heatmap.png
+    """
+
+    stub:
+    """
+    touch correlation_heatmap.png
+    touch correlation_matrix.tab
+    """
+}
@@ -11,7 +11,7 @@ process BOWTIE2_ALIGN {
 
     script:
     def genome_base = file(params.genome).baseName
-    def bowtie_threads = task.cpus - 5  // Reserve threads for overhead
+    def bowtie_threads = Math.max(task.cpus - 1, 1)  // Leave one thread for samtools view
     """
     bowtie2 -p ${bowtie_threads} \
         -x ${index_dir}/${genome_base} \
@@ -0,0 +1,31 @@
+#!/usr/bin/env nextflow
+
+process BOWTIE2_ALIGN_CHUNK {
+    container 'ghcr.io/bf528/bowtie2:latest'
+    label 'process_medium'
+
+    input:
+    tuple val(sample_id), val(condition), val(replicate), path(chunk), path(index_dir)
+
+    output:
+    tuple val(sample_id), val(condition), val(replicate), path("*.sorted.bam"), emit: bam
+
+    script:
+    def genome_base = file(params.genome).baseName
+    def chunk_name = chunk.name.replaceAll(/\.fastq\.gz$/, '')
+    // Aligner and sorter share the node; sort only needs a couple of threads
+    def sort_threads = Math.max(task.cpus.intdiv(4), 1)
+    def bowtie_threads = Math.max(task.cpus - sort_threads, 1)
+    """
+    bowtie2 -p ${bowtie_threads} \
+        -x ${index_dir}/${genome_base} \
+        -U ${chunk} \
+        | samtools sort -@ ${sort_threads} -o ${chunk_name}.sorted.bam -
+    """
+
+    stub:
+    def chunk_name = chunk.name.replaceAll(/\.fastq\.gz$/, '')
+    """
+    touch ${chunk_name}.sorted.bam
+    """
+}
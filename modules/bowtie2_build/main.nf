@@ -2,11 +2,12 @@
 
 process BOWTIE2_BUILD {
     container 'ghcr.io/bf528/bowtie2:latest'
-    publishDir "${params.refdir}", mode: 'copy'
+    // Built once per genome content; later runs and other projects reuse it
+    storeDir "${params.asset_dir}/bowtie2_index/${digest}"
     label 'process_high'
 
     input:
-    path(genome_fasta)
+    tuple val(digest), path(genome_fasta)
 
     output:
     path("bowtie2_index"), emit: index
@@ -0,0 +1,28 @@
+#!/usr/bin/env nextflow
+
+process CALL_PEAKS {
+    container 'ghcr.io/bf528/pysam:latest'
+    publishDir "${params.outdir}/homer/peaks", mode: 'copy', pattern: "*_peaks.txt"
+    label 'process_medium'
+
+    input:
+    tuple val(experiment), val(ip_id), path(ip_tags), val(input_id), path(input_tags)
+
+    output:
+    tuple val(experiment), path("${ip_id}_peaks.txt"), emit: peaks
+
+    script:
+    def fragment = params.fragment_length ? "--fragment-length ${params.fragment_length}" : ''
+    """
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.peak_caller \
+        --ip ${ip_tags} --control ${input_tags} ${fragment} \
+        --genome-size ${params.peak_genome_size} --fdr ${params.peak_fdr} \
+        --workers ${task.cpus} \
+        -o ${ip_id}_peaks.txt
+    """
+
+    stub:
+    """
+    touch ${ip_id}_peaks.txt
+    """
+}
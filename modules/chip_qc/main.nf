@@ -0,0 +1,27 @@
+#!/usr/bin/env nextflow
+
+process CHIP_QC {
+    container 'ghcr.io/bf528/pysam:latest'
+    publishDir "${params.outdir}/qc", mode: 'copy'
+    label 'process_single'
+
+    input:
+    tuple val(sample_id), val(condition), val(replicate), path(sorted_bam), path(peaks)
+
+    output:
+    path("${sample_id}_qc.json"), emit: json
+    path("${sample_id}_qc_mqc.tsv"), emit: mqc
+
+    script:
+    """
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.bam_qc \
+        --bam ${sorted_bam} --peaks ${peaks} --sample ${sample_id} \
+        --max-shift ${params.qc_max_shift} -o ${sample_id}_qc
+    """
+
+    stub:
+    """
+    touch ${sample_id}_qc.json
+    touch ${sample_id}_qc_mqc.tsv
+    """
+}
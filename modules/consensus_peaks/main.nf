@@ -0,0 +1,27 @@
+#!/usr/bin/env nextflow
+
+process CONSENSUS_PEAKS {
+    container 'ghcr.io/bf528/pandas:latest'
+    publishDir "${params.outdir}/peaks/${experiment}", mode: 'copy'
+    label 'process_single'
+
+    input:
+    tuple val(experiment), path(beds)
+    path(blacklist)
+
+    output:
+    tuple val(experiment), path("filtered_peaks.bed"), emit: filtered_peaks
+    tuple val(experiment), path("consensus_regions.bed"), emit: regions
+
+    script:
+    """
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.consensus ${beds} \
+        --min-support ${params.consensus_min_support} --blacklist ${blacklist} \
+        -o filtered_peaks.bed --all consensus_regions.bed
+    """
+
+    stub:
+    """
+    touch filtered_peaks.bed consensus_regions.bed
+    """
+}
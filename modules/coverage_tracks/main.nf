@@ -0,0 +1,35 @@
+#!/usr/bin/env nextflow
+
+process COVERAGE_TRACKS {
+    container 'ghcr.io/bf528/deeptools:latest'
+    publishDir "${params.outdir}/bigwig", mode: 'copy'
+    label 'process_medium'
+
+    input:
+    tuple val(input_id), path(input_bam), path(input_bai), val(ip_ids), path(ip_bams), path(ip_bais)
+
+    output:
+    path("*.bw"), emit: bigwig
+    path("*.log2ratio.bw"), emit: ratio
+    path("*.bins"), emit: bins
+
+    script:
+    // The INPUT is binned once and shared by the ratio track of every IP that names it
+    def pairs = ip_ids.collect { "--pair ${it}:${input_id}" }.join(' ')
+    """
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.coverage \
+        --bam ${ip_bams} ${input_bam} \
+        ${pairs} \
+        --bin-size ${params.bin_size} \
+        --normalize ${params.coverage_norm} \
+        --effective-genome-size ${params.effective_genome_size} \
+        --extend ${params.extend_reads} \
+        --workers ${task.cpus}
+    """
+
+    stub:
+    """
+    touch ${input_id}.bw ${ip_ids.collect { "${it}.bw ${it}_vs_${input_id}.log2ratio.bw" }.join(' ')}
+    mkdir -p ${input_id}.bins ${ip_ids.collect { "${it}.bins" }.join(' ')}
+    """
+}
@@ -10,15 +10,18 @@ process DEEPTOOLS_MULTIBWSUMMARY {
 
     output:
     path("multibw_summary.npz"), emit: matrix
+    path("multibw_summary.tab"), emit: counts
 
     script:
     def bw_files = bigwigs.collect { it }.join(' ')
     """
-    multiBigwigSummary bins -b ${bw_files} -o multibw_summary.npz -p ${task.cpus}
+    multiBigwigSummary bins -b ${bw_files} -o multibw_summary.npz \
+        --outRawCounts multibw_summary.tab -p ${task.cpus}
     """
 
     stub:
     """
     touch multibw_summary.npz
+    touch multibw_summary.tab
     """
 }
\ No newline at end of file
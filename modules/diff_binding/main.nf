@@ -0,0 +1,36 @@
+#!/usr/bin/env nextflow
+
+process DIFF_BINDING {
+    container 'ghcr.io/bf528/pysam:latest'
+    publishDir "${params.outdir}/diffbind", mode: 'copy'
+    label 'process_medium'
+
+    input:
+    path(bams)
+    path(regions, stageAs: 'regions?/*')
+    path(design)
+
+    output:
+    path("differential_binding.tsv"), emit: results
+    path("counts.tsv"), emit: counts
+    path("counts.npz"), emit: count_matrix
+
+    script:
+    def contrast = params.diffbind_contrast ? "--contrast ${params.diffbind_contrast.tokenize(',').join(' ')}" : ''
+    def fragment = params.fragment_length ? "--fragment-length ${params.fragment_length}" : ''
+    // Peaks of several experiments are merged into one set of non-overlapping regions first
+    def region_files = regions instanceof List ? regions : [regions]
+    """
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.consensus ${region_files.join(' ')} \
+        --names ${(1..region_files.size()).collect { "set${it}" }.join(' ')} -o diffbind_regions.bed
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.diffbind \
+        --regions diffbind_regions.bed --bams ${bams} --design ${design} \
+        ${contrast} ${fragment} --normalize ${params.diffbind_normalize} \
+        --workers ${task.cpus} -o .
+    """
+
+    stub:
+    """
+    touch differential_binding.tsv counts.tsv counts.npz
+    """
+}
@@ -0,0 +1,23 @@
+#!/usr/bin/env nextflow
+
+process FASTQ_SPLIT {
+    container 'ghcr.io/bf528/pandas:latest'
+    label 'process_single'
+
+    input:
+    tuple val(sample_id), val(condition), val(replicate), path(reads)
+
+    output:
+    tuple val(sample_id), val(condition), val(replicate), path("${sample_id}.chunk*.fastq.gz"), emit: chunks
+
+    script:
+    """
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.fastq_split ${reads} \
+        --reads ${params.align_chunk_reads} --prefix ${sample_id}
+    """
+
+    stub:
+    """
+    touch ${sample_id}.chunk0000.fastq.gz
+    """
+}
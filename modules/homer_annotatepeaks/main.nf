@@ -2,16 +2,16 @@
 
 process HOMER_ANNOTATEPEAKS {
     container 'ghcr.io/bf528/homer_samtools:latest'
-    publishDir "${params.outdir}/homer/annotations", mode: 'copy'
+    publishDir "${params.outdir}/homer/annotations/${experiment}", mode: 'copy'
     label 'process_medium'
 
     input:
-    path(peaks)
+    tuple val(experiment), path(peaks)
     path(genome)
     path(gtf)
 
     output:
-    path("annotated_peaks.txt"), emit: annotations
+    tuple val(experiment), path("annotated_peaks.txt"), emit: annotations
 
     script:
     """
@@ -2,15 +2,15 @@
 
 process HOMER_FINDMOTIFSGENOME {
     container 'ghcr.io/bf528/homer_samtools:latest'
-    publishDir "${params.outdir}/homer/motifs", mode: 'copy'
+    publishDir "${params.outdir}/homer/motifs/${experiment}", mode: 'copy'
     label 'process_high'
 
     input:
-    path(peaks)
+    tuple val(experiment), path(peaks)
     path(genome)
 
     output:
-    path("motif_output"), emit: motif_dir
+    tuple val(experiment), path("motif_output"), emit: motif_dir
 
     script:
     """
@@ -6,10 +6,10 @@ process HOMER_FINDPEAKS {
     label 'process_medium'
 
     input:
-    tuple val(ip_sample), val(replicate), path(ip_tagdir), path(input_tagdir)
+    tuple val(ip_sample), val(experiment), path(ip_tagdir), path(input_tagdir)
 
     output:
-    tuple val(replicate), path("${ip_sample}_peaks.txt"), emit: peaks
+    tuple val(experiment), path("${ip_sample}_peaks.txt"), emit: peaks
 
     script:
     """
@@ -6,10 +6,10 @@ process HOMER_POS2BED {
     label 'process_single'
 
     input:
-    tuple val(replicate), path(peaks_txt)
+    tuple val(experiment), path(peaks_txt)
 
     output:
-    tuple val(replicate), path("${peaks_txt.baseName}.bed"), emit: bed
+    tuple val(experiment), path("${peaks_txt.baseName}.bed"), emit: bed
 
     script:
     """
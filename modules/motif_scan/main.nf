@@ -0,0 +1,33 @@
+#!/usr/bin/env nextflow
+
+process MOTIF_SCAN {
+    container 'ghcr.io/bf528/pandas:latest'
+    publishDir "${params.outdir}/motifs/${experiment}", mode: 'copy'
+    label 'process_medium'
+
+    input:
+    tuple val(experiment), path(peaks)
+    path(genome)
+    path(motifs)
+    path(blacklist)
+
+    output:
+    tuple val(experiment), path("known_results.tsv"), emit: known
+    tuple val(experiment), path("motif_positions.tsv"), emit: positions
+    tuple val(experiment), path("motif_hits.tsv"), emit: hits
+
+    script:
+    def mask = params.motif_mask ? '--mask' : ''
+    """
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.motifs \
+        --peaks ${peaks} --genome ${genome} --motifs ${motifs} \
+        --size ${params.motif_size} ${mask} --blacklist ${blacklist} \
+        --background-ratio ${params.motif_background_ratio} \
+        --workers ${task.cpus} --outdir .
+    """
+
+    stub:
+    """
+    touch known_results.tsv motif_positions.tsv motif_hits.tsv
+    """
+}
@@ -0,0 +1,24 @@
+#!/usr/bin/env nextflow
+
+process PEAK_TAGS {
+    container 'ghcr.io/bf528/pysam:latest'
+    label 'process_medium'
+
+    input:
+    tuple val(sample_id), path(bam), path(bai)
+
+    output:
+    tuple val(sample_id), path("${sample_id}.tags"), emit: tags
+
+    script:
+    """
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.peak_caller \
+        --ip ${bam} --tags-only --workers ${task.cpus}
+    """
+
+    stub:
+    """
+    mkdir -p ${sample_id}.tags
+    touch ${sample_id}.tags/meta.json
+    """
+}
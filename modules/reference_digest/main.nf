@@ -0,0 +1,22 @@
+#!/usr/bin/env nextflow
+
+process REFERENCE_DIGEST {
+    container 'ghcr.io/bf528/pandas:latest'
+    label 'process_single'
+
+    input:
+    path(reference)
+
+    output:
+    tuple env(DIGEST), path(reference), emit: digest
+
+    script:
+    """
+    DIGEST=\$(PYTHONPATH=${params.scripts_dir} python -m chipseq.assets digest ${reference})
+    """
+
+    stub:
+    """
+    DIGEST=stub
+    """
+}
@@ -0,0 +1,29 @@
+#!/usr/bin/env nextflow
+
+process REPRODUCIBLE_PEAKS {
+    container 'ghcr.io/bf528/pandas:latest'
+    publishDir "${params.outdir}/peaks/${experiment}", mode: 'copy'
+    label 'process_single'
+
+    input:
+    tuple val(experiment), path(bed1), path(bed2)
+    path(blacklist)
+
+    output:
+    tuple val(experiment), path("filtered_peaks.bed"), emit: filtered_peaks
+
+    script:
+    def reciprocal = params.reciprocal_overlap ? '-r' : ''
+    def rank_filter = params.max_rank_diff != null ? "--max-rank-diff ${params.max_rank_diff}" : ''
+    """
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.reproducible \
+        -a ${bed1} -b ${bed2} --blacklist ${blacklist} \
+        -f ${params.min_overlap} ${reciprocal} ${rank_filter} \
+        -o filtered_peaks.bed
+    """
+
+    stub:
+    """
+    touch filtered_peaks.bed
+    """
+}
@@ -0,0 +1,26 @@
+#!/usr/bin/env nextflow
+
+process SAMPLESHEET_CHECK {
+    container 'ghcr.io/bf528/pandas:latest'
+    publishDir "${params.outdir}/pipeline_info", mode: 'copy'
+    label 'process_single'
+
+    input:
+    path(samplesheet)
+    val(base_dir)
+
+    output:
+    path("samplesheet.valid.csv"), emit: csv
+
+    script:
+    """
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.samplesheet ${samplesheet} \
+        --base-dir ${base_dir} -o samplesheet.valid.csv
+    """
+
+    stub:
+    """
+    PYTHONPATH=${params.scripts_dir} python -m chipseq.samplesheet ${samplesheet} \
+        --base-dir ${base_dir} -o samplesheet.valid.csv
+    """
+}
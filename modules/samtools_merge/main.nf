@@ -0,0 +1,26 @@
+#!/usr/bin/env nextflow
+
+process SAMTOOLS_MERGE {
+    container 'ghcr.io/bf528/samtools:latest'
+    publishDir "${params.outdir}/sorted_bams", mode: 'copy'
+    label 'process_medium'
+
+    input:
+    tuple val(sample_id), val(condition), val(replicate), path(chunk_bams)
+
+    output:
+    tuple val(sample_id), val(condition), val(replicate), path("${sample_id}.sorted.bam"), emit: sorted_bam
+    tuple val(sample_id), val(condition), val(replicate), path("${sample_id}.sorted.bam.bai"), emit: bam_index
+
+    script:
+    // Chunks are already coordinate-sorted, so this is a single k-way merge
+    """
+    samtools merge -@ ${task.cpus} -o ${sample_id}.sorted.bam ${chunk_bams}
+    samtools index -@ ${task.cpus} ${sample_id}.sorted.bam
+    """
+
+    stub:
+    """
+    touch ${sample_id}.sorted.bam ${sample_id}.sorted.bam.bai
+    """
+}
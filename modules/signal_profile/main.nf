@@ -0,0 +1,39 @@
+#!/usr/bin/env nextflow
+
+process SIGNAL_PROFILE {
+    container 'ghcr.io/bf528/deeptools:latest'
+    publishDir "${params.outdir}/deeptools", mode: 'copy'
+    label 'process_medium'
+
+    input:
+    path(signals)
+    path(bed)
+    path(rnaseq)
+
+    output:
+    path("profile_plot.png"), emit: plot
+    path("profile_data.tsv"), emit: data
+
+    script:
+    // bigWigs, or chipseq.coverage .bins directories
+    def inputs = signals instanceof List ? signals : [signals]
+    def source = inputs[0].name.endsWith('.bins') ? '--coverage' : '--bigwigs'
+    def grouping = params.profile_by_de ? "--rnaseq ${rnaseq}" : ''
+    """
+    CHIPSEQ_CACHE_DIR=.cache PYTHONPATH=${params.scripts_dir} python -m chipseq.profile \
+        ${source} ${inputs.join(' ')} \
+        --genes ${bed} \
+        -b ${params.window} \
+        -a ${params.window} \
+        ${grouping} \
+        --workers ${task.cpus} \
+        -o profile_data.tsv \
+        --plot profile_plot.png
+    """
+
+    stub:
+    """
+    touch profile_plot.png
+    touch profile_data.tsv
+    """
+}
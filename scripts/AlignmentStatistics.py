@@ -1,51 +1,78 @@
 import pandas as pd
 import numpy as np
+from chipseq.render import save_figure
 import matplotlib.pyplot as plt
 from matplotlib_venn import venn2
 import seaborn as sns
 import os
 import re
+import json
 
 print("="*80)
 print("SUPPLEMENTARY FIGURE S2A - ALIGNMENT STATISTICS")
 print("="*80)
 
-# Read flagstat files
+# Read per-sample QC (chipseq.bam_qc JSON), falling back to flagstat text
+qc_dir = 'results/qc'
 flagstat_dir = 'results/flagstat'
-flagstat_files = {
-    'INPUT Rep1': os.path.join(flagstat_dir, 'INPUT_rep1_flagstat.txt'),
-    'INPUT Rep2': os.path.join(flagstat_dir, 'INPUT_rep2_flagstat.txt'),
-    'RUNX1 IP Rep1': os.path.join(flagstat_dir, 'IP_rep1_flagstat.txt'),
-    'RUNX1 IP Rep2': os.path.join(flagstat_dir, 'IP_rep2_flagstat.txt')
+samples = {
+    'INPUT Rep1': 'INPUT_rep1',
+    'INPUT Rep2': 'INPUT_rep2',
+    'RUNX1 IP Rep1': 'IP_rep1',
+    'RUNX1 IP Rep2': 'IP_rep2'
 }
 
-stats_data = []
+def read_flagstat(filepath):
+    with open(filepath, 'r') as f:
+        lines = f.readlines()
+    # First line: total reads
+    total_reads = int(lines[0].split()[0])
+    # Find mapped reads line (usually "X + Y mapped")
+    mapped_reads = 0
+    for line in lines:
+        if 'mapped (' in line and 'primary' not in line:
+            mapped_reads = int(line.split()[0])
+            break
+    return {'total_reads': total_reads, 'mapped_reads': mapped_reads}
+
+def fmt(value, spec):
+    return '-' if value is None else format(value, spec)
 
-for sample_name, filepath in flagstat_files.items():
-    if os.path.exists(filepath):
-        with open(filepath, 'r') as f:
-            lines = f.readlines()
-            # First line: total reads
-            total_line = lines[0]
-            total_reads = int(total_line.split()[0])
-            
-            # Find mapped reads line (usually "X + Y mapped")
-            mapped_reads = 0
-            for line in lines:
-                if 'mapped (' in line and 'primary' not in line:
-                    mapped_reads = int(line.split()[0])
-                    break
-            
-            mapping_pct = (mapped_reads / total_reads * 100) if total_reads > 0 else 0
-            
-            stats_data.append({
-                'Sample': sample_name,
-                'Total Reads': f"{total_reads:,}",
-                'Mapped Reads': f"{mapped_reads:,}",
-                'Mapping Rate (%)': f"{mapping_pct:.2f}"
-            })
+stats_data = []
+has_chip_qc = False
+
+for sample_name, sample_id in samples.items():
+    qc_path = os.path.join(qc_dir, f'{sample_id}_qc.json')
+    flagstat_path = os.path.join(flagstat_dir, f'{sample_id}_flagstat.txt')
+    if os.path.exists(qc_path):
+        with open(qc_path, 'r') as f:
+            qc = json.load(f)
+        has_chip_qc = True
+    elif os.path.exists(flagstat_path):
+        qc = read_flagstat(flagstat_path)
     else:
-        print(f"Warning: {filepath} not found")
+        print(f"Warning: neither {qc_path} nor {flagstat_path} found")
+        continue
+
+    total_reads, mapped_reads = qc['total_reads'], qc['mapped_reads']
+    mapping_pct = (mapped_reads / total_reads * 100) if total_reads > 0 else 0
+    row = {
+        'Sample': sample_name,
+        'Total Reads': f"{total_reads:,}",
+        'Mapped Reads': f"{mapped_reads:,}",
+        'Mapping Rate (%)': f"{mapping_pct:.2f}"
+    }
+    if 'nrf' in qc:
+        row.update({
+            'Dup. Rate (%)': fmt(qc['duplication_rate'] * 100, '.2f'),
+            'NRF': fmt(qc['nrf'], '.3f'),
+            'PBC1': fmt(qc['pbc1'], '.3f'),
+            'FRiP (%)': fmt(None if qc['frip'] is None else qc['frip'] * 100, '.2f'),
+            'Fragment (bp)': fmt(qc['fragment_length'], 'd'),
+            'NSC': fmt(qc['nsc'], '.2f'),
+            'RSC': fmt(qc['rsc'], '.2f'),
+        })
+    stats_data.append(row)
 
 # Create table
 stats_df = pd.DataFrame(stats_data)
@@ -71,35 +98,36 @@ fig, ax = plt.subplots(figsize=(10, 4))
 ax.axis('tight')
 ax.axis('off')
 
-table_data = []
-for _, row in stats_df.iterrows():
-    table_data.append([row['Sample'], row['Total Reads'], 
-                      row['Mapped Reads'], row['Mapping Rate (%)']])
+# Samples without chipseq.bam_qc output show '-' in the ChIP-specific columns
+stats_df = stats_df.fillna('-')
+columns = list(stats_df.columns)
+table_data = stats_df[columns].values.tolist()
+if has_chip_qc:
+    fig.set_size_inches(18, 4)
 
 table = ax.table(cellText=table_data,
-                colLabels=['Sample', 'Total Reads', 'Mapped Reads', 'Mapping Rate (%)'],
+                colLabels=columns,
                 cellLoc='center',
                 loc='center',
-                colWidths=[0.25, 0.25, 0.25, 0.25])
+                colWidths=[1 / len(columns)] * len(columns))
 
 table.auto_set_font_size(False)
 table.set_fontsize(10)
 table.scale(1, 2)
 
 # Style header
-for i in range(4):
+for i in range(len(columns)):
     table[(0, i)].set_facecolor('#4472C4')
     table[(0, i)].set_text_props(weight='bold', color='white')
 
 # Alternate row colors
 for i in range(1, len(table_data) + 1):
-    for j in range(4):
+    for j in range(len(columns)):
         if i % 2 == 0:
             table[(i, j)].set_facecolor('#D9E2F3')
 
 plt.title('Supplementary Table S2A - Alignment Statistics', 
           fontsize=14, fontweight='bold', pad=20)
-plt.savefig('results/supp_figure_S2A_table.png', dpi=300, bbox_inches='tight')
-plt.show()
+save_figure('results/supp_figure_S2A_table.png')
 
 print("\n✓ Saved table as 'results/supp_figure_S2A_table.png'")
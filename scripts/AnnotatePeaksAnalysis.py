@@ -1,14 +1,16 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+import glob
+from chipseq.cache import load_homer_annotation
+from chipseq.enrichment import run_enrichment
+from chipseq.runner import ANNOTATION, experiment_path
 
 print("="*80)
 print("PREPARING GENE LIST FOR ENRICHR - PROMOTER-BOUND GENES")
 print("="*80)
 
 # Load annotated peaks
-peaks = pd.read_csv('results/homer/annotations/annotated_peaks.txt', 
-                    sep='\t', comment='#')
+peaks = load_homer_annotation(experiment_path(ANNOTATION))
 
 print(f"\nTotal annotated peaks: {len(peaks):,}")
 
@@ -33,3 +35,14 @@ print(f"{'='*60}")
 output_file = 'results/genes_for_enrichr.txt'
 with open(output_file, 'w') as f:
     f.write('\n'.join(promoter_genes))
+
+# Local enrichment against any GMT libraries on disk (Hallmark, GO BP, KEGG, ...)
+gmt_files = sorted(glob.glob('refs/gmt/*.gmt'))
+if gmt_files:
+    tables = run_enrichment(promoter_genes, gmt_files, 'results/enrichment')
+    for name, table in tables.items():
+        n_sig = (table['Adjusted P-value'] < 0.05).sum()
+        print(f"{name}: {len(table):,} terms tested, {n_sig:,} with adjusted p < 0.05")
+    print("✓ Saved enrichment tables to 'results/enrichment/'")
+else:
+    print("No GMT libraries in 'refs/gmt/' - upload the gene list to Enrichr instead")
@@ -1,6 +1,9 @@
 import pandas as pd
+from chipseq.render import save_figure
 import matplotlib.pyplot as plt
 import numpy as np
+import os
+import textwrap
 
 # Data extracted from my ENRICHR files
 enrichment_data = {
@@ -74,6 +77,27 @@ enrichment_data = {
 # Create DataFrame
 df = pd.DataFrame(enrichment_data)
 
+# Prefer tables from the local enrichment engine (chipseq.enrichment) when present
+local_tables = {
+    'Hallmark': 'results/enrichment/MSigDB_Hallmark_2020_table.txt',
+    'GO Process': 'results/enrichment/GO_Biological_Process_2025_table.txt',
+    'KEGG': 'results/enrichment/KEGG_2021_Human_table.txt',
+}
+if all(os.path.exists(path) for path in local_tables.values()):
+    top_terms = []
+    for category, path in local_tables.items():
+        table = pd.read_csv(path, sep='\t').nsmallest(5, 'Adjusted P-value')
+        terms = table['Term'].str.replace(r'\s*\(GO:\d+\)$', '', regex=True)
+        top_terms.append(pd.DataFrame({
+            'Term': [textwrap.fill(t, 30) for t in terms],
+            'Category': category,
+            'Adjusted_P_value': table['Adjusted P-value'].to_numpy(),
+            # Terms fully covered by the gene list have an infinite odds ratio
+            'Combined_Score': table['Combined Score'].replace(np.inf, np.nan).to_numpy(),
+        }))
+    df = pd.concat(top_terms, ignore_index=True)
+    print("Using local enrichment tables from 'results/enrichment/'")
+
 # Create figure with two subplots
 fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 10))
 
@@ -142,8 +166,7 @@ fig.suptitle('Top Enriched Pathways in RUNX1 Promoter-Bound Genes',
              fontsize=16, fontweight='bold', y=0.995)
 
 plt.tight_layout(rect=[0, 0, 1, 0.96])
-plt.savefig('results/enrichment_top_pathways_figure.png', dpi=300, bbox_inches='tight')
-plt.show()
+save_figure('results/enrichment_top_pathways_figure.png')
 
 print("✓ Saved figure: results/enrichment_top_pathways_figure.png")
 
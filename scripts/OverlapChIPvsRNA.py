@@ -1,11 +1,16 @@
 ### Figure 2F
 import pandas as pd
 import numpy as np
+from chipseq.render import save_figure
 import matplotlib.pyplot as plt
 import seaborn as sns
+import os
+from chipseq.binding import DEFAULT_WINDOWS, GeneBindingIndex
+from chipseq.cache import load_homer_annotation, load_rnaseq
+from chipseq.runner import ANNOTATION, experiment_path
 
 # Load RNA-seq data
-rnaseq = pd.read_csv('results/GSE75070_MCF7_shRUNX1_shNS_RNAseq_log2_foldchange.txt', sep='\t')
+rnaseq = load_rnaseq('results/GSE75070_MCF7_shRUNX1_shNS_RNAseq_log2_foldchange.txt')
 rnaseq_clean = rnaseq.dropna(subset=['padj'])
 
 # Apply thresholds from paper
@@ -18,63 +23,37 @@ up_gene_set = set(up_genes['genename'])
 down_gene_set = set(down_genes['genename'])
 
 # Load annotated peaks
-peaks = pd.read_csv('results/homer/annotations/annotated_peaks.txt', 
-                    sep='\t', comment='#')
-
-# Check what column contains gene names
-#print("Peak annotation columns:")
-#print(peaks.columns.tolist())
-#print("\nFirst few rows:")
-#print(peaks.head())
-
-# Adjust this column name based on your actual file
-# Common HOMER column names: 'Gene Name', 'Nearest PromoterID', 'Gene Symbol'
-gene_col = 'Gene Name'  # CHANGE THIS if needed
-
-# Function to check if gene has peak within distance
-def genes_with_peaks_in_region(peaks_df, distance_col, max_distance):
-    """Get genes with peaks within specified distance from TSS"""
-    nearby_peaks = peaks_df[abs(peaks_df[distance_col]) <= max_distance]
-    return set(nearby_peaks[gene_col].dropna().unique())
-
-def genes_with_peaks_in_gene_body(peaks_df, max_distance=20000):
-    """Get genes with peaks within gene body +/- 20kb"""
-    # Peaks annotated as promoter, exon, intron, TTS, or within 20kb
-    gene_body_annotations = ['promoter', 'exon', 'intron', '5', '3', 'UTR']
-    gene_body_peaks = peaks_df[
-        (peaks_df['Annotation'].str.contains('|'.join(gene_body_annotations), case=False, na=False)) |
-        (abs(peaks_df['Distance to TSS']) <= max_distance)
-    ]
-    return set(gene_body_peaks[gene_col].dropna().unique())
-
-# Get genes with peaks near TSS (+/- 5kb)
-genes_peaks_tss = genes_with_peaks_in_region(peaks, 'Distance to TSS', 5000)
-
-# Get genes with peaks in gene body (+/- 20kb)
-genes_peaks_gene = genes_with_peaks_in_gene_body(peaks, 20000)
-
-# Calculate overlaps for each category
+peaks = load_homer_annotation(experiment_path(ANNOTATION))
+
+gene_col = 'Gene Name'
+
+# Encode genes once; bound/unbound counts for any window come from one index
+binding = GeneBindingIndex(peaks, gene_col=gene_col, genes=rnaseq_clean['genename'])
+groups = {'Up-regulated': up_gene_set, 'Down-regulated': down_gene_set}
+response = binding.response_table(groups, windows=[5000, 20000])
+
+def bound_count(group, mode, window):
+    row = response[(response['group'] == group) & (response['mode'] == mode) &
+                   (response['window'] == window)].iloc[0]
+    return row['bound'], row['not_bound']
+
 # TSS +/- 5kb
-up_tss_with = up_gene_set & genes_peaks_tss
-up_tss_without = up_gene_set - genes_peaks_tss
-down_tss_with = down_gene_set & genes_peaks_tss
-down_tss_without = down_gene_set - genes_peaks_tss
+up_tss_with, up_tss_without = bound_count('Up-regulated', 'tss', 5000)
+down_tss_with, down_tss_without = bound_count('Down-regulated', 'tss', 5000)
 
 # Gene body +/- 20kb
-up_gene_with = up_gene_set & genes_peaks_gene
-up_gene_without = up_gene_set - genes_peaks_gene
-down_gene_with = down_gene_set & genes_peaks_gene
-down_gene_without = down_gene_set - genes_peaks_gene
+up_gene_with, up_gene_without = bound_count('Up-regulated', 'gene_body', 20000)
+down_gene_with, down_gene_without = bound_count('Down-regulated', 'gene_body', 20000)
 
 # Print statistics
 print(f"\n========== Figure 2F Data ==========")
 print(f"\nTSS +/- 5kb:")
-print(f"  Up-regulated with RUNX1: {len(up_tss_with)}/{len(up_gene_set)} ({100*len(up_tss_with)/len(up_gene_set):.1f}%)")
-print(f"  Down-regulated with RUNX1: {len(down_tss_with)}/{len(down_gene_set)} ({100*len(down_tss_with)/len(down_gene_set):.1f}%)")
+print(f"  Up-regulated with RUNX1: {up_tss_with}/{len(up_gene_set)} ({100*up_tss_with/len(up_gene_set):.1f}%)")
+print(f"  Down-regulated with RUNX1: {down_tss_with}/{len(down_gene_set)} ({100*down_tss_with/len(down_gene_set):.1f}%)")
 
 print(f"\nGene body +/- 20kb:")
-print(f"  Up-regulated with RUNX1: {len(up_gene_with)}/{len(up_gene_set)} ({100*len(up_gene_with)/len(up_gene_set):.1f}%)")
-print(f"  Down-regulated with RUNX1: {len(down_gene_with)}/{len(down_gene_set)} ({100*len(down_gene_with)/len(down_gene_set):.1f}%)")
+print(f"  Up-regulated with RUNX1: {up_gene_with}/{len(up_gene_set)} ({100*up_gene_with/len(up_gene_set):.1f}%)")
+print(f"  Down-regulated with RUNX1: {down_gene_with}/{len(down_gene_set)} ({100*down_gene_with/len(down_gene_set):.1f}%)")
 
 # Create Figure 2F
 fig, ax = plt.subplots(figsize=(10, 7))
@@ -83,10 +62,10 @@ categories = ['Up-regulated\nTSS ±5kb', 'Down-regulated\nTSS ±5kb',
               'Up-regulated\nGene ±20kb', 'Down-regulated\nGene ±20kb']
 
 # Data for each bar
-bound_counts = [len(up_tss_with), len(down_tss_with), 
-                len(up_gene_with), len(down_gene_with)]
-not_bound_counts = [len(up_tss_without), len(down_tss_without),
-                    len(up_gene_without), len(down_gene_without)]
+bound_counts = [up_tss_with, down_tss_with, 
+                up_gene_with, down_gene_with]
+not_bound_counts = [up_tss_without, down_tss_without,
+                    up_gene_without, down_gene_without]
 totals = [len(up_gene_set), len(down_gene_set), 
           len(up_gene_set), len(down_gene_set)]
 
@@ -129,8 +108,7 @@ ax.yaxis.grid(True, linestyle='--', alpha=0.3)
 ax.set_axisbelow(True)
 
 plt.tight_layout()
-plt.savefig('results/figure_2F_accurate.png', dpi=300, bbox_inches='tight')
-plt.show()
+save_figure('results/figure_2F_accurate.png')
 
 # Summary table
 summary_data = {
@@ -143,3 +121,35 @@ summary_data = {
 summary_df = pd.DataFrame(summary_data)
 print("\n========== Summary Table ==========")
 print(summary_df.to_string(index=False))
+
+# Significance from the shuffle null (python -m chipseq.permutation ...)
+permutation_path = 'results/figure_2F_permutation.tsv'
+if os.path.exists(permutation_path):
+    print("\n========== Permutation Test (TSS window) ==========")
+    print(pd.read_csv(permutation_path, sep='\t').to_string(index=False))
+
+# Distance-response table: % bound across a sweep of windows, by mode and annotation class
+response_sweep = binding.response_table(groups, windows=DEFAULT_WINDOWS)
+class_sweep = binding.class_response_table(groups, windows=DEFAULT_WINDOWS)
+response_sweep.to_csv('results/figure_2F_distance_response.tsv', sep='\t', index=False)
+class_sweep.to_csv('results/figure_2F_distance_response_by_class.tsv', sep='\t', index=False)
+
+print("\n========== Distance Response (% bound) ==========")
+print(response_sweep.pivot_table(index='window', columns=['mode', 'group'],
+                                 values='pct_bound').round(1).to_string())
+
+fig, ax = plt.subplots(figsize=(8, 6))
+colors = {'Up-regulated': '#d62728', 'Down-regulated': '#1f77b4'}
+styles = {'tss': '-', 'gene_body': '--'}
+for (group, mode), sub in response_sweep.groupby(['group', 'mode']):
+    ax.plot(sub['window'] / 1000, sub['pct_bound'], styles[mode], marker='o',
+            color=colors[group], label=f"{group} ({mode.replace('_', ' ')})")
+ax.set_xscale('log')
+ax.set_xlabel('Window around TSS (kb)', fontsize=13, fontweight='bold')
+ax.set_ylabel('Percentage of Genes Bound', fontsize=13, fontweight='bold')
+ax.set_title('RUNX1 Binding vs. Distance Window', fontsize=14, fontweight='bold', pad=20)
+ax.legend(fontsize=10)
+ax.yaxis.grid(True, linestyle='--', alpha=0.3)
+
+plt.tight_layout()
+save_figure('results/figure_2F_distance_response.png')
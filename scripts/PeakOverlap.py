@@ -1,3 +1,13 @@
+import os
+import pandas as pd
+from chipseq.render import save_figure
+import matplotlib.pyplot as plt
+from matplotlib_venn import venn2
+from chipseq.overlap import stream_overlap_counts
+from chipseq.peak_reader import (ChromVocab, PeakSummary, iter_peak_batches, read_peak_array,
+                                 summarize_peaks)
+from chipseq.runner import REPRODUCIBLE_PEAKS, experiment_path
+
 print("\n" + "="*80)
 print("SUPPLEMENTARY FIGURE S2C - PEAK OVERLAP BETWEEN REPLICATES")
 print("="*80)
@@ -6,56 +16,28 @@ print("="*80)
 rep1_peaks_path = 'results/IP_rep1_peaks.bed'
 rep2_peaks_path = 'results/IP_rep2_peaks.bed'
 
+# Shared chromosome ids so peaks from both files can be compared directly
+chrom_vocab = ChromVocab()
+
 def read_peaks_bed(filepath):
-    """Read BED file and return list of peak regions"""
-    peaks = []
-    with open(filepath, 'r') as f:
-        for line in f:
-            if line.startswith('#') or line.strip() == '':
-                continue
-            parts = line.strip().split('\t')
-            if len(parts) >= 3:
-                chrom = parts[0]
-                start = int(parts[1])
-                end = int(parts[2])
-                peaks.append((chrom, start, end))
-    return peaks
-
-def peaks_overlap(peak1, peak2):
-    """Check if two peaks overlap (same chr and any bp overlap)"""
-    chr1, start1, end1 = peak1
-    chr2, start2, end2 = peak2
-    
-    if chr1 != chr2:
-        return False
-    
-    # Check for any overlap
-    return not (end1 <= start2 or end2 <= start1)
-
-def count_overlapping_peaks(peaks1, peaks2):
-    """Count how many peaks from peaks1 overlap with any peak in peaks2"""
-    overlapping = 0
-    for peak1 in peaks1:
-        for peak2 in peaks2:
-            if peaks_overlap(peak1, peak2):
-                overlapping += 1
-                break  # Count each peak1 only once
-    return overlapping
-
-# Read peaks
-rep1_peaks = read_peaks_bed(rep1_peaks_path)
+    """Read BED file into a compact record array of peak regions"""
+    return read_peak_array(filepath, vocab=chrom_vocab)
+
+# Keep the smaller replicate in memory and stream the larger one against it
 rep2_peaks = read_peaks_bed(rep2_peaks_path)
+# Replicate 1's summary is accumulated in the same pass over its batches
+rep1_stats = PeakSummary()
+n_rep1, rep1_overlap_rep2, rep2_overlap_rep1 = stream_overlap_counts(
+    rep1_stats.passing(iter_peak_batches(rep1_peaks_path, vocab=chrom_vocab)), rep2_peaks)
+rep1_summary = rep1_stats.result()
+rep2_summary = summarize_peaks([rep2_peaks])
 
 print(f"\nPeak counts:")
-print(f"  IP Replicate 1: {len(rep1_peaks):,} peaks")
-print(f"  IP Replicate 2: {len(rep2_peaks):,} peaks")
-
-# Calculate overlaps (peaks that have any bp overlap)
-rep1_overlap_rep2 = count_overlapping_peaks(rep1_peaks, rep2_peaks)
-rep2_overlap_rep1 = count_overlapping_peaks(rep2_peaks, rep1_peaks)
+print(f"  IP Replicate 1: {n_rep1:,} peaks (mean width {rep1_summary['mean_width']:.0f} bp)")
+print(f"  IP Replicate 2: {len(rep2_peaks):,} peaks (mean width {rep2_summary['mean_width']:.0f} bp)")
 
 # For Venn diagram, use the counts
-rep1_only = len(rep1_peaks) - rep1_overlap_rep2
+rep1_only = n_rep1 - rep1_overlap_rep2
 rep2_only = len(rep2_peaks) - rep2_overlap_rep1
 both = rep1_overlap_rep2  # Use rep1's overlapping count
 
@@ -66,7 +48,7 @@ print(f"  Replicate 1 only (no overlap): {rep1_only:,}")
 print(f"  Replicate 2 only (no overlap): {rep2_only:,}")
 
 # Calculate overlap percentage
-overlap_pct_rep1 = (rep1_overlap_rep2 / len(rep1_peaks) * 100) if len(rep1_peaks) > 0 else 0
+overlap_pct_rep1 = (rep1_overlap_rep2 / n_rep1 * 100) if n_rep1 > 0 else 0
 overlap_pct_rep2 = (rep2_overlap_rep1 / len(rep2_peaks) * 100) if len(rep2_peaks) > 0 else 0
 
 print(f"\nOverlap percentages:")
@@ -101,7 +83,7 @@ plt.title('Peak Overlap Between Replicates (Supplementary Figure S2C)',
 # Add statistics text box
 stats_text = f"""
 Total peaks:
-  Rep1: {len(rep1_peaks):,}
+  Rep1: {n_rep1:,}
   Rep2: {len(rep2_peaks):,}
 
 Overlapping:
@@ -114,19 +96,18 @@ plt.text(0.02, 0.02, stats_text, transform=ax.transAxes,
          bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8))
 
 plt.tight_layout()
-plt.savefig('results/supp_figure_S2C_venn.png', dpi=300, bbox_inches='tight')
-plt.show()
+save_figure('results/supp_figure_S2C_venn.png')
 
 print("\n✓ Saved Venn diagram as 'results/supp_figure_S2C_venn.png'")
 
 # Compare with reproducible peaks
-reproducible_peaks_path = 'results/peaks/reproducible_peaks.bed'
+reproducible_peaks_path = experiment_path(REPRODUCIBLE_PEAKS)
 if os.path.exists(reproducible_peaks_path):
     reproducible_peaks = read_peaks_bed(reproducible_peaks_path)
     print(f"\nReproducible peaks (after bedtools intersect): {len(reproducible_peaks):,}")
     
     # Percentage relative to smaller set
-    smaller_set = min(len(rep1_peaks), len(rep2_peaks))
+    smaller_set = min(n_rep1, len(rep2_peaks))
     print(f"This represents {len(reproducible_peaks)/smaller_set*100:.1f}% of the smaller replicate")
     
     # Percentage relative to overlapping peaks
@@ -153,7 +134,7 @@ summary_data = {
         'Rep2 overlap %'
     ],
     'Value': [
-        f"{len(rep1_peaks):,}",
+        f"{n_rep1:,}",
         f"{len(rep2_peaks):,}",
         f"{rep1_overlap_rep2:,}",
         f"{rep2_overlap_rep1:,}",
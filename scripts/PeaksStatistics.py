@@ -1,12 +1,16 @@
-import pandas as pd
 import numpy as np
+from chipseq.cache import load_homer_annotation, load_rnaseq
+from chipseq.interval_index import IntervalIndex
+from chipseq.runner import ANNOTATION, experiment_path
 
 # Load data
-rnaseq = pd.read_csv('results/GSE75070_MCF7_shRUNX1_shNS_RNAseq_log2_foldchange.txt', sep='\t')
+rnaseq = load_rnaseq('results/GSE75070_MCF7_shRUNX1_shNS_RNAseq_log2_foldchange.txt')
 rnaseq_clean = rnaseq.dropna(subset=['padj']).copy()  # Use .copy() to avoid warning
 
-peaks = pd.read_csv('results/homer/annotations/annotated_peaks.txt', 
-                    sep='\t', comment='#')
+peaks = load_homer_annotation(experiment_path(ANNOTATION))
+
+# Region index over all peaks, for neighbourhood queries around candidates
+peak_index = IntervalIndex(peaks['Chr'], peaks['Start'], peaks['End'])
 
 print("PEAKS STATISTICS")
 print("="*80)
@@ -71,6 +75,11 @@ if len(overlap) > 0:
     if len(down_candidates) == 0:
         print("No down-regulated candidates found. Showing all candidates:")
         down_candidates = overlap_sorted.head(10)
+
+    # Input for batch locus plots (python -m chipseq.locus --candidates ...)
+    candidate_cols = ['Gene Name Clean', 'Chr', 'Start', 'End', 'Peak Score', 'Distance to TSS',
+                      'log2FoldChange', 'padj']
+    down_candidates[candidate_cols].to_csv('results/down_candidates.tsv', sep='\t', index=False)
     
     for i, (idx, row) in enumerate(down_candidates.iterrows(), 1):
         print(f"\n{i}. Gene: {row['Gene Name Clean']}")
@@ -80,6 +89,8 @@ if len(overlap) > 0:
         print(f"   log2 Fold Change: {row['log2FoldChange']:.2f}")
         print(f"   Adjusted p-value: {row['padj']:.2e}")
         print(f"   Annotation: {row['Annotation']}")
+        nearby = peak_index.window(row['Chr'], (row['Start'] + row['End']) // 2, 10000)
+        print(f"   Peaks within 10kb: {len(nearby)}")
         if 'Gene Description' in row:
             desc = row['Gene Description']
             if isinstance(desc, str) and len(desc) > 0:
@@ -113,6 +124,8 @@ for gene in paper_genes:
         print(f"  Peak Score: {best_peak['Peak Score']:.2f}")
         print(f"  Distance to TSS: {best_peak['Distance to TSS']:,} bp")
         print(f"  Annotation: {best_peak['Annotation']}")
+        nearby = peak_index.window(best_peak['Chr'], (best_peak['Start'] + best_peak['End']) // 2, 10000)
+        print(f"  Peaks within 10kb: {len(nearby)}")
     else:
         print(f"  ✗ No peaks found")
     
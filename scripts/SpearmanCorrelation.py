@@ -1,3 +1,8 @@
+import os
+import pandas as pd
+import numpy as np
+from chipseq.render import show_image
+
 print("\n" + "="*80)
 print("SUPPLEMENTARY FIGURE S2B - CORRELATION ANALYSIS")
 print("="*80)
@@ -5,6 +10,8 @@ print("="*80)
 # Your correlation plot is already generated at:
 correlation_plot_path = 'results/correlation_heatmap.png'
 correlation_matrix_path = 'results/correlation_matrix.tab'
+# Written by chipseq.correlation --bootstrap
+bootstrap_path = 'results/correlation_matrix_bootstrap.tsv'
 
 if os.path.exists(correlation_matrix_path):
     # Read the correlation matrix
@@ -12,6 +19,11 @@ if os.path.exists(correlation_matrix_path):
     
     print("\nYour Spearman Correlation Matrix:")
     print(corr_matrix.round(3))
+
+    if os.path.exists(bootstrap_path):
+        intervals = pd.read_csv(bootstrap_path, sep='\t')
+        print("\nBootstrap confidence intervals:")
+        print(intervals.round(3).to_string(index=False))
     
     # Calculate average correlations
     print("\n" + "="*80)
@@ -63,9 +75,8 @@ Paper's findings (Supplementary Figure S2B):
     
     # Display your plot
     if os.path.exists(correlation_plot_path):
-        from IPython.display import Image, display
         print("\nYour Correlation Heatmap:")
-        display(Image(correlation_plot_path))
+        show_image(correlation_plot_path)
     
 else:
     print(f"Warning: Correlation matrix not found at {correlation_matrix_path}")
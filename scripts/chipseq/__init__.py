@@ -0,0 +1 @@
+"""Shared peak-analysis helpers used by the scripts in scripts/"""
@@ -0,0 +1,306 @@
+"""In-process replacement for HOMER annotatePeaks.pl with a GTF.
+
+The GTF is reduced once to two tables that are kept in the reference asset
+store (``chipseq.assets``): transcripts sorted by TSS on a global coordinate
+axis (``code * CHROM_STRIDE + position``), and one interval table holding
+every promoter, TTS, UTR, exon and intron window with the transcript it
+belongs to.  A run over any number of peaks is then a handful of
+``searchsorted`` calls: one for the nearest TSS and one stabbing query per
+feature class.
+
+Coordinates and rules follow HOMER: peaks are placed at their center in
+1-based coordinates, distances are signed relative to the transcript
+strand, promoters span -1 kb to +100 bp of a TSS and TTS windows -100 bp to
++1 kb of a transcript end.  A peak takes the first class that contains it,
+in ``CLASSES`` order, otherwise it is Intergenic.  UTR labels refine exons,
+so they are checked before exons.  The output has the column layout of
+``annotated_peaks.txt``; columns HOMER fills from its own gene database
+(RefSeq, aliases, descriptions) are left empty.
+
+Usage:
+    python -m chipseq.annotate --peaks filtered_peaks.bed \\
+        --gtf gencode.v45.primary_assembly.annotation.gtf -o annotated_peaks.txt
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from chipseq.assets import AssetStore, annotation_tables
+from chipseq.cache import load_gtf
+from chipseq.overlap import CHROM_STRIDE
+
+INDEX_VERSION = 1
+
+PROMOTER_WINDOW = (-1000, 100)
+TTS_WINDOW = (-100, 1000)
+
+# Feature classes in priority order
+CLASSES = ['promoter-TSS', 'TTS', "5' UTR", "3' UTR", 'exon', 'intron']
+
+ANNOTATION_COLUMNS = ['Chr', 'Start', 'End', 'Strand', 'Peak Score', 'Focus Ratio/Region Size',
+                      'Annotation', 'Detailed Annotation', 'Distance to TSS', 'Nearest PromoterID',
+                      'Entrez ID', 'Nearest Unigene', 'Nearest Refseq', 'Nearest Ensembl',
+                      'Gene Name', 'Gene Alias', 'Gene Description', 'Gene Type']
+
+
+def _transcripts(records):
+    """Transcript records with 1-based TSS/TTS, ordered by chromosome and TSS"""
+    tx = records[records['feature'] == 'transcript']
+    plus = np.asarray(tx['strand'], dtype=object) == '+'
+    start0 = tx['start'].to_numpy(np.int64)
+    end = tx['end'].to_numpy(np.int64)
+    table = pd.DataFrame({
+        'chrom': np.asarray(tx['chrom'], dtype=object),
+        'strand': np.where(plus, 1, -1).astype(np.int8),
+        'tss': np.where(plus, start0 + 1, end),
+        'tts': np.where(plus, end, start0 + 1),
+        'transcript_id': np.asarray(tx['transcript_id'], dtype=object),
+        'gene_id': np.asarray(tx['gene_id'], dtype=object),
+        'gene_name': np.asarray(tx['gene_name'], dtype=object),
+        'gene_type': np.asarray(tx['gene_type'], dtype=object),
+    })
+    return table.sort_values(['chrom', 'tss'], kind='stable', ignore_index=True)
+
+
+def _chrom_codes(chroms, names):
+    """Position of each chromosome in the sorted ``names``; -1 if absent"""
+    chroms = np.asarray(chroms, dtype=object)
+    codes = np.searchsorted(names, chroms).astype(np.int64)
+    codes[codes == len(names)] = 0
+    found = names[codes] == chroms if len(names) else np.zeros(len(chroms), dtype=bool)
+    return np.where(found, codes, -1)
+
+
+def build_transcript_table(gtf_path):
+    return _transcripts(load_gtf(gtf_path))
+
+
+def build_feature_table(gtf_path):
+    """Promoter, TTS, UTR, exon and intron windows as half-open 1-based global intervals"""
+    records = load_gtf(gtf_path)
+    tx = _transcripts(records)
+    names = np.unique(np.asarray(tx['chrom'], dtype=object))
+    offset = _chrom_codes(tx['chrom'], names) * CHROM_STRIDE
+    strand, tss, tts = tx['strand'].to_numpy(), tx['tss'].to_numpy(), tx['tts'].to_numpy()
+    rows = np.arange(len(tx))
+    parts = []
+
+    def add(cls, starts, ends, tx_rows, number=None, total=None):
+        zeros = np.zeros(len(starts), dtype=np.int32)
+        parts.append(pd.DataFrame({
+            'class': np.full(len(starts), CLASSES.index(cls), dtype=np.int8),
+            'start': starts, 'end': ends, 'transcript': tx_rows.astype(np.int32),
+            'number': zeros if number is None else number.astype(np.int32),
+            'total': zeros if total is None else total.astype(np.int32),
+        }))
+
+    # Windows relative to the transcript direction, mirrored on the minus strand
+    for cls, anchor, (lo, hi) in [('promoter-TSS', tss, PROMOTER_WINDOW), ('TTS', tts, TTS_WINDOW)]:
+        left = np.where(strand > 0, anchor + lo, anchor - hi)
+        right = np.where(strand > 0, anchor + hi, anchor - lo)
+        add(cls, offset + left, offset + right + 1, rows)
+
+    tx_index = pd.Index(tx['transcript_id'])
+    exons = records[records['feature'] == 'exon']
+    ex_tx = tx_index.get_indexer(np.asarray(exons['transcript_id'], dtype=object))
+    keep = ex_tx >= 0
+    ex_tx = ex_tx[keep]
+    ex_start = exons['start'].to_numpy(np.int64)[keep] + 1
+    ex_end = exons['end'].to_numpy(np.int64)[keep] + 1
+    order = np.lexsort((ex_start, ex_tx))
+    ex_tx, ex_start, ex_end = ex_tx[order], ex_start[order], ex_end[order]
+    first = np.searchsorted(ex_tx, ex_tx, side='left')
+    total = np.searchsorted(ex_tx, ex_tx, side='right') - first
+    ascending = np.arange(len(ex_tx)) - first + 1
+    ex_strand = strand[ex_tx]
+    # Exons and introns are numbered in transcript order
+    number = np.where(ex_strand > 0, ascending, total - ascending + 1)
+    add('exon', offset[ex_tx] + ex_start, offset[ex_tx] + ex_end, ex_tx, number, total)
+
+    same = ex_tx[1:] == ex_tx[:-1]
+    intron_tx = ex_tx[1:][same]
+    intron_number = np.where(ex_strand[1:] > 0, ascending[:-1], total[:-1] - ascending[:-1])[same]
+    add('intron', offset[intron_tx] + ex_end[:-1][same], offset[intron_tx] + ex_start[1:][same],
+        intron_tx, intron_number, total[1:][same] - 1)
+
+    utrs = records[records['feature'].isin(['UTR', 'five_prime_utr', 'three_prime_utr'])]
+    utr_tx = tx_index.get_indexer(np.asarray(utrs['transcript_id'], dtype=object))
+    feature = np.asarray(utrs['feature'], dtype=object)
+    utr_start = utrs['start'].to_numpy(np.int64)
+    utr_end = utrs['end'].to_numpy(np.int64)
+    # GENCODE only says 'UTR'; the side of the start codon decides 5' or 3'
+    codons = records[records['feature'] == 'start_codon']
+    codon_tx = tx_index.get_indexer(np.asarray(codons['transcript_id'], dtype=object))
+    codon_ok = codon_tx >= 0
+    cds_start = np.full(len(tx), np.iinfo(np.int64).max)
+    cds_end = np.full(len(tx), -1, dtype=np.int64)
+    np.minimum.at(cds_start, codon_tx[codon_ok], codons['start'].to_numpy(np.int64)[codon_ok])
+    np.maximum.at(cds_end, codon_tx[codon_ok], codons['end'].to_numpy(np.int64)[codon_ok])
+    safe_tx = np.maximum(utr_tx, 0)
+    has_codon = (utr_tx >= 0) & (cds_end[safe_tx] >= 0)
+    upstream = np.where(strand[safe_tx] > 0, utr_end <= cds_start[safe_tx],
+                        utr_start >= cds_end[safe_tx])
+    five = (feature == 'five_prime_utr') | ((feature == 'UTR') & has_codon & upstream)
+    three = (feature == 'three_prime_utr') | ((feature == 'UTR') & has_codon & ~upstream)
+    for cls, mask in [("5' UTR", five), ("3' UTR", three)]:
+        mask &= utr_tx >= 0
+        add(cls, offset[utr_tx[mask]] + utr_start[mask] + 1, offset[utr_tx[mask]] + utr_end[mask] + 1,
+            utr_tx[mask])
+
+    features = pd.concat(parts, ignore_index=True)
+    return features.sort_values(['class', 'start'], kind='stable', ignore_index=True)
+
+
+class AnnotationIndex:
+    """Nearest-TSS and feature-class lookups over one GTF"""
+
+    def __init__(self, transcripts, features):
+        self.transcripts = transcripts
+        self.chrom_names = np.unique(np.asarray(transcripts['chrom'], dtype=object))
+        codes = _chrom_codes(transcripts['chrom'], self.chrom_names)
+        self.strand = transcripts['strand'].to_numpy()
+        self.tss = transcripts['tss'].to_numpy(np.int64)
+        self.global_tss = codes * CHROM_STRIDE + self.tss
+
+        classes = features['class'].to_numpy()
+        self.class_bounds = np.searchsorted(classes, np.arange(len(CLASSES) + 1))
+        self.feature_starts = features['start'].to_numpy(np.int64)
+        self.feature_ends = features['end'].to_numpy(np.int64)
+        self.feature_tx = features['transcript'].to_numpy()
+        self.feature_number = features['number'].to_numpy()
+        self.feature_total = features['total'].to_numpy()
+
+    @classmethod
+    def from_gtf(cls, gtf_path, asset_dir=None):
+        """Index tables built once per GTF content and memory-mapped afterwards"""
+        return cls(*annotation_tables(gtf_path, AssetStore(asset_dir)))
+
+    def nearest_tss(self, positions):
+        """Row of the nearest transcript TSS to each global position, -1 if none on that chromosome"""
+        right = np.searchsorted(self.global_tss, positions)
+        left = right - 1
+        gaps = np.full((2, len(positions)), np.iinfo(np.int64).max)
+        ok_left = left >= 0
+        ok_right = right < len(self.global_tss)
+        gaps[0, ok_left] = positions[ok_left] - self.global_tss[left[ok_left]]
+        gaps[1, ok_right] = self.global_tss[right[ok_right]] - positions[ok_right]
+        # Positions on different chromosomes are at least CHROM_STRIDE / 2 apart
+        gaps[gaps >= CHROM_STRIDE // 2] = np.iinfo(np.int64).max
+        rows = np.where(gaps[1] < gaps[0], right, left)
+        rows[np.minimum(gaps[0], gaps[1]) == np.iinfo(np.int64).max] = -1
+        return rows
+
+    def containing(self, cls, positions):
+        """Row of a ``cls`` feature containing each global position, -1 if none"""
+        lo, hi = self.class_bounds[cls], self.class_bounds[cls + 1]
+        starts, ends = self.feature_starts[lo:hi], self.feature_ends[lo:hi]
+        if len(starts) == 0:
+            return np.full(len(positions), -1)
+        # The feature reaching furthest right among those starting at or before
+        # a position covers it whenever any of them does
+        reach = np.maximum.accumulate(ends)
+        holder = np.maximum.accumulate(np.where(ends == reach, np.arange(len(ends)), 0))
+        last = np.searchsorted(starts, positions, side='right') - 1
+        safe = np.maximum(last, 0)
+        hit = (last >= 0) & (reach[safe] > positions)
+        return np.where(hit, lo + holder[safe], -1)
+
+    def annotate(self, chroms, starts, ends):
+        """HOMER-style annotation columns for 1-based peak coordinates"""
+        codes = _chrom_codes(chroms, self.chrom_names)
+        centers = (np.asarray(starts, dtype=np.int64) + np.asarray(ends, dtype=np.int64)) // 2
+        positions = np.where(codes >= 0, codes * CHROM_STRIDE + centers, -CHROM_STRIDE)
+
+        nearest = np.where(codes >= 0, self.nearest_tss(positions), -1)
+        feature = np.full(len(positions), -1)
+        feature_class = np.full(len(positions), -1)
+        for cls in range(len(CLASSES)):
+            todo = np.flatnonzero((feature < 0) & (codes >= 0))
+            found = self.containing(cls, positions[todo])
+            feature[todo] = found
+            feature_class[todo[found >= 0]] = cls
+
+        tx = self.transcripts
+        genic = feature >= 0
+        f_tx = self.feature_tx[np.maximum(feature, 0)]
+        label = np.asarray(CLASSES, dtype=object)[np.maximum(feature_class, 0)]
+        tx_id = np.asarray(tx['transcript_id'], dtype=object)
+        detail = pd.Series(tx_id[f_tx])
+        numbered = np.isin(feature_class, [CLASSES.index('exon'), CLASSES.index('intron')])
+        counts = (', ' + pd.Series(label).str.split(' ').str[0] + ' ' +
+                  pd.Series(self.feature_number[np.maximum(feature, 0)]).astype(str) + ' of ' +
+                  pd.Series(self.feature_total[np.maximum(feature, 0)]).astype(str))
+        detail = detail + counts.where(numbered, '')
+        annotation = (pd.Series(label) + ' (' + detail + ')').where(genic, 'Intergenic')
+        gene_type = pd.Series(np.asarray(tx['gene_type'], dtype=object)[f_tx]).fillna('')
+        detailed = (gene_type + '-' + annotation).where(genic, 'Intergenic')
+
+        has_tss = nearest >= 0
+        n_tx = np.maximum(nearest, 0)
+        distance = np.where(self.strand[n_tx] > 0, centers - self.tss[n_tx], self.tss[n_tx] - centers)
+
+        def nearest_column(values):
+            return pd.Series(np.asarray(values, dtype=object)[n_tx]).where(has_tss, '')
+
+        nearest_id = nearest_column(tx_id)
+        return pd.DataFrame({
+            'Annotation': annotation.where(codes >= 0, 'NA'),
+            'Detailed Annotation': detailed.where(codes >= 0, 'NA'),
+            'Distance to TSS': pd.Series(distance, dtype='Int64').where(has_tss),
+            'Nearest PromoterID': nearest_id,
+            'Entrez ID': nearest_column(tx['gene_id']).str.split('.').str[0],
+            'Nearest Unigene': nearest_id.str.split('.').str[0],
+            'Nearest Refseq': '',
+            'Nearest Ensembl': '',
+            'Gene Name': nearest_column(tx['gene_name']),
+            'Gene Alias': '',
+            'Gene Description': '',
+            'Gene Type': nearest_column(tx['gene_type']),
+        })
+
+
+def read_peaks(filepath):
+    """BED peaks as a table with HOMER's 1-based starts, ids, strands and scores"""
+    try:
+        bed = pd.read_csv(filepath, sep='\t', comment='#', header=None, dtype=str)
+    except pd.errors.EmptyDataError:
+        bed = pd.DataFrame(columns=[0, 1, 2])
+    n = len(bed)
+    return pd.DataFrame({
+        'PeakID': bed[3] if 3 in bed.columns else pd.Series(
+            [f"{c}-{i + 1}" for i, c in enumerate(bed[0])], dtype=object),
+        'Chr': bed[0],
+        'Start': bed[1].astype(np.int64) + 1,
+        'End': bed[2].astype(np.int64),
+        'Strand': bed[5] if 5 in bed.columns else pd.Series(['+'] * n, dtype=object),
+        'Peak Score': pd.to_numeric(bed[4], errors='coerce') if 4 in bed.columns else 0,
+        'Focus Ratio/Region Size': 'NA',
+    })
+
+
+def annotate_peaks(peaks_path, gtf_path, asset_dir=None):
+    """annotated_peaks.txt-style table for a BED of peaks"""
+    peaks = read_peaks(peaks_path)
+    index = AnnotationIndex.from_gtf(gtf_path, asset_dir)
+    columns = index.annotate(peaks['Chr'], peaks['Start'], peaks['End'])
+    return pd.concat([peaks.reset_index(drop=True), columns], axis=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Nearest-TSS peak annotation from a GTF")
+    parser.add_argument('--peaks', required=True, help="BED of peaks")
+    parser.add_argument('--gtf', required=True)
+    parser.add_argument('-o', '--output', default='annotated_peaks.txt')
+    args = parser.parse_args(argv)
+
+    table = annotate_peaks(args.peaks, args.gtf)
+    id_column = f"PeakID (cmd=chipseq.annotate {args.peaks} -gtf {args.gtf})"
+    table = table.rename(columns={'PeakID': id_column})[[id_column] + ANNOTATION_COLUMNS]
+    table.to_csv(args.output, sep='\t', index=False, na_rep='NA')
+    counts = table['Annotation'].str.replace(r' \(.*', '', regex=True).value_counts()
+    print(f"Annotated {len(table):,} peaks: " + ', '.join(f"{k} {v:,}" for k, v in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
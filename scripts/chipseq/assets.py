@@ -0,0 +1,228 @@
+"""Content-addressed store for artifacts derived from reference files.
+
+Each artifact is keyed on the content hash of the file it is built from, so
+a genome, GTF or blacklist that has been seen before (by any run, in any
+project sharing the store) is never processed again, whatever its path.
+Entries live in ``<store>/<kind>/<digest>/`` with a ``manifest.json``
+naming the source; they are built in a temporary directory and renamed into
+place, so concurrent builders are safe and a crashed build leaves nothing
+behind.
+
+Hashing a multi-GB FASTA takes seconds, so digests are remembered per
+(real path, size, mtime) in ``<store>/digests.json``.
+
+Kinds built here are the chromosome sizes of a FASTA, the blacklist as a
+``PEAK_DTYPE`` array and the ``chipseq.annotate`` GTF index; ``chipseq.fasta``
+stores the faidx index of FASTAs that have no ``.fai`` beside them.  The pipeline
+stores its bowtie2 index under ``<store>/bowtie2_index/<digest>`` through
+Nextflow ``storeDir``, using the digest printed by ``digest``.
+
+The store defaults to ``<cache dir>/assets`` and can be moved with the
+``CHIPSEQ_ASSET_DIR`` environment variable.
+
+Usage:
+    python -m chipseq.assets digest refs/GRCh38.primary_assembly.genome.fa
+    python -m chipseq.assets build --genome refs/GRCh38.primary_assembly.genome.fa \\
+        --gtf refs/gencode.v45.primary_assembly.annotation.gtf --blacklist refs/hg38-blacklist.v2.bed
+    python -m chipseq.assets list
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from chipseq.cache import compact_strings, default_cache_dir, file_digest, read_entry, write_entry
+from chipseq.peak_reader import ChromVocab, read_peak_array
+
+# Bump a kind's version when its builder changes so old entries are not reused
+KINDS = {
+    'chrom_sizes': 'chrom_sizes-v1',
+    'blacklist': 'blacklist-v1',
+    'annotation': 'annotation-v1',
+    'faidx': 'faidx-v1',
+}
+
+
+def default_asset_dir():
+    return os.environ.get('CHIPSEQ_ASSET_DIR', os.path.join(default_cache_dir(), 'assets'))
+
+
+class AssetStore:
+    """Directory of built artifacts keyed on (kind, source content digest)"""
+
+    def __init__(self, root=None):
+        self.root = root or default_asset_dir()
+        self._digests_path = os.path.join(self.root, 'digests.json')
+
+    def _read_digests(self):
+        if not os.path.exists(self._digests_path):
+            return {}
+        try:
+            with open(self._digests_path) as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def digest(self, source):
+        """Content digest of a file, remembered while its size and mtime are unchanged"""
+        real = os.path.realpath(source)
+        stat = os.stat(real)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        digests = self._read_digests()
+        known = digests.get(real)
+        if known and known['stamp'] == stamp:
+            return known['digest']
+        digest = file_digest(real)
+        digests[real] = {'stamp': stamp, 'digest': digest}
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.digests-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(digests, f, indent=1)
+        os.replace(tmp_path, self._digests_path)
+        return digest
+
+    def path(self, kind, source):
+        return os.path.join(self.root, KINDS[kind], self.digest(source))
+
+    def get(self, kind, source, build):
+        """Entry directory for ``source``, running ``build(source, directory)`` on a miss"""
+        entry_dir = self.path(kind, source)
+        if os.path.exists(os.path.join(entry_dir, 'manifest.json')):
+            return entry_dir
+        parent = os.path.dirname(entry_dir)
+        os.makedirs(parent, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+        try:
+            build(source, tmp_dir)
+            with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+                json.dump({'kind': kind, 'source': os.path.basename(source),
+                           'size': os.path.getsize(source), 'built': time.strftime('%Y-%m-%d %H:%M:%S')},
+                          f, indent=2)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another process finished the same entry first
+            if not os.path.exists(os.path.join(entry_dir, 'manifest.json')):
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return entry_dir
+
+    def entries(self):
+        """(kind, digest, manifest) for every entry"""
+        found = []
+        if not os.path.isdir(self.root):
+            return found
+        for kind in sorted(os.listdir(self.root)):
+            kind_dir = os.path.join(self.root, kind)
+            if not os.path.isdir(kind_dir):
+                continue
+            for digest in sorted(os.listdir(kind_dir)):
+                if digest.startswith('.'):
+                    continue
+                # Entries written by Nextflow storeDir have no manifest
+                manifest = os.path.join(kind_dir, digest, 'manifest.json')
+                if os.path.exists(manifest):
+                    with open(manifest) as f:
+                        found.append((kind, digest, json.load(f)))
+                else:
+                    found.append((kind, digest, {}))
+        return found
+
+
+def _build_chrom_sizes(fasta, outdir):
+    """Sequence lengths from the samtools .fai when present, else by scanning the FASTA"""
+    sizes = []
+    if os.path.exists(fasta + '.fai'):
+        with open(fasta + '.fai') as f:
+            sizes = [(line.split('\t')[0], int(line.split('\t')[1])) for line in f if line.strip()]
+    else:
+        opener = gzip.open if fasta.endswith('.gz') else open
+        name, length = None, 0
+        with opener(fasta, 'rb') as f:
+            for line in f:
+                if line.startswith(b'>'):
+                    if name is not None:
+                        sizes.append((name, length))
+                    name, length = line[1:].split()[0].decode(), 0
+                else:
+                    length += len(line.rstrip())
+        if name is not None:
+            sizes.append((name, length))
+    with open(os.path.join(outdir, 'chrom.sizes'), 'w') as f:
+        f.writelines(f"{name}\t{length}\n" for name, length in sizes)
+
+
+def _build_blacklist(bed, outdir):
+    vocab = ChromVocab()
+    intervals = read_peak_array(bed, vocab=vocab, layout='bed')
+    np.save(os.path.join(outdir, 'intervals.npy'), intervals)
+    with open(os.path.join(outdir, 'chroms.json'), 'w') as f:
+        json.dump(vocab.names, f)
+
+
+def _build_annotation(gtf, outdir):
+    from chipseq.annotate import build_feature_table, build_transcript_table
+    write_entry(compact_strings(build_transcript_table(gtf)), os.path.join(outdir, 'transcripts'))
+    write_entry(compact_strings(build_feature_table(gtf)), os.path.join(outdir, 'features'))
+
+
+def chrom_sizes_path(fasta, store=None):
+    """Path of a ``chrom.sizes`` file for the FASTA"""
+    store = store or AssetStore()
+    return os.path.join(store.get('chrom_sizes', fasta, _build_chrom_sizes), 'chrom.sizes')
+
+
+def load_blacklist(bed, vocab, store=None):
+    """Blacklist intervals as a ``PEAK_DTYPE`` array with chromosome ids from ``vocab``"""
+    store = store or AssetStore()
+    entry_dir = store.get('blacklist', bed, _build_blacklist)
+    intervals = np.load(os.path.join(entry_dir, 'intervals.npy'))
+    with open(os.path.join(entry_dir, 'chroms.json')) as f:
+        names = json.load(f)
+    if len(names):
+        intervals['chrom'] = vocab.encode(names)[intervals['chrom']]
+    return intervals
+
+
+def annotation_tables(gtf, store=None):
+    """(transcripts, features) tables of the ``chipseq.annotate`` index, memory-mapped"""
+    store = store or AssetStore()
+    entry_dir = store.get('annotation', gtf, _build_annotation)
+    return read_entry(os.path.join(entry_dir, 'transcripts')), read_entry(os.path.join(entry_dir, 'features'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Content-addressed reference asset store")
+    parser.add_argument('--store', help="Store directory (default: $CHIPSEQ_ASSET_DIR or <cache>/assets)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    digest_parser = sub.add_parser('digest', help="Print the content digest of a file")
+    digest_parser.add_argument('file')
+    build_parser = sub.add_parser('build', help="Build the assets of the given references")
+    build_parser.add_argument('--genome', help="FASTA: chromosome sizes")
+    build_parser.add_argument('--gtf', help="GTF: annotation index")
+    build_parser.add_argument('--blacklist', help="BED: blacklist intervals")
+    sub.add_parser('list', help="List stored assets")
+    args = parser.parse_args(argv)
+
+    store = AssetStore(args.store)
+    if args.command == 'digest':
+        print(store.digest(args.file))
+    elif args.command == 'build':
+        if args.genome:
+            print(chrom_sizes_path(args.genome, store))
+        if args.gtf:
+            print(store.get('annotation', args.gtf, _build_annotation))
+        if args.blacklist:
+            print(store.get('blacklist', args.blacklist, _build_blacklist))
+    else:
+        for kind, digest, manifest in store.entries():
+            print(f"{kind}\t{digest}\t{manifest.get('source', '')}\t{manifest.get('built', '')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""Single-pass ChIP-seq QC over a coordinate-sorted BAM.
+
+One streaming pass collects everything SAMTOOLS_FLAGSTAT reported plus the
+ChIP-specific metrics, holding only one chromosome of read positions at a
+time:
+
+* flagstat counts: total, secondary, supplementary, duplicates, mapped
+* duplication rate and library complexity (NRF, PBC1, PBC2) from read
+  5' positions
+* FRiP against a peak BED (reads overlapping any peak)
+* strand cross-correlation (NSC, RSC, estimated fragment length), computed
+  with FFTs over fixed-size chromosome chunks
+
+Results are written as ``<prefix>.json`` and as a one-row MultiQC custom
+content table ``<prefix>_mqc.tsv``.
+
+Usage:
+    python -m chipseq.bam_qc --bam IP_rep1.sorted.bam --peaks filtered_peaks.bed \\
+        --sample IP_rep1 -o IP_rep1_qc
+"""
+import argparse
+import json
+from array import array
+
+import numpy as np
+import pysam
+
+from chipseq.overlap import any_overlap
+from chipseq.peak_reader import ChromVocab, read_peak_array
+
+FLAG_UNMAPPED = 0x4
+FLAG_REVERSE = 0x10
+FLAG_SECONDARY = 0x100
+FLAG_DUPLICATE = 0x400
+FLAG_SUPPLEMENTARY = 0x800
+
+DEFAULT_MAX_SHIFT = 500
+DEFAULT_CHUNK = 1 << 20
+
+
+def _next_pow2(n):
+    return 1 << (int(n) - 1).bit_length()
+
+
+class StrandCrossCorrelation:
+    """Genome-wide Pearson correlation of +/- strand 5' counts at each shift.
+
+    Per chromosome, counts are built one chunk at a time and correlated with
+    an FFT; only the raw sums needed for the Pearson formula are kept, so
+    memory is bounded by the chunk size.
+    """
+
+    def __init__(self, max_shift=DEFAULT_MAX_SHIFT, chunk=DEFAULT_CHUNK):
+        self.max_shift = max_shift
+        self.chunk = chunk
+        self.products = np.zeros(max_shift + 1)
+        self.length = 0
+        self.n_plus = self.n_minus = 0
+        self.sq_plus = self.sq_minus = 0
+
+    def add_chromosome(self, plus_pos, minus_pos, chrom_len):
+        self.length += chrom_len
+        # Sums of squared per-base counts without a chromosome-length array
+        plus_counts = np.unique(plus_pos, return_counts=True)[1].astype(np.int64)
+        minus_counts = np.unique(minus_pos, return_counts=True)[1].astype(np.int64)
+        self.n_plus += len(plus_pos)
+        self.n_minus += len(minus_pos)
+        self.sq_plus += int((plus_counts ** 2).sum())
+        self.sq_minus += int((minus_counts ** 2).sum())
+        if len(plus_pos) == 0 or len(minus_pos) == 0:
+            return
+
+        plus_pos = np.sort(plus_pos)
+        minus_pos = np.sort(minus_pos)
+        size = _next_pow2(self.chunk + self.max_shift)
+        for lo in range(0, chrom_len, self.chunk):
+            hi = min(lo + self.chunk, chrom_len)
+            p = plus_pos[np.searchsorted(plus_pos, lo):np.searchsorted(plus_pos, hi)] - lo
+            # Minus tags up to max_shift past the chunk pair with plus tags inside it
+            m = minus_pos[np.searchsorted(minus_pos, lo):np.searchsorted(minus_pos, hi + self.max_shift)] - lo
+            if len(p) == 0 or len(m) == 0:
+                continue
+            plus_dense = np.bincount(p, minlength=size)[:size].astype(np.float64)
+            minus_dense = np.bincount(m, minlength=size)[:size].astype(np.float64)
+            # sum_x plus[x] * minus[x + s] for s = 0..max_shift
+            corr = np.fft.irfft(np.conj(np.fft.rfft(plus_dense)) * np.fft.rfft(minus_dense), n=size)
+            self.products += np.rint(corr[:self.max_shift + 1])
+
+    def merge(self, other):
+        """Add the sums of another instance (e.g. from a worker process)"""
+        self.products += other.products
+        self.length += other.length
+        self.n_plus += other.n_plus
+        self.n_minus += other.n_minus
+        self.sq_plus += other.sq_plus
+        self.sq_minus += other.sq_minus
+
+    def correlation(self):
+        """Pearson r per shift over the whole genome"""
+        if self.length == 0:
+            return np.zeros(self.max_shift + 1)
+        mean_p, mean_m = self.n_plus / self.length, self.n_minus / self.length
+        sd_p = np.sqrt(max(self.sq_plus / self.length - mean_p ** 2, 0))
+        sd_m = np.sqrt(max(self.sq_minus / self.length - mean_m ** 2, 0))
+        if sd_p == 0 or sd_m == 0:
+            return np.zeros(self.max_shift + 1)
+        return (self.products / self.length - mean_p * mean_m) / (sd_p * sd_m)
+
+    def summary(self, read_length):
+        """Fragment length, NSC and RSC following phantompeakqualtools"""
+        cc = self.correlation()
+        shifts = np.arange(len(cc))
+        # Exclude the 'phantom' peak at the read length and very short shifts
+        candidates = (np.abs(shifts - read_length) > 10) & (shifts >= 30)
+        if not candidates.any():
+            return {'fragment_length': None, 'nsc': None, 'rsc': None}
+        fragment = int(shifts[candidates][np.argmax(cc[candidates])])
+        cc_min = float(cc.min())
+        cc_frag = float(cc[fragment])
+        cc_read = float(cc[min(read_length, len(cc) - 1)])
+        return {
+            'fragment_length': fragment,
+            'nsc': cc_frag / cc_min if cc_min > 0 else None,
+            'rsc': (cc_frag - cc_min) / (cc_read - cc_min) if cc_read != cc_min else None,
+        }
+
+
+class BamQC:
+    """Accumulates all QC metrics chromosome by chromosome"""
+
+    def __init__(self, peaks=None, vocab=None, max_shift=DEFAULT_MAX_SHIFT):
+        self.peaks = peaks
+        self.vocab = vocab or ChromVocab()
+        self.counts = dict(total=0, secondary=0, supplementary=0, duplicates=0, mapped=0,
+                           primary_mapped=0, reads_in_peaks=0)
+        self.distinct_positions = 0
+        self.single_read_positions = 0
+        self.double_read_positions = 0
+        self.read_lengths = array('l')
+        self.xcorr = StrandCrossCorrelation(max_shift)
+
+    def add_chromosome(self, chrom, chrom_len, starts, ends, reverse):
+        starts = np.frombuffer(starts, dtype=np.int64) if len(starts) else np.empty(0, np.int64)
+        ends = np.frombuffer(ends, dtype=np.int64) if len(ends) else np.empty(0, np.int64)
+        reverse = np.frombuffer(reverse, dtype=np.int8).astype(bool) if len(reverse) else np.empty(0, bool)
+        if len(starts) == 0:
+            return
+        five_prime = np.where(reverse, ends - 1, starts)
+
+        # Library complexity from distinct (5' position, strand) pairs
+        _, per_position = np.unique(five_prime * 2 + reverse, return_counts=True)
+        self.distinct_positions += len(per_position)
+        self.single_read_positions += int(np.sum(per_position == 1))
+        self.double_read_positions += int(np.sum(per_position == 2))
+
+        if self.peaks is not None:
+            in_chrom = self.peaks[self.peaks['chrom'] == self.vocab.id(chrom)]
+            order = np.argsort(in_chrom['start'])
+            hits = any_overlap(starts, ends, in_chrom['start'][order].astype(np.int64),
+                               in_chrom['end'][order].astype(np.int64))
+            self.counts['reads_in_peaks'] += int(hits.sum())
+
+        self.xcorr.add_chromosome(np.clip(five_prime[~reverse], 0, chrom_len - 1),
+                                  np.clip(five_prime[reverse], 0, chrom_len - 1), chrom_len)
+
+    def run(self, bam_path):
+        """Stream the BAM once, flushing per-chromosome buffers as they fill"""
+        with pysam.AlignmentFile(bam_path, 'rb') as bam:
+            lengths = dict(zip(bam.references, bam.lengths))
+            current = None
+            starts, ends, reverse = array('q'), array('q'), array('b')
+            for read in bam.fetch(until_eof=True):
+                flag = read.flag
+                self.counts['total'] += 1
+                if flag & FLAG_SECONDARY:
+                    self.counts['secondary'] += 1
+                if flag & FLAG_SUPPLEMENTARY:
+                    self.counts['supplementary'] += 1
+                if flag & FLAG_DUPLICATE:
+                    self.counts['duplicates'] += 1
+                if flag & FLAG_UNMAPPED:
+                    continue
+                self.counts['mapped'] += 1
+                if flag & (FLAG_SECONDARY | FLAG_SUPPLEMENTARY):
+                    continue
+                self.counts['primary_mapped'] += 1
+
+                chrom = read.reference_name
+                if chrom != current:
+                    if current is not None:
+                        self.add_chromosome(current, lengths[current], starts, ends, reverse)
+                    current = chrom
+                    starts, ends, reverse = array('q'), array('q'), array('b')
+                starts.append(read.reference_start)
+                ends.append(read.reference_end)
+                reverse.append(1 if flag & FLAG_REVERSE else 0)
+                if len(self.read_lengths) < 10000:
+                    self.read_lengths.append(read.query_length or read.reference_length)
+            if current is not None:
+                self.add_chromosome(current, lengths[current], starts, ends, reverse)
+        return self.metrics()
+
+    def metrics(self):
+        c = self.counts
+        reads = c['primary_mapped']
+        read_length = int(np.median(self.read_lengths)) if len(self.read_lengths) else 0
+        metrics = {
+            'total_reads': c['total'],
+            'secondary': c['secondary'],
+            'supplementary': c['supplementary'],
+            'duplicates_marked': c['duplicates'],
+            'mapped_reads': c['mapped'],
+            'mapping_rate': c['mapped'] / c['total'] if c['total'] else 0.0,
+            'read_length': read_length,
+            'duplication_rate': 1 - self.distinct_positions / reads if reads else 0.0,
+            'nrf': self.distinct_positions / reads if reads else 0.0,
+            'pbc1': self.single_read_positions / self.distinct_positions if self.distinct_positions else 0.0,
+            'pbc2': (self.single_read_positions / self.double_read_positions
+                     if self.double_read_positions else None),
+            'reads_in_peaks': c['reads_in_peaks'] if self.peaks is not None else None,
+            'frip': c['reads_in_peaks'] / reads if self.peaks is not None and reads else None,
+        }
+        metrics.update(self.xcorr.summary(read_length))
+        return metrics
+
+
+def write_outputs(sample, metrics, prefix):
+    """Write ``<prefix>.json`` and a MultiQC general-stats ``<prefix>_mqc.tsv``"""
+    with open(f"{prefix}.json", 'w') as f:
+        json.dump({'sample': sample, **metrics}, f, indent=2)
+    columns = ['mapped_reads', 'mapping_rate', 'duplication_rate', 'nrf', 'pbc1', 'pbc2',
+               'frip', 'fragment_length', 'nsc', 'rsc']
+    with open(f"{prefix}_mqc.tsv", 'w') as f:
+        f.write("# id: 'chip_qc'\n# plot_type: 'generalstats'\n")
+        f.write('\t'.join(['Sample'] + columns) + '\n')
+        values = ['' if metrics[c] is None else f"{metrics[c]:.4g}" if isinstance(metrics[c], float)
+                  else str(metrics[c]) for c in columns]
+        f.write('\t'.join([sample] + values) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Single-pass ChIP-seq BAM QC")
+    parser.add_argument('--bam', required=True, help="Coordinate-sorted BAM")
+    parser.add_argument('--peaks', help="Peak BED for FRiP")
+    parser.add_argument('--sample', required=True)
+    parser.add_argument('--max-shift', type=int, default=DEFAULT_MAX_SHIFT)
+    parser.add_argument('-o', '--output-prefix', required=True)
+    args = parser.parse_args(argv)
+
+    vocab = ChromVocab()
+    peaks = read_peak_array(args.peaks, vocab=vocab, layout='bed') if args.peaks else None
+    metrics = BamQC(peaks, vocab, args.max_shift).run(args.bam)
+    write_outputs(args.sample, metrics, args.output_prefix)
+    print(json.dumps(metrics, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,436 @@
+"""Benchmarks of the analysis scripts on seeded synthetic projects.
+
+``generate`` writes a project directory with the inputs the analysis
+scripts read from ``results/``: HOMER-style replicate peak BEDs, the
+reproducible peak BED, a HOMER annotatePeaks table, an RNA-seq fold-change
+table and a GMT library.  Replicate 1 and the annotation table have
+``n_peaks`` rows and replicate 2 a quarter of that; peaks cluster around
+gene TSSs the way factor peaks do, so the annotation classes, distances
+and DE overlaps look like a real run.  The same size and seed always give
+the same files.
+
+``run`` times each stage on each project size in a fresh interpreter and
+records wall time and peak RSS.  The first repeat runs with an empty
+``chipseq.cache`` directory (cold), later repeats reuse it (warm).  Results
+go to a JSON file; ``compare`` diffs two of them and exits non-zero when a
+stage got slower or bigger than the threshold.
+
+Usage:
+    python -m chipseq.bench run --sizes 10k 100k 1M 10M --repeat 2
+    python -m chipseq.bench run --sizes 100k --stages s2c_venn figure_2f -o bench.json
+    python -m chipseq.bench compare results/benchmarks/0.1.0.json bench.json
+    python -m chipseq.bench generate --size 1M --outdir /tmp/bench-1M
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from chipseq.annotate import ANNOTATION_COLUMNS
+from chipseq.runner import (ANNOTATION, REPRODUCIBLE_PEAKS, RNASEQ, SCRIPTS_DIR, STAGES,
+                            experiment_path, run_script)
+
+# Bump when generated data changes so results from different generators are not compared
+GENERATOR_VERSION = 1
+RESULT_FORMAT = 1
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+DEFAULT_STAGES = ['s2c_venn', 'peak_statistics', 'figure_2f', 'enrichment_genes']
+DEFAULT_GENES = 20_000
+
+# GRCh38 primary chromosomes
+CHROM_SIZES = {
+    'chr1': 248956422, 'chr2': 242193529, 'chr3': 198295559, 'chr4': 190214555,
+    'chr5': 181538259, 'chr6': 170805979, 'chr7': 159345973, 'chr8': 145138636,
+    'chr9': 138394717, 'chr10': 133797422, 'chr11': 135086622, 'chr12': 133275309,
+    'chr13': 114364328, 'chr14': 107043718, 'chr15': 101991189, 'chr16': 90338345,
+    'chr17': 83257441, 'chr18': 80373285, 'chr19': 58617616, 'chr20': 64444167,
+    'chr21': 46709983, 'chr22': 50818468, 'chrX': 156040895,
+}
+# Genes the analysis scripts look up by name
+NAMED_GENES = ['MALAT1', 'NEAT1', 'FN1', 'FBN2', 'BMP2', 'PIDD1']
+
+CHROM_STRIDE = 1 << 32
+REP1_BED = 'results/IP_rep1_peaks.bed'
+REP2_BED = 'results/IP_rep2_peaks.bed'
+# Synthetic projects hold one experiment
+EXPERIMENT = 'IP'
+REPRODUCIBLE_BED = experiment_path(REPRODUCIBLE_PEAKS, EXPERIMENT)
+ANNOTATION_TABLE = experiment_path(ANNOTATION, EXPERIMENT)
+GMT = 'refs/gmt/Synthetic_Pathways.gmt'
+
+
+def parse_size(text):
+    """'10k', '1M', '2.5M' or '100000' -> int"""
+    text = str(text).strip()
+    scale = {'k': 1_000, 'm': 1_000_000, 'g': 1_000_000_000}.get(text[-1:].lower())
+    return int(float(text[:-1]) * scale) if scale else int(text)
+
+
+def format_size(n):
+    for suffix, scale in (('G', 1_000_000_000), ('M', 1_000_000), ('k', 1_000)):
+        if n >= scale and n % scale == 0:
+            return f"{n // scale}{suffix}"
+    return str(n)
+
+
+class SyntheticGenome:
+    """Seeded gene models on the GRCh38 chromosomes"""
+
+    def __init__(self, n_genes=DEFAULT_GENES, seed=0):
+        rng = np.random.default_rng([seed, n_genes])
+        self.chrom_names = np.array(list(CHROM_SIZES), dtype=object)
+        self.chrom_sizes = np.array(list(CHROM_SIZES.values()), dtype=np.int64)
+        weights = self.chrom_sizes / self.chrom_sizes.sum()
+        self.names = np.array(NAMED_GENES + [f"G{i:05d}" for i in range(n_genes - len(NAMED_GENES))],
+                              dtype=object)
+        self.chroms = rng.choice(len(weights), size=n_genes, p=weights)
+        self.tss = (rng.random(n_genes) * (self.chrom_sizes[self.chroms] - 200_000)).astype(np.int64) + 100_000
+        self.strands = np.where(rng.random(n_genes) < 0.5, '+', '-').astype(object)
+        self.types = np.where(rng.random(n_genes) < 0.85, 'protein_coding', 'lncRNA').astype(object)
+        self.transcripts = np.array([f"ENST{i:011d}.1" for i in range(n_genes)], dtype=object)
+        self.gene_ids = np.array([f"ENSG{i:011d}.1" for i in range(n_genes)], dtype=object)
+        order = np.argsort(self.chroms * CHROM_STRIDE + self.tss)
+        self._sorted = order
+        self._sorted_keys = (self.chroms * CHROM_STRIDE + self.tss)[order]
+
+    def random_peaks(self, rng, n, tss_fraction=0.6):
+        """(chrom codes, starts, ends) with ``tss_fraction`` of peaks near a TSS"""
+        near = rng.random(n) < tss_fraction
+        chroms = np.empty(n, dtype=np.int64)
+        centers = np.empty(n, dtype=np.int64)
+        genes = rng.integers(len(self.names), size=int(near.sum()))
+        chroms[near] = self.chroms[genes]
+        centers[near] = self.tss[genes] + rng.laplace(0, 2000, size=len(genes)).astype(np.int64)
+        n_far = n - len(genes)
+        chroms[~near] = rng.choice(len(self.chrom_sizes), size=n_far,
+                                   p=self.chrom_sizes / self.chrom_sizes.sum())
+        centers[~near] = (rng.random(n_far) * self.chrom_sizes[chroms[~near]]).astype(np.int64)
+        widths = (150 + rng.gamma(2.0, 60.0, size=n)).astype(np.int64)
+        starts = np.clip(centers - widths // 2, 0, self.chrom_sizes[chroms] - widths)
+        return chroms, starts, starts + widths
+
+    def nearest_gene(self, chroms, centers):
+        """Index of the gene with the nearest TSS on the same chromosome"""
+        keys = chroms * CHROM_STRIDE + centers
+        right = np.searchsorted(self._sorted_keys, keys).clip(1, len(self._sorted_keys) - 1)
+        left = right - 1
+        pick = np.where(np.abs(self._sorted_keys[right] - keys) < np.abs(keys - self._sorted_keys[left]),
+                        right, left)
+        return self._sorted[pick]
+
+
+def _bed_table(genome, chroms, starts, ends, prefix=''):
+    names = genome.chrom_names[chroms]
+    ids = names + '-' + (np.arange(len(starts)) + 1).astype(str).astype(object)
+    return pd.DataFrame({'chrom': names, 'start': starts, 'end': ends, 'name': prefix + ids,
+                         'score': 1, 'strand': '+'})
+
+
+def _write_bed(table, path):
+    with open(path, 'w') as f:
+        # pos2bed.pl keeps the HOMER comment header
+        f.write("# HOMER Peaks\n# synthetic peaks from chipseq.bench\n")
+        table.to_csv(f, sep='\t', header=False, index=False)
+
+
+def _annotation_table(genome, rng, chroms, starts, ends):
+    """HOMER annotatePeaks.pl table for the peaks, annotated against the nearest TSS"""
+    centers = (starts + ends) // 2
+    gene = genome.nearest_gene(chroms, centers)
+    distance = np.where(genome.strands[gene] == '+', 1, -1) * (centers - genome.tss[gene])
+    body = rng.choice(np.array(['intron', 'exon', 'TTS', "3' UTR", "5' UTR", 'non-coding'], dtype=object),
+                      size=len(starts), p=[0.55, 0.12, 0.12, 0.1, 0.06, 0.05])
+    classes = np.where((distance >= -1000) & (distance <= 100), 'promoter-TSS',
+                       np.where(np.abs(distance) > 50_000, 'Intergenic', body)).astype(object)
+    genic = classes != 'Intergenic'
+    annotation = classes.copy()
+    annotation[genic] = classes[genic] + ' (' + genome.transcripts[gene][genic] + ')'
+    detailed = annotation.copy()
+    detailed[genic] = genome.types[gene][genic] + '-' + annotation[genic]
+    table = pd.DataFrame({
+        'Chr': genome.chrom_names[chroms], 'Start': starts + 1, 'End': ends, 'Strand': '+',
+        'Peak Score': np.round(rng.gamma(2.0, 8.0, size=len(starts)), 1), 'Focus Ratio/Region Size': 'NA',
+        'Annotation': annotation, 'Detailed Annotation': detailed, 'Distance to TSS': distance,
+        'Nearest PromoterID': genome.transcripts[gene], 'Entrez ID': genome.gene_ids[gene],
+        'Nearest Unigene': '', 'Nearest Refseq': '', 'Nearest Ensembl': genome.transcripts[gene],
+        'Gene Name': genome.names[gene], 'Gene Alias': '', 'Gene Description': '',
+        'Gene Type': genome.types[gene],
+    })
+    ids = table['Chr'] + '-' + pd.Series(np.arange(len(table)) + 1).astype(str)
+    table.insert(0, 'PeakID (cmd=annotatePeaks.pl synthetic.bed -gtf synthetic.gtf)', ids)
+    return table[[table.columns[0]] + ANNOTATION_COLUMNS]
+
+
+def _rnaseq_table(genome, rng):
+    n = len(genome.names)
+    lfc = rng.normal(0, 0.9, size=n)
+    padj = np.minimum(rng.random(n) ** (1 + 4 * np.abs(lfc)), 1.0)
+    padj[rng.random(n) < 0.05] = np.nan
+    return pd.DataFrame({'genename': genome.names, 'transcript': genome.transcripts,
+                         'log2FoldChange': np.round(lfc, 6), 'padj': padj})
+
+
+def _write_gmt(genome, rng, path, n_terms=300):
+    with open(path, 'w') as f:
+        for i in range(n_terms):
+            genes = rng.choice(genome.names, size=int(rng.integers(15, 300)), replace=False)
+            f.write('\t'.join([f"SYNTHETIC_PATHWAY_{i:03d}", ''] + list(genes)) + '\n')
+
+
+def generate_project(outdir, n_peaks, seed=0, n_genes=DEFAULT_GENES):
+    """Write a synthetic project under ``outdir``; returns its manifest"""
+    rng = np.random.default_rng([seed, n_peaks, GENERATOR_VERSION])
+    genome = SyntheticGenome(n_genes, seed)
+    for path in (REP1_BED, REPRODUCIBLE_BED, ANNOTATION_TABLE, GMT):
+        os.makedirs(os.path.join(outdir, os.path.dirname(path)), exist_ok=True)
+
+    rep1 = genome.random_peaks(rng, n_peaks)
+    # Replicate 2 is a quarter the size; 70% of its peaks are jittered replicate 1 peaks
+    n_rep2 = max(n_peaks // 4, 1)
+    shared = rng.choice(n_peaks, size=int(n_rep2 * 0.7), replace=False)
+    shift = rng.integers(-60, 61, size=len(shared))
+    shared_starts = np.maximum(rep1[1][shared] + shift, 0)
+    shared_ends = shared_starts + (rep1[2][shared] - rep1[1][shared])
+    own = genome.random_peaks(rng, n_rep2 - len(shared))
+    rep2 = (np.concatenate([rep1[0][shared], own[0]]), np.concatenate([shared_starts, own[1]]),
+            np.concatenate([shared_ends, own[2]]))
+
+    _write_bed(_bed_table(genome, *rep1), os.path.join(outdir, REP1_BED))
+    _write_bed(_bed_table(genome, *rep2), os.path.join(outdir, REP2_BED))
+    _write_bed(_bed_table(genome, *(part[shared] for part in rep1)),
+               os.path.join(outdir, REPRODUCIBLE_BED))
+    _annotation_table(genome, rng, *rep1).to_csv(os.path.join(outdir, ANNOTATION_TABLE), sep='\t',
+                                                 index=False, na_rep='NA')
+    _rnaseq_table(genome, rng).to_csv(os.path.join(outdir, RNASEQ), sep='\t', index=False, na_rep='NA')
+    _write_gmt(genome, rng, os.path.join(outdir, GMT))
+
+    manifest = {'generator': GENERATOR_VERSION, 'seed': seed, 'n_peaks': n_peaks,
+                'n_rep2': n_rep2, 'n_genes': n_genes,
+                'bytes': sum(os.path.getsize(os.path.join(outdir, p))
+                             for p in (REP1_BED, REP2_BED, REPRODUCIBLE_BED, ANNOTATION_TABLE, RNASEQ, GMT))}
+    with open(os.path.join(outdir, 'bench.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def ensure_project(workdir, n_peaks, seed=0, n_genes=DEFAULT_GENES):
+    """Project directory for (size, seed), generated on first use; returns (path, manifest, seconds)"""
+    project = os.path.join(workdir, f"g{GENERATOR_VERSION}-s{seed}-{format_size(n_peaks)}")
+    manifest_path = os.path.join(project, 'bench.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['n_genes'] == n_genes:
+            return project, manifest, 0.0
+    shutil.rmtree(project, ignore_errors=True)
+    start = time.perf_counter()
+    manifest = generate_project(project, n_peaks, seed, n_genes)
+    return project, manifest, time.perf_counter() - start
+
+
+def _peak_rss_mb():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+
+
+def _measure_stage(scripts_dir, script, project, log_path):
+    """Run one script in this (fresh) process; returns (seconds, peak RSS in MB)"""
+    os.chdir(project)
+    os.environ['CHIPSEQ_CACHE_DIR'] = os.path.join(project, 'results', '.cache')
+    metrics = run_script(scripts_dir, script, log_path)
+    return metrics['wall_s'], _peak_rss_mb()
+
+
+def _measure_baseline():
+    """Peak RSS of an interpreter that has imported what every stage imports"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot  # noqa: F401
+    return _peak_rss_mb()
+
+
+def _in_fresh_process(fn, *args):
+    # spawn, not fork, so peak RSS starts from an empty interpreter
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def _git_commit(path):
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=path, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _version():
+    try:
+        from importlib.metadata import version
+        return version('chipseq-analysis')
+    except Exception:
+        return 'dev'
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, stage_names=DEFAULT_STAGES, repeat=1, seed=0,
+                   workdir=None, scripts_dir=SCRIPTS_DIR, n_genes=DEFAULT_GENES, log=print):
+    """Time every stage at every size; returns the result document"""
+    by_name = {stage.name: stage for stage in STAGES}
+    unknown = [name for name in stage_names if name not in by_name]
+    if unknown:
+        raise SystemExit(f"Unknown stage(s): {', '.join(unknown)}")
+    workdir = workdir or os.path.join(tempfile.gettempdir(), 'chipseq-bench')
+    os.makedirs(workdir, exist_ok=True)
+
+    document = {
+        'format': RESULT_FORMAT,
+        'generator': GENERATOR_VERSION,
+        'version': _version(),
+        'git_commit': _git_commit(scripts_dir),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': seed,
+        'n_genes': n_genes,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+        },
+        'baseline_rss_mb': round(_in_fresh_process(_measure_baseline), 1),
+        'datasets': [],
+        'results': [],
+    }
+    for n_peaks in sizes:
+        project, manifest, gen_seconds = ensure_project(workdir, n_peaks, seed, n_genes)
+        document['datasets'].append(dict(manifest, generate_seconds=round(gen_seconds, 3)))
+        log(f"{format_size(n_peaks)} peaks ({manifest['bytes'] / 2**20:,.0f} MB of inputs"
+            + (f", generated in {gen_seconds:.1f}s)" if gen_seconds else ", reused)"))
+        log_dir = os.path.join(project, 'results', 'logs')
+        os.makedirs(log_dir, exist_ok=True)
+        for name in stage_names:
+            stage = by_name[name]
+            # Every stage starts cold; repeats after the first reuse its cache entries
+            shutil.rmtree(os.path.join(project, 'results', '.cache'), ignore_errors=True)
+            for i in range(repeat):
+                record = {'stage': name, 'script': stage.script, 'n_peaks': n_peaks,
+                          'repeat': i, 'cache': 'cold' if i == 0 else 'warm'}
+                log_path = os.path.join(log_dir, f"{name}.{i}.log")
+                document['results'].append(record)
+                try:
+                    seconds, rss = _in_fresh_process(_measure_stage, scripts_dir, stage.script,
+                                                     project, log_path)
+                except BaseException as exc:
+                    record.update(status='failed', error=f"{type(exc).__name__}: {exc}", log=log_path)
+                    log(f"  ✗ {name} [{record['cache']}]: {record['error']} (see {log_path})")
+                    break
+                record.update(status='ok', seconds=round(seconds, 4), peak_rss_mb=round(rss, 1))
+                log(f"  ✓ {name} [{record['cache']}]: {seconds:.2f}s, {rss:,.0f} MB peak RSS")
+    return document
+
+
+def _summarize(document):
+    """(stage, n_peaks, cache) -> (best seconds, worst peak RSS) over repeats"""
+    summary = {}
+    for record in document['results']:
+        if record['status'] != 'ok':
+            continue
+        key = (record['stage'], record['n_peaks'], record['cache'])
+        seconds, rss = summary.get(key, (np.inf, 0.0))
+        summary[key] = (min(seconds, record['seconds']), max(rss, record['peak_rss_mb']))
+    return summary
+
+
+def compare(old, new, threshold=0.25, min_seconds=0.5):
+    """Table of old vs new per (stage, size, cache) and whether each regressed
+
+    A stage regresses when its best time or its peak RSS grows by more than
+    ``threshold``; timings under ``min_seconds`` in both runs are too noisy to
+    flag.
+    """
+    if old.get('generator') != new.get('generator'):
+        raise SystemExit(f"Results use different data generators ({old.get('generator')} vs "
+                         f"{new.get('generator')}) and cannot be compared")
+    old_summary, new_summary = _summarize(old), _summarize(new)
+    rows = []
+    for key in sorted(set(old_summary) & set(new_summary), key=lambda k: (k[0], k[1], k[2])):
+        (old_s, old_rss), (new_s, new_rss) = old_summary[key], new_summary[key]
+        time_ratio = new_s / old_s if old_s > 0 else np.nan
+        rss_ratio = new_rss / old_rss if old_rss > 0 else np.nan
+        slower = time_ratio > 1 + threshold and max(old_s, new_s) >= min_seconds
+        rows.append({'stage': key[0], 'n_peaks': format_size(key[1]), 'cache': key[2],
+                     'old_s': old_s, 'new_s': new_s, 'time_ratio': round(time_ratio, 2),
+                     'old_rss_mb': old_rss, 'new_rss_mb': new_rss, 'rss_ratio': round(rss_ratio, 2),
+                     'regression': bool(slower or rss_ratio > 1 + threshold)})
+    failed = [f"{r['stage']} @ {format_size(r['n_peaks'])}" for r in new['results'] if r['status'] != 'ok']
+    return pd.DataFrame(rows), failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis scripts on synthetic data")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = sub.add_parser('run', help="Time and memory-profile stages at several sizes")
+    run_parser.add_argument('--sizes', nargs='+', default=[format_size(n) for n in DEFAULT_SIZES],
+                            help="Peak counts, e.g. 10k 1M (default: 10k 100k 1M 10M)")
+    run_parser.add_argument('--stages', nargs='+', default=DEFAULT_STAGES,
+                            help="Runner stage names (default: %(default)s)")
+    run_parser.add_argument('--repeat', type=int, default=1, help="Runs per stage; the first is cold")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--genes', type=int, default=DEFAULT_GENES, help="Genes in the RNA-seq table")
+    run_parser.add_argument('--workdir', help="Where synthetic projects are kept between runs "
+                                              "(default: <tmp>/chipseq-bench)")
+    run_parser.add_argument('-o', '--output', help="Result JSON (default: results/benchmarks/<version>-<date>.json)")
+
+    gen_parser = sub.add_parser('generate', help="Write one synthetic project")
+    gen_parser.add_argument('--size', required=True)
+    gen_parser.add_argument('--seed', type=int, default=0)
+    gen_parser.add_argument('--genes', type=int, default=DEFAULT_GENES)
+    gen_parser.add_argument('--outdir', required=True)
+
+    cmp_parser = sub.add_parser('compare', help="Compare two result files")
+    cmp_parser.add_argument('old')
+    cmp_parser.add_argument('new')
+    cmp_parser.add_argument('--threshold', type=float, default=0.25,
+                            help="Relative growth in time or memory that counts as a regression")
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        manifest = generate_project(args.outdir, parse_size(args.size), args.seed, args.genes)
+        print(f"Wrote {manifest['n_peaks']:,} peaks ({manifest['bytes'] / 2**20:,.1f} MB) to {args.outdir}")
+    elif args.command == 'run':
+        document = run_benchmarks([parse_size(s) for s in args.sizes], args.stages, args.repeat,
+                                  args.seed, args.workdir, n_genes=args.genes)
+        output = args.output or os.path.join(
+            'results', 'benchmarks', f"{document['version']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"Wrote {output}")
+    else:
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        table, failed = compare(old, new, args.threshold)
+        print(table.to_string(index=False) if len(table) else "No common (stage, size) results")
+        for name in failed:
+            print(f"Failed in {args.new}: {name}")
+        if failed or table.get('regression', pd.Series(dtype=bool)).any():
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Typed columnar cache for the text tables the analysis scripts read.
+
+The first time a HOMER annotation table, BED peak file, RNA-seq fold-change
+table or GTF is loaded it is parsed with pandas, converted to compact dtypes
+(categorical strings, int32 coordinates, float32 scores) and written as one
+``.npy`` file per column under the cache directory.  Later loads hash the
+source file and, if an entry for that content hash exists, memory-map the
+columns instead of parsing text again.
+
+Tables are also memoized in-process, keyed on path and content hash, so a
+runner that loads shared inputs up front hands the same columns to every
+stage (and to forked workers) without touching disk again.
+
+The cache directory defaults to ``results/.cache`` and can be moved with the
+``CHIPSEQ_CACHE_DIR`` environment variable.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+CACHE_FORMAT_VERSION = 1
+
+BED_COLUMNS = ['chrom', 'start', 'end', 'name', 'score', 'strand']
+
+# Column typing per table kind: coordinates become int32, scores float32.
+# padj stays float64 because float32 underflows to 0 below ~1e-38.
+TABLE_SPECS = {
+    'homer_annotation': {
+        'int32': ['Start', 'End', 'Distance to TSS'],
+        'float32': ['Peak Score', 'Focus Ratio/Region Size'],
+    },
+    'bed': {
+        'int32': ['start', 'end'],
+        'float32': ['score'],
+    },
+    'rnaseq': {
+        'int32': [],
+        'float32': ['log2FoldChange'],
+    },
+    'gtf': {
+        'int32': ['start', 'end'],
+        'float32': [],
+    },
+}
+
+# GTF records kept for gene models and peak annotation; CDS and codon rows
+# other than start_codon are dropped to keep the cached table small
+GTF_FEATURES = ['gene', 'transcript', 'exon', 'UTR', 'five_prime_utr', 'three_prime_utr',
+                'start_codon']
+GTF_ATTRIBUTES = ['gene_id', 'gene_name', 'gene_type', 'transcript_id']
+
+
+# (absolute path, kind, content hash) -> DataFrame loaded in this process
+_loaded = {}
+
+
+def default_cache_dir():
+    return os.environ.get('CHIPSEQ_CACHE_DIR', os.path.join('results', '.cache'))
+
+
+def file_digest(filepath, block_size=1 << 20):
+    """Content hash of a file, read in blocks"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parse(filepath, kind):
+    if kind == 'homer_annotation':
+        return pd.read_csv(filepath, sep='\t', comment='#')
+    if kind == 'bed':
+        df = pd.read_csv(filepath, sep='\t', comment='#', header=None)
+        df.columns = BED_COLUMNS[:df.shape[1]] + [f'col{i}' for i in range(len(BED_COLUMNS), df.shape[1])]
+        return df
+    if kind == 'rnaseq':
+        return pd.read_csv(filepath, sep='\t')
+    if kind == 'gtf':
+        return _parse_gtf(filepath)
+    raise ValueError(f"Unknown table kind: {kind}")
+
+
+def _parse_gtf(filepath, chunksize=1_000_000):
+    """GTF as 0-based half-open records with the attributes split into columns"""
+    chunks = []
+    reader = pd.read_csv(filepath, sep='\t', comment='#', header=None, usecols=[0, 2, 3, 4, 6, 8],
+                         names=['chrom', 'feature', 'start', 'end', 'strand', 'attributes'],
+                         dtype={0: str, 2: str, 6: str, 8: str}, chunksize=chunksize)
+    for chunk in reader:
+        chunk = chunk[chunk['feature'].isin(GTF_FEATURES)]
+        attributes = chunk.pop('attributes')
+        for name in GTF_ATTRIBUTES:
+            chunk[name] = attributes.str.extract(f'{name} "([^"]*)"', expand=False)
+        # gene_type is gene_biotype in Ensembl GTFs
+        chunk['gene_type'] = chunk['gene_type'].fillna(
+            attributes.str.extract('gene_biotype "([^"]*)"', expand=False))
+        chunk['start'] -= 1
+        chunks.append(chunk)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _compact(df, kind):
+    """Downcast columns following TABLE_SPECS; strings become categoricals"""
+    spec = TABLE_SPECS[kind]
+    out = {}
+    for col in df.columns:
+        values = df[col]
+        if col in spec['int32'] and not values.isna().any():
+            out[col] = values.astype(np.int32)
+        elif col in spec['float32']:
+            out[col] = values.astype(np.float32)
+        elif pd.api.types.is_numeric_dtype(values):
+            out[col] = values
+        else:
+            out[col] = values.astype('category')
+    return pd.DataFrame(out)
+
+
+def compact_strings(df):
+    """Strings become categoricals, other columns are kept as they are"""
+    return pd.DataFrame({col: df[col] if pd.api.types.is_numeric_dtype(df[col])
+                         else df[col].astype('category') for col in df.columns})
+
+
+def write_entry(df, entry_dir):
+    """Write one .npy per column plus a manifest, atomically"""
+    parent = os.path.dirname(entry_dir)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    manifest = {'version': CACHE_FORMAT_VERSION, 'columns': []}
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categories = np.asarray(values.cat.categories, dtype=str)
+            np.save(os.path.join(tmp_dir, f'{i}.codes.npy'), values.cat.codes.to_numpy(np.int32))
+            np.save(os.path.join(tmp_dir, f'{i}.categories.npy'), categories)
+            manifest['columns'].append({'name': col, 'kind': 'category'})
+        else:
+            np.save(os.path.join(tmp_dir, f'{i}.npy'), values.to_numpy())
+            manifest['columns'].append({'name': col, 'kind': 'array'})
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another process wrote the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def read_entry(entry_dir):
+    """Memory-map an entry written by ``write_entry``; None if its format is outdated"""
+    with open(os.path.join(entry_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != CACHE_FORMAT_VERSION:
+        return None
+    columns = {}
+    for i, column in enumerate(manifest['columns']):
+        if column['kind'] == 'category':
+            codes = np.load(os.path.join(entry_dir, f'{i}.codes.npy'), mmap_mode='r')
+            categories = np.load(os.path.join(entry_dir, f'{i}.categories.npy'))
+            columns[column['name']] = pd.Categorical.from_codes(codes, categories=categories)
+        else:
+            columns[column['name']] = np.load(os.path.join(entry_dir, f'{i}.npy'), mmap_mode='r')
+    return pd.DataFrame(columns)
+
+
+def _prune_stale(cache_dir, prefix, keep):
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name != keep:
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+def load_table(filepath, kind, cache_dir=None):
+    """Load a table through the columnar cache, parsing the text only on a miss"""
+    cache_dir = cache_dir or default_cache_dir()
+    path_key = hashlib.blake2b(os.path.abspath(filepath).encode(), digest_size=4).hexdigest()
+    prefix = f"{kind}-{os.path.basename(filepath)}-{path_key}-"
+    digest = file_digest(filepath)
+    memo_key = (os.path.abspath(filepath), kind, digest)
+    if memo_key in _loaded:
+        # Shallow copy so callers adding columns don't affect each other
+        return _loaded[memo_key].copy(deep=False)
+
+    entry_name = prefix + digest
+    entry_dir = os.path.join(cache_dir, entry_name)
+
+    df = read_entry(entry_dir) if os.path.isdir(entry_dir) else None
+    if df is None:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        df = _compact(_parse(filepath, kind), kind)
+        write_entry(df, entry_dir)
+        _prune_stale(cache_dir, prefix, entry_name)
+    _loaded[memo_key] = df
+    return df.copy(deep=False)
+
+
+def load_homer_annotation(filepath, cache_dir=None):
+    """HOMER annotatePeaks.pl output as a typed DataFrame"""
+    return load_table(filepath, 'homer_annotation', cache_dir)
+
+
+def load_bed(filepath, cache_dir=None):
+    """BED peak file (HOMER '#' headers skipped) as a typed DataFrame"""
+    return load_table(filepath, 'bed', cache_dir)
+
+
+def load_rnaseq(filepath, cache_dir=None):
+    """RNA-seq fold-change table (genename, transcript, log2FoldChange, padj)"""
+    return load_table(filepath, 'rnaseq', cache_dir)
+
+
+def load_gtf(filepath, cache_dir=None):
+    """GTF gene, transcript, exon, UTR and start codon records (0-based starts)"""
+    return load_table(filepath, 'gtf', cache_dir)
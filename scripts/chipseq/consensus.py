@@ -0,0 +1,181 @@
+"""N-way consensus peaks with k-of-n replicate support.
+
+All peak files are read onto one global coordinate axis and every start
+and end is sorted once; a single pass over the endpoints (running depth)
+finds the merged regions, assigns each peak to its region and records the
+depth between consecutive endpoints.  Per-region support, peak count and
+maximum score then come from grouped reductions over the peaks, which are
+already in region order, so the whole build is O(N log N) in the total
+number of peaks however many files there are.
+
+Each region is written as BED6 (name ``consensus_<i>``, score = the
+maximum peak score) followed by its summit (midpoint of the stretch
+covered by the most peaks), the number of supporting samples, their
+names and the number of merged peaks.  Peaks that only touch (bookended)
+are not merged.  ``--min-support k`` keeps regions found in at least k
+samples; ``--all`` also writes every region before that filter.
+
+Usage:
+    python -m chipseq.consensus IP_rep1_peaks.bed IP_rep2_peaks.bed IP_rep3_peaks.bed \\
+        --min-support 2 --blacklist hg38-blacklist.v2.bed -o filtered_peaks.bed
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from chipseq.assets import load_blacklist
+from chipseq.overlap import CHROM_STRIDE, any_overlap, global_coords
+from chipseq.peak_reader import ChromVocab, read_peak_array
+
+CONSENSUS_COLUMNS = ['chrom', 'start', 'end', 'name', 'score', 'strand', 'summit', 'n_support',
+                     'samples', 'n_peaks']
+
+
+def sample_name(path):
+    """'results/homer/peaks_bed/IP_rep1_peaks.bed' -> 'IP_rep1'"""
+    name = os.path.basename(path)
+    for suffix in ('.gz', '.bed', '.txt', '.narrowPeak', '_peaks'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def sweep(starts, ends):
+    """One pass over sorted endpoints of global ``[start, end)`` intervals.
+
+    Returns ``(peak_order, peak_region, region_start, region_end, segments)``:
+    peaks in start order with the merged region each falls in, the region
+    bounds, and ``(seg_start, seg_end, depth, region)`` for every stretch
+    between consecutive endpoints that at least one peak covers.
+    """
+    n = len(starts)
+    pos = np.concatenate([starts, ends])
+    delta = np.concatenate([np.ones(n, dtype=np.int8), np.full(n, -1, dtype=np.int8)])
+    # One sort key with ends before starts at the same coordinate, so bookended peaks stay apart
+    order = np.argsort(pos * 2 + (delta > 0))
+    pos, delta = pos[order], delta[order]
+    depth = np.cumsum(delta, dtype=np.int64)
+    opens = (delta == 1) & (depth == 1)
+    closes = depth == 0
+    region = np.cumsum(opens) - 1
+
+    is_start = order < n
+    peak_order = order[is_start]
+    peak_region = region[is_start]
+
+    covered = (depth[:-1] > 0) & (pos[1:] > pos[:-1])
+    segments = (pos[:-1][covered], pos[1:][covered], depth[:-1][covered], region[:-1][covered])
+    return peak_order, peak_region, pos[opens], pos[closes], segments
+
+
+def _summits(segments, n_regions):
+    """Midpoint of the deepest stretch of each region (leftmost on ties)"""
+    seg_start, seg_end, depth, region = segments
+    order = np.lexsort((seg_start, -depth, region))
+    first = np.r_[True, region[order][1:] != region[order][:-1]]
+    best = order[first]
+    summits = np.empty(n_regions, dtype=np.int64)
+    summits[region[best]] = (seg_start[best] + seg_end[best]) // 2
+    return summits
+
+
+def _support_labels(support, names):
+    """Comma-joined sample names per region, built once per distinct support pattern"""
+    if len(support) == 0:
+        return np.empty(0, dtype=object)
+    packed = np.packbits(support, axis=1)
+    # Hash the packed rows as one key each instead of sorting rows
+    keys = [packed[:, j] for j in range(packed.shape[1])]
+    codes, _ = pd.factorize(pd.MultiIndex.from_arrays(keys) if len(keys) > 1 else keys[0])
+    first = np.zeros(codes.max() + 1, dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes))[::-1]
+    labels = np.array([','.join(np.asarray(names)[row]) for row in support[first]], dtype=object)
+    return labels[codes]
+
+
+def consensus_regions(peak_sets, names, vocab):
+    """Merged regions of several ``PEAK_DTYPE`` arrays as a ``CONSENSUS_COLUMNS`` table"""
+    sample = np.repeat(np.arange(len(peak_sets)), [len(p) for p in peak_sets])
+    peaks = np.concatenate(peak_sets) if peak_sets else np.empty(0)
+    valid = peaks['end'] > peaks['start'] if len(peaks) else np.zeros(0, dtype=bool)
+    peaks, sample = peaks[valid], sample[valid]
+    if len(peaks) == 0:
+        return pd.DataFrame(columns=CONSENSUS_COLUMNS)
+
+    starts, ends = global_coords(peaks['chrom'], peaks['start'], peaks['end'])
+    peak_order, peak_region, region_start, region_end, segments = sweep(starts, ends)
+    n_regions = len(region_start)
+
+    support = np.zeros((n_regions, len(names)), dtype=bool)
+    support[peak_region, sample[peak_order]] = True
+    bounds = np.flatnonzero(np.r_[True, peak_region[1:] != peak_region[:-1]])
+    chrom = region_start // CHROM_STRIDE
+    table = pd.DataFrame({
+        'chrom': vocab.decode(chrom),
+        'start': region_start - chrom * CHROM_STRIDE,
+        'end': region_end - chrom * CHROM_STRIDE,
+        'name': '',
+        'score': np.maximum.reduceat(peaks['score'][peak_order], bounds),
+        'strand': '+',
+        'summit': _summits(segments, n_regions) - chrom * CHROM_STRIDE,
+        'n_support': support.sum(axis=1),
+        'samples': _support_labels(support, names),
+        'n_peaks': np.diff(np.r_[bounds, len(peak_order)]),
+    })
+    return table
+
+
+def build_consensus(paths, names=None, min_support=1, blacklist=None):
+    """(consensus table filtered to ``min_support`` and the blacklist, all regions)"""
+    names = list(names) if names else [sample_name(p) for p in paths]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Sample names are not unique: {', '.join(names)}")
+    vocab = ChromVocab()
+    peak_sets = [read_peak_array(path, vocab=vocab) for path in paths]
+    regions = consensus_regions(peak_sets, names, vocab)
+    keep = (regions['n_support'] >= min_support).to_numpy().copy()
+    if blacklist is not None and len(regions):
+        bl = load_blacklist(blacklist, vocab)
+        codes = vocab.encode(regions['chrom'].to_numpy())
+        start, end = global_coords(codes, regions['start'], regions['end'])
+        bl_start, bl_end = global_coords(bl['chrom'], bl['start'], bl['end'])
+        keep &= ~any_overlap(start, end, bl_start, bl_end)
+    regions['name'] = [f"consensus_{i + 1}" for i in range(len(regions))]
+    return regions[keep], regions
+
+
+def write_consensus(table, path):
+    table.to_csv(path, sep='\t', header=False, index=False, float_format='%g')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Consensus peaks across any number of peak files")
+    parser.add_argument('peaks', nargs='+', help="Peak BED or HOMER peak files, one per sample")
+    parser.add_argument('--names', nargs='+', help="Sample names (default: from file names)")
+    parser.add_argument('-k', '--min-support', type=int, default=1,
+                        help="Minimum number of samples supporting a region (default: 1)")
+    parser.add_argument('--blacklist', help="BED of regions to exclude")
+    parser.add_argument('-o', '--output', required=True)
+    parser.add_argument('--all', help="Also write every region, before the support and blacklist filters")
+    args = parser.parse_args(argv)
+
+    if args.names and len(args.names) != len(args.peaks):
+        parser.error("--names needs one name per peak file")
+    # Order by sample name so output does not depend on the order files were given in
+    names = args.names or [sample_name(p) for p in args.peaks]
+    names, paths = zip(*sorted(zip(names, args.peaks)))
+    consensus, regions = build_consensus(paths, names, args.min_support, args.blacklist)
+    write_consensus(consensus, args.output)
+    if args.all:
+        write_consensus(regions, args.all)
+
+    counts = regions['n_support'].value_counts().sort_index()
+    print(f"{len(regions):,} merged regions from {len(paths)} samples; by support: "
+          + ', '.join(f"{k}: {v:,}" for k, v in counts.items()))
+    print(f"Wrote {len(consensus):,} regions with support >= {args.min_support} to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
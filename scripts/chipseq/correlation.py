@@ -0,0 +1,438 @@
+"""Out-of-core Spearman/Pearson correlation over genome-wide signal bins.
+
+Reads the ``multibw_summary.npz`` written by ``multiBigwigSummary bins`` (or
+bins bigWigs or ``chipseq.coverage`` bin arrays directly) into a memory-mapped ``(bins, samples)`` matrix under
+the cache directory, so later runs with other methods or filters skip the
+decode.  Bins can be dropped when all-zero (deepTools ``--skipZeros``), when
+any sample is NaN, or when they overlap a blacklist.  The ``.npz`` holds only
+the matrix and labels; bin coordinates, which the blacklist filter needs,
+come from the ``--outRawCounts`` table of the same run (``--regions``).
+
+All pairwise correlations come from chunked ``X.T @ X`` products over row
+blocks, so memory is bounded by the chunk size and the sample count.  For
+Spearman, columns are ranked a block of samples at a time into a second
+memory-mapped matrix first.  Bootstrap confidence intervals use Poisson
+bootstrap weights on bins and run in a process pool; ranks are not
+recomputed per resample.
+
+The correlation matrix is written in ``plotCorrelation --outFileCorMatrix``
+layout, so ``SpearmanCorrelation.py`` reads either.
+
+Usage:
+    python -m chipseq.correlation --npz results/deeptools/multibw_summary.npz \\
+        --regions results/deeptools/multibw_summary.tab \\
+        --method spearman --skip-zeros --blacklist refs/hg38-blacklist.v2.bed \\
+        -o results/correlation_matrix.tab --plot results/correlation_heatmap.png
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+
+from chipseq.assets import load_blacklist
+from chipseq.cache import default_cache_dir, file_digest
+from chipseq.overlap import any_overlap, global_coords
+from chipseq.peak_reader import ChromVocab
+
+DEFAULT_CHUNK_ROWS = 1 << 18
+DEFAULT_RANK_BLOCK = 8
+
+
+class BinMatrix:
+    """Memory-mapped signal matrix with one row per genomic bin"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.values = np.load(os.path.join(directory, 'matrix.npy'), mmap_mode='r')
+        # Bin coordinates, None for an .npz read without its regions
+        self.chroms = self.starts = self.ends = None
+        if os.path.exists(os.path.join(directory, 'chroms.npy')):
+            self.chroms = np.load(os.path.join(directory, 'chroms.npy'), allow_pickle=False)
+            self.starts = np.load(os.path.join(directory, 'starts.npy'), mmap_mode='r')
+            self.ends = np.load(os.path.join(directory, 'ends.npy'), mmap_mode='r')
+        with open(os.path.join(directory, 'labels.json')) as f:
+            self.labels = json.load(f)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @classmethod
+    def from_npz(cls, npz_path, regions_path=None, cache_dir=None):
+        """Extract a multiBigwigSummary archive once, streaming the matrix member
+
+        ``regions_path`` is the run's ``--outRawCounts`` table (or a BED of
+        the bins, in matrix order); without it the bins have no coordinates.
+        """
+        if regions_path:
+            key = json.dumps([[os.path.abspath(p), file_digest(p)] for p in (npz_path, regions_path)])
+            entry_dir = _entry_dir('npz', key, cache_dir, is_path=False)
+        else:
+            entry_dir = _entry_dir('npz', npz_path, cache_dir)
+        if os.path.isdir(entry_dir):
+            return cls(entry_dir)
+        tmp_dir = _new_entry(entry_dir)
+        with zipfile.ZipFile(npz_path) as archive:
+            with archive.open('matrix.npy') as member:
+                version = np.lib.format.read_magic(member)
+                read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                               else np.lib.format.read_array_header_2_0)
+                shape, fortran, dtype = read_header(member)
+                if fortran:
+                    raise ValueError(f"{npz_path}: Fortran-ordered matrix is not supported")
+                out = np.lib.format.open_memmap(os.path.join(tmp_dir, 'matrix.npy'), mode='w+',
+                                                dtype=np.float32, shape=shape)
+                row_bytes = dtype.itemsize * shape[1]
+                for lo in range(0, shape[0], DEFAULT_CHUNK_ROWS):
+                    hi = min(lo + DEFAULT_CHUNK_ROWS, shape[0])
+                    block = np.frombuffer(member.read(row_bytes * (hi - lo)), dtype=dtype)
+                    out[lo:hi] = block.reshape(hi - lo, shape[1])
+                out.flush()
+                del out
+            contents = np.load(archive.open('labels.npy'), allow_pickle=True)
+            labels = [str(label) for label in contents]
+        if regions_path:
+            regions = pd.read_csv(regions_path, sep='\t', header=None, comment='#', usecols=[0, 1, 2],
+                                  dtype={0: str})
+            if len(regions) != shape[0]:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise ValueError(f"{regions_path} has {len(regions):,} bins, "
+                                 f"{npz_path} has {shape[0]:,}; use the tables of one run")
+            _write_regions(tmp_dir, regions[0].to_numpy(), regions[1].to_numpy(np.int64),
+                           regions[2].to_numpy(np.int64), labels)
+        else:
+            _write_labels(tmp_dir, labels)
+        return cls(_commit_entry(tmp_dir, entry_dir))
+
+    @classmethod
+    def from_bigwigs(cls, bigwig_paths, bin_size=10000, labels=None, cache_dir=None):
+        """Mean signal per fixed-size bin for each bigWig (requires pyBigWig)"""
+        import pyBigWig
+
+        key = json.dumps([[os.path.abspath(p), file_digest(p)] for p in bigwig_paths] + [bin_size])
+        entry_dir = _entry_dir('bigwig', key, cache_dir, is_path=False)
+        if os.path.isdir(entry_dir):
+            return cls(entry_dir)
+        handles = [pyBigWig.open(p) for p in bigwig_paths]
+        try:
+            chrom_sizes = handles[0].chroms()
+            n_bins = {c: -(-size // bin_size) for c, size in chrom_sizes.items()}
+            tmp_dir = _new_entry(entry_dir)
+            out = np.lib.format.open_memmap(os.path.join(tmp_dir, 'matrix.npy'), mode='w+',
+                                            dtype=np.float32,
+                                            shape=(sum(n_bins.values()), len(handles)))
+            chroms, starts, ends = [], [], []
+            row = 0
+            for chrom, size in chrom_sizes.items():
+                n = n_bins[chrom]
+                bin_starts = np.arange(n, dtype=np.int64) * bin_size
+                for j, bw in enumerate(handles):
+                    means = bw.stats(chrom, 0, size, nBins=n, type='mean', exact=True) \
+                        if chrom in bw.chroms() else [None] * n
+                    out[row:row + n, j] = np.array(means, dtype=np.float64)
+                chroms.append(np.full(n, chrom))
+                starts.append(bin_starts)
+                ends.append(np.minimum(bin_starts + bin_size, size))
+                row += n
+            out.flush()
+            del out
+        finally:
+            for bw in handles:
+                bw.close()
+        labels = labels or [os.path.basename(p) for p in bigwig_paths]
+        _write_regions(tmp_dir, np.concatenate(chroms), np.concatenate(starts),
+                       np.concatenate(ends), labels)
+        return cls(_commit_entry(tmp_dir, entry_dir))
+
+
+    @classmethod
+    def from_coverage(cls, bins_dirs, bin_size=10000, normalize='CPM', cache_dir=None):
+        """Re-bin ``chipseq.coverage`` bin arrays to ``bin_size`` (no bigWig decoding)"""
+        from chipseq.coverage import BinnedCoverage
+
+        tracks = [BinnedCoverage(d, normalize) for d in bins_dirs]
+        factor = bin_size // tracks[0].bin_size
+        if any(t.bin_size != tracks[0].bin_size for t in tracks) or factor * tracks[0].bin_size != bin_size:
+            raise ValueError(f"bin size {bin_size} is not a multiple of every coverage bin size")
+        key = json.dumps([t.digest() for t in tracks] + [bin_size])
+        entry_dir = _entry_dir('coverage', key, cache_dir, is_path=False)
+        if os.path.isdir(entry_dir):
+            return cls(entry_dir)
+        chrom_sizes = tracks[0].chroms()
+        n_bins = {c: -(-size // bin_size) for c, size in chrom_sizes.items()}
+        tmp_dir = _new_entry(entry_dir)
+        out = np.lib.format.open_memmap(os.path.join(tmp_dir, 'matrix.npy'), mode='w+',
+                                        dtype=np.float32, shape=(sum(n_bins.values()), len(tracks)))
+        chroms, starts, ends = [], [], []
+        row = 0
+        for chrom, size in chrom_sizes.items():
+            n = n_bins[chrom]
+            for j, track in enumerate(tracks):
+                sums = np.asarray(track.bin_sums(chrom), dtype=np.float64)
+                # Mean normalized depth over each coarse bin
+                coarse = np.add.reduceat(sums, np.arange(0, len(sums), factor))
+                out[row:row + n, j] = coarse * track.scale() / bin_size
+            bin_starts = np.arange(n, dtype=np.int64) * bin_size
+            chroms.append(np.full(n, chrom))
+            starts.append(bin_starts)
+            ends.append(np.minimum(bin_starts + bin_size, size))
+            row += n
+        out.flush()
+        del out
+        _write_regions(tmp_dir, np.concatenate(chroms), np.concatenate(starts),
+                       np.concatenate(ends), [t.label for t in tracks])
+        return cls(_commit_entry(tmp_dir, entry_dir))
+
+
+def _entry_dir(kind, source, cache_dir=None, is_path=True):
+    cache_dir = cache_dir or default_cache_dir()
+    if is_path:
+        name = f"bins-{kind}-{os.path.basename(source)}-{file_digest(source)}"
+    else:
+        name = f"bins-{kind}-{hashlib.blake2b(source.encode(), digest_size=16).hexdigest()}"
+    return os.path.join(cache_dir, name)
+
+
+def _new_entry(entry_dir):
+    parent = os.path.dirname(entry_dir)
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+
+
+def _commit_entry(tmp_dir, entry_dir):
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another process wrote the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return entry_dir
+
+
+def _write_labels(directory, labels):
+    with open(os.path.join(directory, 'labels.json'), 'w') as f:
+        json.dump([label.strip("'") for label in labels], f)
+
+
+def _write_regions(directory, chroms, starts, ends, labels):
+    np.save(os.path.join(directory, 'chroms.npy'), np.asarray(chroms, dtype=str))
+    np.save(os.path.join(directory, 'starts.npy'), np.asarray(starts, dtype=np.int64))
+    np.save(os.path.join(directory, 'ends.npy'), np.asarray(ends, dtype=np.int64))
+    _write_labels(directory, labels)
+
+
+def keep_bins(bins, skip_zeros=True, blacklist=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Row mask: no NaN, not all-zero (if ``skip_zeros``), not in the blacklist"""
+    if blacklist is not None and bins.chroms is None:
+        raise ValueError("the bins have no coordinates to match the blacklist against; "
+                         "give the multiBigwigSummary --outRawCounts table with --regions")
+    keep = np.empty(bins.shape[0], dtype=bool)
+    for lo in range(0, bins.shape[0], chunk_rows):
+        block = np.asarray(bins.values[lo:lo + chunk_rows])
+        ok = ~np.isnan(block).any(axis=1)
+        if skip_zeros:
+            ok &= (block != 0).any(axis=1)
+        keep[lo:lo + chunk_rows] = ok
+    if blacklist is not None and len(blacklist):
+        vocab = ChromVocab()
+        codes = vocab.encode(bins.chroms)
+        bl = load_blacklist(blacklist, vocab)
+        q_start, q_end = global_coords(codes, bins.starts, bins.ends)
+        r_start, r_end = global_coords(bl['chrom'], bl['start'], bl['end'])
+        keep &= ~any_overlap(q_start, q_end, r_start, r_end)
+    return keep
+
+
+def rank_columns(values, rows, out_path, block_cols=DEFAULT_RANK_BLOCK):
+    """Average ranks of each column over ``rows``, written to an .npy memmap"""
+    ranks = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float64,
+                                      shape=(len(rows), values.shape[1]))
+    for lo in range(0, values.shape[1], block_cols):
+        hi = min(lo + block_cols, values.shape[1])
+        ranks[:, lo:hi] = rankdata(np.asarray(values[:, lo:hi])[rows], axis=0)
+    ranks.flush()
+    return ranks
+
+
+def _weighted_moments(X, rows, weights, chunk_rows):
+    """Weighted total, column means and centered cross-products, in row chunks"""
+    n_cols = X.shape[1]
+    total = 0.0
+    sums = np.zeros(n_cols)
+    for lo in range(0, len(rows), chunk_rows):
+        block = np.asarray(X[rows[lo:lo + chunk_rows]], dtype=np.float64)
+        w = weights[lo:lo + chunk_rows] if weights is not None else None
+        total += w.sum() if w is not None else len(block)
+        sums += w @ block if w is not None else block.sum(axis=0)
+    means = sums / total
+    cross = np.zeros((n_cols, n_cols))
+    for lo in range(0, len(rows), chunk_rows):
+        block = np.asarray(X[rows[lo:lo + chunk_rows]], dtype=np.float64) - means
+        if weights is not None:
+            cross += (block * weights[lo:lo + chunk_rows, None]).T @ block
+        else:
+            cross += block.T @ block
+    return cross
+
+
+def _to_correlation(cross):
+    sd = np.sqrt(np.diag(cross))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = cross / np.outer(sd, sd)
+    np.fill_diagonal(corr, 1.0)
+    return corr
+
+
+def correlation_matrix(X, rows=None, weights=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Pearson correlation of all column pairs of ``X`` over ``rows``"""
+    rows = np.arange(X.shape[0]) if rows is None else rows
+    return _to_correlation(_weighted_moments(X, rows, weights, chunk_rows))
+
+
+def _bootstrap_batch(matrix_path, seed, n_replicates, chunk_rows):
+    """Correlations for ``n_replicates`` Poisson-weighted resamples of all rows"""
+    X = np.load(matrix_path, mmap_mode='r')
+    rng = np.random.default_rng(seed)
+    rows = np.arange(X.shape[0])
+    out = np.empty((n_replicates, X.shape[1], X.shape[1]))
+    for r in range(n_replicates):
+        weights = rng.poisson(1.0, size=X.shape[0]).astype(np.float64)
+        out[r] = correlation_matrix(X, rows, weights, chunk_rows)
+    return out
+
+
+def bootstrap_intervals(matrix_path, n_bootstrap=200, level=0.95, workers=None, seed=None,
+                        batch_size=10, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Percentile intervals (low, high) for every pair, resampling bins in parallel"""
+    n_batches = -(-n_bootstrap // batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(n_batches)
+    sizes = [min(batch_size, n_bootstrap - i * batch_size) for i in range(n_batches)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        replicates = np.concatenate(list(pool.map(
+            _bootstrap_batch, [matrix_path] * n_batches, seeds, sizes, [chunk_rows] * n_batches)))
+    tail = (1 - level) / 2 * 100
+    return np.percentile(replicates, [tail, 100 - tail], axis=0)
+
+
+def compute(bins, method='spearman', skip_zeros=True, blacklist=None, log1p=False,
+            n_bootstrap=0, workers=None, seed=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Correlation DataFrame, plus a long table of bootstrap intervals if requested"""
+    rows = np.flatnonzero(keep_bins(bins, skip_zeros, blacklist, chunk_rows))
+    if len(rows) < 2:
+        raise ValueError("Fewer than two bins left after filtering")
+    with tempfile.TemporaryDirectory(dir=bins.directory, prefix='.work-') as work:
+        matrix_path = os.path.join(work, 'values.npy')
+        if method == 'spearman':
+            X = rank_columns(bins.values, rows, matrix_path)
+        elif method == 'pearson':
+            X = np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float64,
+                                          shape=(len(rows), bins.shape[1]))
+            for lo in range(0, len(rows), chunk_rows):
+                block = np.asarray(bins.values[rows[lo:lo + chunk_rows]], dtype=np.float64)
+                X[lo:lo + chunk_rows] = np.log1p(block) if log1p else block
+            X.flush()
+        else:
+            raise ValueError(f"Unknown correlation method '{method}'")
+
+        corr = pd.DataFrame(correlation_matrix(X, chunk_rows=chunk_rows),
+                            index=bins.labels, columns=bins.labels)
+        intervals = None
+        if n_bootstrap:
+            low, high = bootstrap_intervals(matrix_path, n_bootstrap, workers=workers, seed=seed,
+                                            chunk_rows=chunk_rows)
+            i, j = np.triu_indices(len(bins.labels), k=1)
+            labels = np.asarray(bins.labels)
+            intervals = pd.DataFrame({
+                'sample_a': labels[i], 'sample_b': labels[j],
+                method: corr.to_numpy()[i, j], 'ci_low': low[i, j], 'ci_high': high[i, j],
+            })
+        del X
+    return corr, intervals, len(rows)
+
+
+def write_correlation_matrix(corr, filepath):
+    """Write in the ``plotCorrelation --outFileCorMatrix`` layout"""
+    labels = [f"'{label}'" for label in corr.columns]
+    with open(filepath, 'w') as f:
+        f.write('\t' + '\t'.join(labels) + '\n')
+        for label, row in zip(labels, corr.to_numpy()):
+            f.write(label + '\t' + '\t'.join(f"{value:.4f}" for value in row) + '\n')
+
+
+def plot_heatmap(corr, filepath, title):
+    from chipseq.render import save_figure
+    import matplotlib.pyplot as plt
+
+    n = len(corr)
+    fig, ax = plt.subplots(figsize=(max(6, 0.35 * n + 3), max(5, 0.35 * n + 2)))
+    image = ax.imshow(corr.to_numpy(), cmap='RdYlBu', vmin=min(0, corr.to_numpy().min()), vmax=1)
+    ax.set_xticks(range(n))
+    ax.set_yticks(range(n))
+    ax.set_xticklabels(corr.columns, rotation=90)
+    ax.set_yticklabels(corr.index)
+    if n <= 20:
+        for i in range(n):
+            for j in range(n):
+                ax.text(j, i, f"{corr.iat[i, j]:.2f}", ha='center', va='center', fontsize=8)
+    fig.colorbar(image, ax=ax)
+    ax.set_title(title)
+    save_figure(filepath, fig)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Correlation of binned ChIP-seq signal")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--npz', help="multiBigwigSummary bins output")
+    source.add_argument('--bigwigs', nargs='+', help="bigWig files to bin directly")
+    source.add_argument('--coverage', nargs='+', help="chipseq.coverage .bins directories")
+    parser.add_argument('--regions', help="multiBigwigSummary --outRawCounts table (or BED) of the "
+                                          "--npz bins; needed for --blacklist")
+    parser.add_argument('--bin-size', type=int, default=10000, help="Bin size for --bigwigs/--coverage")
+    parser.add_argument('--method', choices=['spearman', 'pearson'], default='spearman')
+    parser.add_argument('--skip-zeros', action='store_true', help="Drop bins that are zero in every sample")
+    parser.add_argument('--log1p', action='store_true', help="log1p-transform values (Pearson only)")
+    parser.add_argument('--blacklist', help="Drop bins overlapping these regions")
+    parser.add_argument('--bootstrap', type=int, default=0, help="Bootstrap resamples for intervals")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('-o', '--output', default='results/correlation_matrix.tab')
+    parser.add_argument('--plot', help="Heatmap image path")
+    parser.add_argument('--intervals', help="Bootstrap interval table (default: next to --output)")
+    args = parser.parse_args(argv)
+
+    if args.regions and not args.npz:
+        parser.error("--regions only applies to --npz")
+    if args.npz and args.blacklist and not args.regions:
+        parser.error("--blacklist with --npz needs --regions: the .npz has no bin coordinates "
+                     "(run multiBigwigSummary with --outRawCounts)")
+    try:
+        if args.npz:
+            bins = BinMatrix.from_npz(args.npz, args.regions)
+        elif args.coverage:
+            bins = BinMatrix.from_coverage(args.coverage, args.bin_size)
+        else:
+            bins = BinMatrix.from_bigwigs(args.bigwigs, args.bin_size)
+        corr, intervals, n_used = compute(bins, args.method, args.skip_zeros, args.blacklist,
+                                          args.log1p, args.bootstrap, args.workers, args.seed)
+    except ValueError as err:
+        parser.error(str(err))
+    write_correlation_matrix(corr, args.output)
+    print(f"{n_used:,} of {bins.shape[0]:,} bins used")
+    print(corr.round(3).to_string())
+    if intervals is not None:
+        intervals_path = args.intervals or os.path.splitext(args.output)[0] + '_bootstrap.tsv'
+        intervals.to_csv(intervals_path, sep='\t', index=False)
+        print(intervals.round(4).to_string(index=False))
+    if args.plot:
+        plot_heatmap(corr, args.plot, f"{args.method.capitalize()} Correlation of Read Counts")
+
+
+if __name__ == '__main__':
+    main()
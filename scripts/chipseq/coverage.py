@@ -0,0 +1,270 @@
+"""Normalized coverage tracks and log2(IP/INPUT) ratios from sorted BAMs.
+
+Native replacement for ``bamCoverage``.  Each chromosome is split into
+chunks that a process pool counts in parallel: reads are extended to the
+fragment length, turned into a per-base depth with a difference array and
+summed per bin with ``np.add.reduceat``.  Bin sums (covered bases per bin)
+are kept as one memory-mapped int32 ``.npy`` per chromosome in
+``<name>.bins/``, next to a ``meta.json`` with the bin size, chromosome
+lengths and read count.
+
+From those arrays, without another BAM pass:
+
+* ``<name>.bw``: mean depth per bin scaled by ``CPM`` (per million reads),
+  ``RPGC`` (1x genome coverage) or left raw (``None``)
+* ``<ip>_vs_<input>.log2ratio.bw``: log2((IP + pseudocount) / (INPUT + pseudocount))
+  of the normalized tracks
+
+``BinnedCoverage`` reads a ``.bins`` directory back; the correlation and
+profile engines accept it in place of bigWigs.  Writing bigWigs requires
+pyBigWig.
+
+Usage:
+    python -m chipseq.coverage --bam IP_rep1.sorted.bam INPUT_rep1.sorted.bam \\
+        --pair IP_rep1:INPUT_rep1 --normalize CPM --extend 200 --workers 8 --outdir results/bigwig
+"""
+import argparse
+import json
+import os
+import shutil
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pysam
+
+from chipseq.cache import file_digest
+
+DEFAULT_BIN_SIZE = 50
+DEFAULT_CHUNK = 8_000_000
+# GRCh38 effective genome size for 50 bp reads (deepTools documentation)
+DEFAULT_EFFECTIVE_GENOME_SIZE = 2701495761
+NORMALIZATIONS = ['CPM', 'RPGC', 'None']
+
+FLAG_SKIP = 0x4 | 0x100 | 0x200 | 0x800
+FLAG_DUPLICATE = 0x400
+FLAG_REVERSE = 0x10
+
+
+def sample_name(bam_path):
+    name = os.path.basename(bam_path)
+    for suffix in ('.bam', '.sorted'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def count_chunk(bam_path, chrom, chrom_len, lo, hi, bin_size, extend, min_mapq, ignore_duplicates):
+    """Covered bases per bin for reads starting in [lo, hi).
+
+    Returns (first bin index, bin sums, reads counted); the bins reach past
+    the chunk on either side as far as fragments crossing it do.
+    """
+    starts, ends, reverse = array('q'), array('q'), array('b')
+    skip = FLAG_SKIP | (FLAG_DUPLICATE if ignore_duplicates else 0)
+    with pysam.AlignmentFile(bam_path, 'rb') as bam:
+        for read in bam.fetch(chrom, lo, hi):
+            if read.flag & skip or read.mapping_quality < min_mapq or read.reference_start < lo:
+                continue
+            starts.append(read.reference_start)
+            ends.append(read.reference_end)
+            reverse.append(1 if read.flag & FLAG_REVERSE else 0)
+    if len(starts) == 0:
+        return lo // bin_size, np.zeros(0, dtype=np.int32), 0
+
+    starts = np.frombuffer(starts, dtype=np.int64)
+    ends = np.frombuffer(ends, dtype=np.int64)
+    reverse = np.frombuffer(reverse, dtype=np.int8).astype(bool)
+    if extend > 0:
+        frag_start = np.where(reverse, ends - extend, starts)
+        frag_end = np.where(reverse, ends, starts + extend)
+    else:
+        frag_start, frag_end = starts, ends
+    frag_start = np.clip(frag_start, 0, chrom_len)
+    frag_end = np.clip(frag_end, 0, chrom_len)
+
+    # Fragments may reach past the chunk on either side
+    first_bin = min(int(frag_start.min()), lo) // bin_size
+    last_bin = -(-max(int(frag_end.max()), hi) // bin_size)
+    origin = first_bin * bin_size
+    span = last_bin * bin_size - origin
+    frag_start -= origin
+    frag_end -= origin
+
+    depth = np.cumsum(np.bincount(frag_start, minlength=span + 1)[:span].astype(np.int32)
+                      - np.bincount(frag_end, minlength=span + 1)[:span].astype(np.int32))
+    sums = np.add.reduceat(depth, np.arange(0, span, bin_size))
+    return first_bin, sums.astype(np.int32), len(starts)
+
+
+def build_bins(bam_path, outdir, name=None, bin_size=DEFAULT_BIN_SIZE, extend=0, min_mapq=0,
+               ignore_duplicates=False, workers=None, chunk_size=DEFAULT_CHUNK):
+    """Count one BAM into ``<outdir>/<name>.bins``; returns the directory"""
+    name = name or sample_name(bam_path)
+    bins_dir = os.path.join(outdir, f"{name}.bins")
+    tmp_dir = bins_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    with pysam.AlignmentFile(bam_path, 'rb') as bam:
+        chrom_sizes = dict(zip(bam.references, bam.lengths))
+
+    arrays = {chrom: np.lib.format.open_memmap(os.path.join(tmp_dir, f"{chrom}.npy"), mode='w+',
+                                               dtype=np.int32, shape=(-(-size // bin_size),))
+              for chrom, size in chrom_sizes.items()}
+    chunk_size = max(chunk_size // bin_size, 1) * bin_size
+    tasks = [(chrom, size, lo, min(lo + chunk_size, size))
+             for chrom, size in chrom_sizes.items() for lo in range(0, size, chunk_size)]
+    n_reads = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(chrom, pool.submit(count_chunk, bam_path, chrom, size, lo, hi, bin_size,
+                                       extend, min_mapq, ignore_duplicates))
+                   for chrom, size, lo, hi in tasks]
+        for chrom, future in futures:
+            first_bin, sums, reads = future.result()
+            target = arrays[chrom]
+            n = min(len(sums), len(target) - first_bin)
+            target[first_bin:first_bin + n] += sums[:n]
+            n_reads += reads
+    covered_bases = 0
+    for values in arrays.values():
+        values.flush()
+        covered_bases += int(values.sum(dtype=np.int64))
+    del arrays
+
+    meta = {'name': name, 'bam': os.path.basename(bam_path), 'bin_size': bin_size,
+            'extend': extend, 'reads': n_reads, 'covered_bases': covered_bases,
+            'chrom_sizes': chrom_sizes}
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(bins_dir, ignore_errors=True)
+    os.rename(tmp_dir, bins_dir)
+    return bins_dir
+
+
+class BinnedCoverage:
+    """Normalized view of a ``.bins`` directory, one chromosome at a time"""
+
+    def __init__(self, directory, normalize='CPM', effective_genome_size=DEFAULT_EFFECTIVE_GENOME_SIZE):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.label = self.meta['name']
+        self.bin_size = self.meta['bin_size']
+        self.normalize = normalize
+        self.effective_genome_size = effective_genome_size
+
+    def digest(self):
+        return f"{file_digest(os.path.join(self.directory, 'meta.json'))}-{self.normalize}"
+
+    def chroms(self):
+        return dict(self.meta['chrom_sizes'])
+
+    def scale(self):
+        """Factor turning mean depth per bin into the normalized value"""
+        if self.normalize == 'CPM':
+            return 1e6 / max(self.meta['reads'], 1)
+        if self.normalize == 'RPGC':
+            # reads x fragment length, as actually laid down on the genome
+            return self.effective_genome_size / max(self.meta['covered_bases'], 1)
+        return 1.0
+
+    def bin_sums(self, chrom):
+        """Raw covered bases per bin (memory-mapped int32)"""
+        return np.load(os.path.join(self.directory, f"{chrom}.npy"), mmap_mode='r')
+
+    def values(self, chrom, first=0, last=None):
+        """Normalized mean depth for bins [first, last) of a chromosome"""
+        size = self.meta['chrom_sizes'][chrom]
+        sums = self.bin_sums(chrom)[first:last]
+        widths = np.full(len(sums), self.bin_size, dtype=np.float64)
+        if len(sums) and first + len(sums) == len(self.bin_sums(chrom)):
+            # The last bin of the chromosome is usually short
+            widths[-1] = size - self.bin_size * (first + len(sums) - 1)
+        return (sums / widths * self.scale()).astype(np.float32)
+
+    def intervals(self, chrom):
+        """(starts, ends, values) per bin, the signal interface of chipseq.profile"""
+        return self.region(chrom, 0, self.meta['chrom_sizes'].get(chrom, 0))
+
+    def region(self, chrom, start, end):
+        """Bins overlapping [start, end), clipped to it; reads only those bins"""
+        size = self.meta['chrom_sizes'].get(chrom)
+        if size is None or end <= start:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float64)
+        first, last = start // self.bin_size, -(-min(end, size) // self.bin_size)
+        bin_starts = np.arange(first, last, dtype=np.int64) * self.bin_size
+        return (np.maximum(bin_starts, start), np.minimum(bin_starts + self.bin_size, min(end, size)),
+                self.values(chrom, first, last).astype(np.float64))
+
+
+def write_bigwig(filepath, chrom_sizes, bin_size, tracks):
+    """Write fixed-step bigWig from (chrom, values) pairs (requires pyBigWig)"""
+    import pyBigWig
+
+    bw = pyBigWig.open(filepath, 'w')
+    try:
+        bw.addHeader(list(chrom_sizes.items()))
+        for chrom, values in tracks:
+            values = np.asarray(values, dtype=np.float64)
+            if len(values):
+                bw.addEntries(chrom, 0, values=values if pyBigWig.numpy else values.tolist(),
+                              span=bin_size, step=bin_size)
+    finally:
+        bw.close()
+
+
+def log2_ratio(ip, control, chrom, pseudocount=1.0):
+    return np.log2((ip.values(chrom) + pseudocount) / (control.values(chrom) + pseudocount))
+
+
+def write_tracks(bins_dirs, pairs, outdir, normalize='CPM',
+                 effective_genome_size=DEFAULT_EFFECTIVE_GENOME_SIZE, pseudocount=1.0):
+    """Normalized bigWig per sample and a log2 ratio bigWig per (IP, INPUT) pair"""
+    coverage = {cov.label: cov for cov in (BinnedCoverage(d, normalize, effective_genome_size)
+                                           for d in bins_dirs)}
+    written = []
+    for name, cov in coverage.items():
+        path = os.path.join(outdir, f"{name}.bw")
+        write_bigwig(path, cov.chroms(), cov.bin_size,
+                     ((chrom, cov.values(chrom)) for chrom in cov.chroms()))
+        written.append(path)
+    for ip_name, input_name in pairs:
+        ip, control = coverage[ip_name], coverage[input_name]
+        if ip.bin_size != control.bin_size:
+            raise ValueError(f"{ip_name} and {input_name} were binned at different sizes")
+        path = os.path.join(outdir, f"{ip_name}_vs_{input_name}.log2ratio.bw")
+        write_bigwig(path, ip.chroms(), ip.bin_size,
+                     ((chrom, log2_ratio(ip, control, chrom, pseudocount)) for chrom in ip.chroms()))
+        written.append(path)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Normalized coverage and IP/INPUT ratio tracks")
+    parser.add_argument('--bam', nargs='+', required=True, help="Sorted, indexed BAMs")
+    parser.add_argument('--pair', action='append', default=[],
+                        help="IP:INPUT sample names for a log2 ratio track (repeatable)")
+    parser.add_argument('--bin-size', type=int, default=DEFAULT_BIN_SIZE)
+    parser.add_argument('--normalize', choices=NORMALIZATIONS, default='CPM')
+    parser.add_argument('--effective-genome-size', type=int, default=DEFAULT_EFFECTIVE_GENOME_SIZE)
+    parser.add_argument('--extend', type=int, default=0, help="Extend reads to this fragment length")
+    parser.add_argument('--min-mapq', type=int, default=0)
+    parser.add_argument('--ignore-duplicates', action='store_true')
+    parser.add_argument('--pseudocount', type=float, default=1.0)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--outdir', default='.')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.outdir, exist_ok=True)
+    pairs = [tuple(pair.split(':', 1)) for pair in args.pair]
+    bins_dirs = [build_bins(bam, args.outdir, bin_size=args.bin_size, extend=args.extend,
+                            min_mapq=args.min_mapq, ignore_duplicates=args.ignore_duplicates,
+                            workers=args.workers)
+                 for bam in args.bam]
+    for path in write_tracks(bins_dirs, pairs, args.outdir, args.normalize,
+                             args.effective_genome_size, args.pseudocount):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Local over-representation analysis against GMT gene-set libraries.
+
+Replaces the manual Enrichr upload: each library is loaded into a sparse
+gene x term incidence matrix, overlaps for every term come from one sparse
+mat-vec, and hypergeometric p-values, Benjamini-Hochberg adjusted p-values,
+odds ratios and combined scores are computed for all terms at once.
+
+Tables are written in the layout of Enrichr's downloadable tables
+(``Term, Overlap, P-value, Adjusted P-value, ..., Genes``).  The combined
+score is Enrichr's ``-ln(p) * odds ratio``.  Results differ from the website
+only through the gene universe: Enrichr tests against its own background,
+whereas here it is the genes of the library (or ``background``), which
+shifts p-values, odds ratios and combined scores accordingly.
+
+Usage:
+    python -m chipseq.enrichment --genes results/genes_for_enrichr.txt \\
+        --gmt refs/gmt/MSigDB_Hallmark_2020.gmt --outdir results/enrichment
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import hypergeom
+
+ENRICHR_COLUMNS = ['Term', 'Overlap', 'P-value', 'Adjusted P-value', 'Old P-value',
+                   'Old Adjusted P-value', 'Odds Ratio', 'Combined Score', 'Genes']
+
+
+class GeneSetLibrary:
+    """A GMT library held as a sparse gene x term incidence matrix"""
+
+    def __init__(self, name, terms, gene_sets):
+        self.name = name
+        self.terms = np.asarray(terms, dtype=object)
+        gene_sets = [pd.unique(np.asarray(s, dtype=object)) for s in gene_sets]
+        all_genes = np.concatenate(gene_sets) if gene_sets else np.empty(0, dtype=object)
+        self.genes = pd.Index(pd.unique(all_genes))
+        rows = self.genes.get_indexer(all_genes)
+        cols = np.repeat(np.arange(len(gene_sets)), [len(s) for s in gene_sets])
+        self.incidence = sparse.csc_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(len(self.genes), len(gene_sets)))
+
+    @classmethod
+    def from_gmt(cls, filepath, name=None):
+        """Load a GMT file: term, description, then one gene per column"""
+        terms, gene_sets = [], []
+        with open(filepath, 'r') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) < 3:
+                    continue
+                terms.append(parts[0])
+                # Enrichr GMTs may carry ',weight' after gene symbols
+                gene_sets.append([g.split(',')[0] for g in parts[2:] if g])
+        name = name or os.path.splitext(os.path.basename(filepath))[0]
+        return cls(name, terms, gene_sets)
+
+
+def benjamini_hochberg(pvalues):
+    """BH-adjusted p-values, in the input order"""
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    n = len(pvalues)
+    if n == 0:
+        return pvalues
+    order = np.argsort(pvalues)
+    scaled = pvalues[order] * n / np.arange(1, n + 1)
+    adjusted = np.minimum.accumulate(scaled[::-1])[::-1]
+    out = np.empty(n)
+    out[order] = np.minimum(adjusted, 1.0)
+    return out
+
+
+def enrich(gene_list, library, background=None):
+    """Hypergeometric enrichment of ``gene_list`` in every term of ``library``.
+
+    The background defaults to all genes in the library; query genes outside
+    the background are ignored.  Returns an Enrichr-layout DataFrame sorted
+    by p-value, with terms that share no genes with the list left out.
+    """
+    library_genes = library.genes
+    incidence = library.incidence
+    if background is None:
+        universe = library_genes
+    else:
+        universe = pd.Index(pd.unique(np.asarray(list(background), dtype=object)))
+        in_universe = universe.get_indexer(library_genes) >= 0
+        incidence = incidence[in_universe]
+        library_genes = library_genes[in_universe]
+    set_sizes = np.asarray(incidence.sum(axis=0)).ravel()
+
+    query = pd.unique(np.asarray(list(gene_list), dtype=object))
+    n_universe = len(universe)
+    n_query = int(np.sum(universe.get_indexer(query) >= 0))
+    query_rows = library_genes.get_indexer(query)
+    in_query = np.zeros(len(library_genes), dtype=np.int32)
+    in_query[query_rows[query_rows >= 0]] = 1
+
+    overlap = incidence.T @ in_query
+    tested = overlap > 0
+    k, K = overlap[tested], set_sizes[tested]
+
+    pvalues = hypergeom.sf(k - 1, n_universe, K, n_query)
+    adjusted = benjamini_hochberg(pvalues)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        odds = (k * (n_universe - K - n_query + k)) / ((n_query - k) * (K - k))
+    odds = np.where(np.isnan(odds), np.inf, odds)
+    combined = -np.log(np.maximum(pvalues, np.finfo(np.float64).tiny)) * odds
+
+    # Gene strings only for tested terms: column slices of the query submatrix
+    query_mask = in_query.astype(bool)
+    hits = incidence[query_mask][:, np.flatnonzero(tested)].tocsc()
+    hit_names = np.asarray(library_genes[query_mask], dtype=object)
+    genes = [';'.join(hit_names[hits.indices[hits.indptr[i]:hits.indptr[i + 1]]])
+             for i in range(hits.shape[1])]
+
+    table = pd.DataFrame({
+        'Term': library.terms[tested],
+        'Overlap': [f"{a}/{b}" for a, b in zip(k, K)],
+        'P-value': pvalues,
+        'Adjusted P-value': adjusted,
+        'Old P-value': 0,
+        'Old Adjusted P-value': 0,
+        'Odds Ratio': odds,
+        'Combined Score': combined,
+        'Genes': genes,
+    }, columns=ENRICHR_COLUMNS)
+    return table.sort_values('P-value', kind='stable').reset_index(drop=True)
+
+
+def read_gene_list(filepath):
+    with open(filepath, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def run_enrichment(gene_list, gmt_paths, outdir, background=None):
+    """Enrich against each GMT library and write ``<library>_table.txt`` files"""
+    os.makedirs(outdir, exist_ok=True)
+    tables = {}
+    for gmt_path in gmt_paths:
+        library = GeneSetLibrary.from_gmt(gmt_path)
+        table = enrich(gene_list, library, background)
+        table.to_csv(os.path.join(outdir, f"{library.name}_table.txt"), sep='\t', index=False)
+        tables[library.name] = table
+    return tables
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hypergeometric gene-set enrichment")
+    parser.add_argument('--genes', required=True, help="Gene list, one symbol per line")
+    parser.add_argument('--gmt', required=True, action='append', help="GMT library (repeatable)")
+    parser.add_argument('--background', help="Background gene list (default: library genes)")
+    parser.add_argument('--outdir', default='results/enrichment')
+    args = parser.parse_args(argv)
+
+    background = read_gene_list(args.background) if args.background else None
+    tables = run_enrichment(read_gene_list(args.genes), args.gmt, args.outdir, background)
+    for name, table in tables.items():
+        n_sig = int((table['Adjusted P-value'] < 0.05).sum())
+        print(f"{name}: {len(table):,} terms tested, {n_sig:,} with adjusted p < 0.05")
+
+
+if __name__ == '__main__':
+    main()
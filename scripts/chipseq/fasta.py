@@ -0,0 +1,213 @@
+"""Memory-mapped FASTA access through a samtools faidx index.
+
+The ``.fai`` index (name, length, byte offset, bases per line, bytes per
+line) gives the file position of every base, so sequence is read straight
+out of a read-only ``mmap`` of the FASTA without parsing it: a region on
+one line is a zero-copy view, and a batch of fixed-width windows (peaks,
+background regions) is one vectorized gather over the mapped bytes.
+Worker processes that open the same FASTA share its pages through the OS
+page cache.
+
+The index is ``<fasta>.fai`` when present, otherwise it is built once per
+FASTA content into the asset store (``chipseq.assets``), in the same
+layout samtools writes.  Only uncompressed FASTA is supported.
+
+Sequences are uint8 ASCII arrays; ``BASE_CODES`` maps bytes to 0-3 for
+A, C, G, T and 4 for anything else.
+
+Usage:
+    python -m chipseq.fasta faidx GRCh38.primary_assembly.genome.fa
+    python -m chipseq.fasta fetch GRCh38.primary_assembly.genome.fa chr21:8000000-8000200 chrX:100-160
+"""
+import argparse
+import mmap
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+FAI_COLUMNS = ['name', 'length', 'offset', 'linebases', 'linewidth']
+NEWLINE = ord('\n')
+CR = ord('\r')
+
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate('ACGT'):
+    BASE_CODES[ord(_base)] = BASE_CODES[ord(_base.lower())] = _code
+# Soft-masked (lowercase) bases as N, for HOMER-style -mask
+MASKED_BASE_CODES = BASE_CODES.copy()
+MASKED_BASE_CODES[[ord(b) for b in 'acgt']] = 4
+
+
+def _record_layout(data, name):
+    """(length, linebases, linewidth) of one record's sequence bytes"""
+    breaks = np.flatnonzero(data == NEWLINE)
+    line_starts = np.r_[0, breaks + 1]
+    line_ends = np.r_[breaks, len(data)]
+    bases = line_ends - line_starts
+    has_cr = bases > 0
+    has_cr[has_cr] = data[line_ends[has_cr] - 1] == CR
+    bases -= has_cr
+    # Blank lines at the end of a record (before the next header) carry no sequence
+    n_lines = len(bases)
+    while n_lines and bases[n_lines - 1] == 0:
+        n_lines -= 1
+    if n_lines == 0:
+        return 0, 0, 0
+    bases = bases[:n_lines]
+    widths = line_ends[:n_lines] - line_starts[:n_lines] + 1
+    if np.any(bases[:-1] != bases[0]) or np.any(widths[:-1] != widths[0]) or bases[-1] > bases[0]:
+        raise ValueError(f"{name}: lines of different lengths; the FASTA cannot be indexed")
+    return int(bases.sum()), int(bases[0]), int(widths[0])
+
+
+def build_faidx(fasta, fai_path):
+    """Write the samtools ``.fai`` index of an uncompressed FASTA"""
+    if fasta.endswith('.gz'):
+        raise ValueError(f"{fasta}: compressed FASTA is not supported; decompress it first")
+    rows = []
+    with open(fasta, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        pos = 0 if mm[:1] == b'>' else mm.find(b'\n>')
+        if pos > 0:
+            pos += 1
+        while pos != -1:
+            header_end = mm.find(b'\n', pos)
+            header_end = size if header_end == -1 else header_end
+            name = mm[pos + 1:header_end].split()[0].decode()
+            seq_start = min(header_end + 1, size)
+            next_header = mm.find(b'\n>', header_end)
+            seq_end = size if next_header == -1 else next_header + 1
+            data = np.frombuffer(mm, dtype=np.uint8, count=seq_end - seq_start, offset=seq_start)
+            length, linebases, linewidth = _record_layout(data, name)
+            del data
+            rows.append((name, length, seq_start, linebases, linewidth))
+            pos = -1 if next_header == -1 else next_header + 1
+    with open(fai_path, 'w') as f:
+        f.writelines('\t'.join(map(str, row)) + '\n' for row in rows)
+
+
+def _build_faidx_asset(fasta, outdir):
+    build_faidx(fasta, os.path.join(outdir, 'genome.fai'))
+
+
+def faidx_path(fasta, store=None):
+    """``<fasta>.fai`` (also beside a symlink's target) if it exists, else the index built into the asset store"""
+    for candidate in (fasta, os.path.realpath(fasta)):
+        if os.path.exists(candidate + '.fai'):
+            return candidate + '.fai'
+    from chipseq.assets import AssetStore
+    store = store or AssetStore()
+    return os.path.join(store.get('faidx', fasta, _build_faidx_asset), 'genome.fai')
+
+
+def read_faidx(fai_path):
+    return pd.read_csv(fai_path, sep='\t', header=None, usecols=range(5), names=FAI_COLUMNS,
+                       dtype={'name': str})
+
+
+class IndexedFasta:
+    """Read-only memory map of a FASTA, addressed through its faidx index"""
+
+    def __init__(self, fasta, fai=None, store=None):
+        self.path = fasta
+        index = read_faidx(fai or faidx_path(fasta, store))
+        self.names = index['name'].to_numpy(dtype=object)
+        self.lengths = index['length'].to_numpy(np.int64)
+        self._offset = index['offset'].to_numpy(np.int64)
+        self._linebases = np.maximum(index['linebases'].to_numpy(np.int64), 1)
+        self._linewidth = index['linewidth'].to_numpy(np.int64)
+        self._ids = {name: i for i, name in enumerate(self.names)}
+        self._file = open(fasta, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._bytes = np.frombuffer(self._mmap, dtype=np.uint8)
+
+    def close(self):
+        self._bytes = None
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def record_ids(self, names):
+        """Index record of each sequence name, -1 where the FASTA has none"""
+        return np.array([self._ids.get(name, -1) for name in names], dtype=np.int64)
+
+    def _byte_index(self, record, positions):
+        linebases = self._linebases[record]
+        return self._offset[record] + positions // linebases * self._linewidth[record] + positions % linebases
+
+    def fetch(self, name, start=0, end=None):
+        """Bases ``[start, end)`` of one sequence, clipped to its length; a view when on one line"""
+        record = self._ids[name]
+        length = self.lengths[record]
+        start = max(0, start)
+        end = length if end is None else min(end, length)
+        if end <= start:
+            return np.empty(0, dtype=np.uint8)
+        linebases = self._linebases[record]
+        if start // linebases == (end - 1) // linebases:
+            first = self._byte_index(record, start)
+            return self._bytes[first:first + end - start]
+        return self._bytes[self._byte_index(record, np.arange(start, end))]
+
+    def windows(self, records, starts, width, fill=ord('N')):
+        """``(n, width)`` bases starting at ``starts`` on ``records``; ``fill`` past sequence ends"""
+        records = np.asarray(records, dtype=np.int64)
+        positions = np.asarray(starts, dtype=np.int64)[:, None] + np.arange(width)
+        inside = (records[:, None] >= 0) & (positions >= 0) & (positions < self.lengths[records][:, None])
+        out = np.full(positions.shape, fill, dtype=np.uint8)
+        rows = np.broadcast_to(records[:, None], positions.shape)[inside]
+        out[inside] = self._bytes[self._byte_index(rows, positions[inside])]
+        return out
+
+
+def parse_region(region):
+    """'chr1:1,000-2,000' (1-based, inclusive) -> ('chr1', 999, 2000); 'chr1' -> ('chr1', 0, None)"""
+    match = re.match(r'^(.+?)(?::([\d,]+)(?:-([\d,]+))?)?$', region)
+    name, start, end = match.groups()
+    start = int(start.replace(',', '')) - 1 if start else 0
+    end = int(end.replace(',', '')) if end else None
+    return name, start, end
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory-mapped indexed FASTA access")
+    sub = parser.add_subparsers(dest='command', required=True)
+    faidx_parser = sub.add_parser('faidx', help="Build (or find) the .fai index and print its path")
+    faidx_parser.add_argument('fasta')
+    faidx_parser.add_argument('-o', '--output', help="Write the index here instead")
+    fetch_parser = sub.add_parser('fetch', help="Print regions as FASTA")
+    fetch_parser.add_argument('fasta')
+    fetch_parser.add_argument('regions', nargs='+', help="name[:start[-end]], 1-based inclusive")
+    fetch_parser.add_argument('--width', type=int, default=60)
+    args = parser.parse_args(argv)
+
+    if args.command == 'faidx':
+        if args.output:
+            build_faidx(args.fasta, args.output)
+            print(args.output)
+        else:
+            print(faidx_path(args.fasta))
+        return
+
+    with IndexedFasta(args.fasta) as fasta:
+        for region in args.regions:
+            name, start, end = parse_region(region)
+            if name not in fasta:
+                sys.exit(f"{args.fasta}: no sequence named {name!r}")
+            seq = fasta.fetch(name, start, end).tobytes().decode()
+            sys.stdout.write(f">{region}\n")
+            sys.stdout.writelines(seq[i:i + args.width] + '\n' for i in range(0, len(seq), args.width))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Split a (gzipped) FASTQ into chunks of N reads for scatter-gather alignment.
+
+Records are streamed as raw lines, four per read, without parsing, so the
+split runs at decompression speed and holds one line in memory whatever
+the chunk size.  Chunks are written with fast gzip compression since they
+only live until they are aligned.
+
+Usage:
+    python -m chipseq.fastq_split IP_rep1_trimmed.fastq.gz --reads 4000000 --prefix IP_rep1
+"""
+import argparse
+import gzip
+
+DEFAULT_CHUNK_READS = 4_000_000
+
+
+def _open(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def split_fastq(path, prefix, chunk_reads=DEFAULT_CHUNK_READS, compresslevel=1):
+    """Write ``<prefix>.chunkNNNN.fastq.gz`` files; returns their paths"""
+    chunk_lines = 4 * chunk_reads
+    paths = []
+    out = None
+    n_lines = 0
+    try:
+        with _open(path) as f:
+            for line in f:
+                if n_lines % chunk_lines == 0:
+                    if out is not None:
+                        out.close()
+                    paths.append(f"{prefix}.chunk{len(paths):04d}.fastq.gz")
+                    out = gzip.open(paths[-1], 'wb', compresslevel=compresslevel)
+                out.write(line)
+                n_lines += 1
+    finally:
+        if out is not None:
+            out.close()
+    if n_lines % 4:
+        raise ValueError(f"{path}: truncated FASTQ record at the end of the file")
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split a FASTQ into fixed-size chunks")
+    parser.add_argument('fastq')
+    parser.add_argument('--reads', type=int, default=DEFAULT_CHUNK_READS, help="Reads per chunk")
+    parser.add_argument('--prefix', required=True)
+    args = parser.parse_args(argv)
+
+    paths = split_fastq(args.fastq, args.prefix, args.reads)
+    print(f"Wrote {len(paths)} chunk(s) of up to {args.reads:,} reads")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Gene models from a GTF, indexed for region queries.
+
+Genes come from the GTF ``gene`` records; the exons of all transcripts of a
+gene are collapsed into one set of non-overlapping blocks (stored CSR-style:
+one flat start/end array plus per-gene offsets), which is what a locus
+track draws.  The parsed GTF goes through ``chipseq.cache``, so the text is
+read once per GTF version.
+"""
+import numpy as np
+import pandas as pd
+
+from chipseq.cache import load_gtf
+from chipseq.interval_index import IntervalIndex
+from chipseq.overlap import CHROM_STRIDE
+
+
+class GeneModels:
+    """Genes with collapsed exon blocks and an interval index over gene spans"""
+
+    def __init__(self, records):
+        genes = records[records['feature'] == 'gene']
+        gene_ids = np.asarray(genes['gene_id'], dtype=object)
+        gene_names = np.asarray(genes['gene_name'], dtype=object)
+        self.genes = pd.DataFrame({
+            'chrom': np.asarray(genes['chrom'], dtype=object),
+            'start': genes['start'].to_numpy(np.int64),
+            'end': genes['end'].to_numpy(np.int64),
+            'strand': np.asarray(genes['strand'], dtype=object),
+            'gene_id': gene_ids,
+            'gene_name': np.where(pd.isna(gene_names), gene_ids, gene_names),
+            'gene_type': np.asarray(genes['gene_type'], dtype=object),
+        })
+        self.index = IntervalIndex(self.genes['chrom'], self.genes['start'], self.genes['end'])
+        names = pd.Index(self.genes['gene_name'])
+        self._by_name = pd.Series(np.arange(len(names)), index=names)
+        self._by_name = self._by_name[~self._by_name.index.duplicated()]
+
+        exons = records[records['feature'] == 'exon']
+        gene_rows = pd.Index(self.genes['gene_id']).get_indexer(np.asarray(exons['gene_id'], dtype=object))
+        keep = gene_rows >= 0
+        self.exon_starts, self.exon_ends, self.exon_offsets = _collapse(
+            gene_rows[keep], exons['start'].to_numpy(np.int64)[keep],
+            exons['end'].to_numpy(np.int64)[keep], len(self.genes))
+
+    @classmethod
+    def from_gtf(cls, filepath, cache_dir=None):
+        return cls(load_gtf(filepath, cache_dir))
+
+    def __len__(self):
+        return len(self.genes)
+
+    def find(self, name):
+        """Row of the first gene with this name (or gene id), or None"""
+        row = self._by_name.get(name)
+        if row is None:
+            matches = np.flatnonzero(self.genes['gene_id'].to_numpy() == name)
+            row = matches[0] if len(matches) else None
+        return None if row is None else int(row)
+
+    def in_region(self, chrom, start, end):
+        """Rows of genes overlapping [start, end)"""
+        return self.index.range(chrom, start, end)
+
+    def exons(self, row):
+        """Collapsed exon blocks (starts, ends) of one gene"""
+        lo, hi = self.exon_offsets[row], self.exon_offsets[row + 1]
+        return self.exon_starts[lo:hi], self.exon_ends[lo:hi]
+
+
+def _collapse(groups, starts, ends, n_groups):
+    """Merge overlapping intervals within each group; returns CSR arrays"""
+    order = np.lexsort((starts, groups))
+    groups, starts, ends = groups[order], starts[order], ends[order]
+    # Shift groups apart on one axis so a single running max handles them all
+    offset = groups.astype(np.int64) * CHROM_STRIDE
+    running_end = np.maximum.accumulate(offset + ends)
+    new_block = np.ones(len(starts), dtype=bool)
+    new_block[1:] = (groups[1:] != groups[:-1]) | (offset[1:] + starts[1:] > running_end[:-1])
+    block_id = np.cumsum(new_block) - 1
+    block_starts = starts[new_block]
+    block_ends = np.zeros(len(block_starts), dtype=np.int64)
+    np.maximum.at(block_ends, block_id, ends)
+    offsets = np.searchsorted(groups[new_block], np.arange(n_groups + 1))
+    return block_starts, block_ends, offsets
@@ -0,0 +1,147 @@
+"""Array-backed per-chromosome interval index.
+
+Intervals are stored as one flat block sorted by (chromosome, start), with an
+offset table marking where each chromosome begins.  Alongside the sorted
+starts and ends a running maximum of the ends is kept per chromosome (an
+augmented sorted array), which bounds the search for overlapping intervals
+to ``O(log n + k)`` for peak-like intervals of similar width.
+
+Coordinates are half-open ``[start, end)`` like BED.  Query results are row
+ids: the position of each interval in the order it was given when the index
+was built (for ``from_bed``, the order of data lines in the file).
+"""
+import numpy as np
+
+
+class IntervalIndex:
+    """Sorted interval index supporting point, range, window and nearest queries"""
+
+    def __init__(self, chroms, starts, ends):
+        chroms = np.asarray(chroms, dtype=object)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if not (len(chroms) == len(starts) == len(ends)):
+            raise ValueError("chroms, starts and ends must have the same length")
+
+        names, codes = np.unique(chroms, return_inverse=True) if len(chroms) else (
+            np.empty(0, dtype=object), np.empty(0, dtype=np.int64))
+        order = np.lexsort((starts, codes))
+        self._set_arrays(
+            chrom_names=names,
+            offsets=np.searchsorted(codes[order], np.arange(len(names) + 1)),
+            starts=starts[order],
+            ends=ends[order],
+            ids=order.astype(np.int64),
+        )
+
+    def _set_arrays(self, chrom_names, offsets, starts, ends, ids):
+        self.chrom_names = np.asarray(chrom_names, dtype=object)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.starts = starts
+        self.ends = ends
+        self.ids = ids
+        self._chrom_lookup = {name: i for i, name in enumerate(self.chrom_names)}
+        # Running max of ends, restarted at every chromosome boundary
+        self.max_ends = np.empty_like(ends)
+        for lo, hi in zip(self.offsets[:-1], self.offsets[1:]):
+            self.max_ends[lo:hi] = np.maximum.accumulate(ends[lo:hi])
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def from_bed(cls, filepath):
+        """Build an index from the first three columns of a BED file"""
+        chroms, starts, ends = [], [], []
+        with open(filepath, 'r') as f:
+            for line in f:
+                if line.startswith(('#', 'track', 'browser')) or line.strip() == '':
+                    continue
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) >= 3:
+                    chroms.append(parts[0])
+                    starts.append(int(parts[1]))
+                    ends.append(int(parts[2]))
+        return cls(chroms, starts, ends)
+
+    def save(self, filepath):
+        """Write the index to an .npz file"""
+        np.savez(filepath,
+                 chrom_names=self.chrom_names.astype(str),
+                 offsets=self.offsets,
+                 starts=self.starts,
+                 ends=self.ends,
+                 ids=self.ids)
+
+    @classmethod
+    def load(cls, filepath):
+        """Load an index written by ``save``"""
+        with np.load(filepath, allow_pickle=False) as data:
+            index = cls.__new__(cls)
+            index._set_arrays(
+                chrom_names=data['chrom_names'].astype(object),
+                offsets=data['offsets'],
+                starts=data['starts'],
+                ends=data['ends'],
+                ids=data['ids'],
+            )
+        return index
+
+    def _bounds(self, chrom):
+        code = self._chrom_lookup.get(chrom)
+        if code is None:
+            return 0, 0
+        return self.offsets[code], self.offsets[code + 1]
+
+    def _overlapping_positions(self, chrom, start, end):
+        """Positions in the sorted arrays of intervals overlapping [start, end)"""
+        lo, hi = self._bounds(chrom)
+        if lo == hi or end <= start:
+            return np.empty(0, dtype=np.int64)
+        # Nothing before `first` reaches past `start`; nothing from `last` on starts before `end`
+        first = lo + np.searchsorted(self.max_ends[lo:hi], start, side='right')
+        last = lo + np.searchsorted(self.starts[lo:hi], end, side='left')
+        if first >= last:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.arange(first, last)
+        return candidates[self.ends[first:last] > start]
+
+    def range(self, chrom, start, end):
+        """Ids of intervals overlapping [start, end), ordered by start"""
+        return self.ids[self._overlapping_positions(chrom, start, end)]
+
+    def point(self, chrom, pos):
+        """Ids of intervals containing position ``pos``"""
+        return self.range(chrom, pos, pos + 1)
+
+    def window(self, chrom, pos, flank):
+        """Ids of intervals within ``flank`` bp of position ``pos``"""
+        return self.range(chrom, max(pos - flank, 0), pos + flank + 1)
+
+    def _distances(self, pos, positions):
+        """Distance from ``pos`` to each interval (0 if the interval contains it)"""
+        return np.maximum.reduce([self.starts[positions] - pos,
+                                  pos - (self.ends[positions] - 1),
+                                  np.zeros(len(positions), dtype=np.int64)])
+
+    def nearest(self, chrom, pos, k=1):
+        """Ids and distances of the ``k`` intervals closest to position ``pos``"""
+        lo, hi = self._bounds(chrom)
+        if lo == hi or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        # Any k intervals bound the k-th nearest distance; those around the
+        # insertion point are a cheap, usually tight choice
+        insert = lo + np.searchsorted(self.starts[lo:hi], pos, side='right')
+        seed = np.arange(max(lo, insert - k), min(hi, insert + k))
+        radius = np.sort(self._distances(pos, seed))[min(k, len(seed)) - 1]
+
+        positions = self._overlapping_positions(chrom, pos - radius, pos + radius + 1)
+        dist = self._distances(pos, positions)
+        keep = np.argsort(dist, kind='stable')[:k]
+        return self.ids[positions[keep]], dist[keep]
+
+    def count_overlaps(self, chroms, starts, ends):
+        """Number of indexed intervals overlapping each query region"""
+        return np.fromiter(
+            (len(self._overlapping_positions(c, s, e)) for c, s, e in zip(chroms, starts, ends)),
+            dtype=np.int64, count=len(chroms))
@@ -0,0 +1,221 @@
+"""Batch locus plots (Figure 2D/2E style) for many candidate genes.
+
+Each panel stacks one coverage track per sample, the peaks in the region
+and the collapsed GTF gene models.  Signal is read only for the plotted
+regions: bigWigs through their own index, ``chipseq.coverage`` bin arrays
+by slicing the memory-mapped bins.  Reads go through ``RegionFetcher``,
+which fetches fixed-size tiles and keeps recent ones in an LRU cache, so
+neighbouring loci drawn by the same worker share I/O.  Loci are sorted by
+position and handed to a process pool in contiguous batches for that
+reason.
+
+Usage:
+    python -m chipseq.locus --candidates results/down_candidates.tsv \\
+        --gtf refs/gencode.v45.primary_assembly.annotation.gtf \\
+        --coverage results/bigwig/IP_rep1.bins results/bigwig/INPUT_rep1.bins \\
+        --peaks results/peaks/RUNX1/filtered_peaks.bed --outdir results/loci
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from chipseq.gene_models import GeneModels
+from chipseq.interval_index import IntervalIndex
+from chipseq.peak_reader import ChromVocab, read_peak_array
+from chipseq.profile import BigWigSignal, bin_means
+
+DEFAULT_TILE = 1 << 20
+DEFAULT_FLANK = 5000
+DEFAULT_PIXELS = 800
+TRACK_COLORS = {'IP': '#1f4e9c', 'INPUT': '#7f7f7f'}
+
+
+class RegionFetcher:
+    """Tile-aligned reads from one signal source with an LRU tile cache"""
+
+    def __init__(self, signal, tile=DEFAULT_TILE, max_tiles=64):
+        self.signal = signal
+        self.tile = tile
+        self.chrom_sizes = signal.chroms()
+        self._read_tile = lru_cache(maxsize=max_tiles)(self._read_tile_uncached)
+
+    def _read_tile_uncached(self, chrom, index):
+        return self.signal.region(chrom, index * self.tile, (index + 1) * self.tile)
+
+    def means(self, chrom, start, end, n_bins):
+        """Mean signal in ``n_bins`` equal bins over [start, end)"""
+        if chrom not in self.chrom_sizes:
+            return np.full(n_bins, np.nan)
+        tiles = [self._read_tile(chrom, i) for i in range(start // self.tile, (end - 1) // self.tile + 1)]
+        intervals = tuple(np.concatenate(parts) for parts in zip(*tiles))
+        edges = np.linspace(start, end, n_bins + 1)[None, :]
+        return bin_means(intervals, edges, self.chrom_sizes[chrom])[0]
+
+
+def open_signal(path):
+    """A bigWig or ``chipseq.coverage`` .bins directory as a signal source"""
+    if os.path.isdir(path):
+        from chipseq.coverage import BinnedCoverage
+        return BinnedCoverage(path)
+    return BigWigSignal(path)
+
+
+class Locus:
+    def __init__(self, name, chrom, start, end, title=None):
+        self.name = name
+        self.chrom = chrom
+        self.start = start
+        self.end = end
+        self.title = title or name
+
+
+def resolve_loci(names, gene_models, flank=DEFAULT_FLANK, info=None):
+    """Gene span +/- flank for each name found in the gene models, sorted by position"""
+    loci, missing = [], []
+    for name in pd.unique(np.asarray(names, dtype=object)):
+        row = gene_models.find(name)
+        if row is None:
+            missing.append(name)
+            continue
+        gene = gene_models.genes.iloc[row]
+        title = f"{name} ({info[name]})" if info is not None and name in info else name
+        loci.append(Locus(name, gene['chrom'], max(int(gene['start']) - flank, 0),
+                          int(gene['end']) + flank, title))
+    loci.sort(key=lambda locus: (locus.chrom, locus.start))
+    return loci, missing
+
+
+def read_candidates(filepath, top=None):
+    """Gene names (and a short label) from a candidate table or a plain gene list"""
+    table = pd.read_csv(filepath, sep='\t')
+    name_col = next((c for c in ['Gene Name Clean', 'Gene Name', 'gene', 'genename'] if c in table.columns), None)
+    if name_col is None:
+        with open(filepath) as f:
+            return [line.strip() for line in f if line.strip()][:top], None
+    table = table.head(top) if top else table
+    info = None
+    if 'log2FoldChange' in table.columns:
+        info = {name: f"log2FC {lfc:.2f}" for name, lfc in zip(table[name_col], table['log2FoldChange'])}
+    return table[name_col].astype(str).str.strip().tolist(), info
+
+
+# Per-process state, set by _init_worker
+_state = {}
+
+
+def _init_worker(signal_paths, peaks_path, gtf_path, n_pixels, max_tiles):
+    _state['fetchers'] = [RegionFetcher(open_signal(p), max_tiles=max_tiles) for p in signal_paths]
+    _state['labels'] = [f.signal.label for f in _state['fetchers']]
+    if peaks_path:
+        vocab = ChromVocab()
+        peaks = read_peak_array(peaks_path, vocab=vocab)
+        _state['peaks'] = peaks
+        _state['peak_index'] = IntervalIndex(vocab.decode(peaks['chrom']), peaks['start'], peaks['end'])
+    else:
+        _state['peaks'] = None
+    _state['genes'] = GeneModels.from_gtf(gtf_path)
+    _state['n_pixels'] = n_pixels
+
+
+def render_locus(locus, outdir):
+    """Draw one locus panel; returns the written path"""
+    from chipseq.render import save_figure
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Rectangle
+
+    fetchers, labels, n_pixels = _state['fetchers'], _state['labels'], _state['n_pixels']
+    tracks = [f.means(locus.chrom, locus.start, locus.end, n_pixels) for f in fetchers]
+    x = np.linspace(locus.start, locus.end, n_pixels + 1)
+    ymax = max([np.nanmax(t) for t in tracks if np.isfinite(t).any()] + [1e-9]) * 1.05
+
+    heights = [1.0] * len(tracks) + [0.3, 0.6]
+    fig, axes = plt.subplots(len(heights), 1, figsize=(10, 1.1 * sum(heights) + 1), sharex=True,
+                             gridspec_kw={'height_ratios': heights})
+    for ax, label, values in zip(axes, labels, tracks):
+        color = TRACK_COLORS['INPUT' if 'INPUT' in label else 'IP']
+        ax.fill_between(x[:-1], np.nan_to_num(values), step='post', color=color, linewidth=0)
+        ax.set_ylim(0, ymax)
+        ax.set_ylabel(label, rotation=0, ha='right', va='center', fontsize=9)
+        ax.spines[['top', 'right']].set_visible(False)
+
+    peak_ax, gene_ax = axes[-2], axes[-1]
+    peak_ax.set_ylabel('Peaks', rotation=0, ha='right', va='center', fontsize=9)
+    if _state['peaks'] is not None:
+        for peak in _state['peaks'][_state['peak_index'].range(locus.chrom, locus.start, locus.end)]:
+            peak_ax.add_patch(Rectangle((peak['start'], 0.1), peak['end'] - peak['start'], 0.8,
+                                        color='#c0392b'))
+    peak_ax.set_ylim(0, 1)
+    peak_ax.set_yticks([])
+
+    genes = _state['genes']
+    rows = genes.in_region(locus.chrom, locus.start, locus.end)
+    for level, row in enumerate(rows[:6]):
+        gene = genes.genes.iloc[row]
+        y = -level
+        gene_ax.plot([max(gene['start'], locus.start), min(gene['end'], locus.end)], [y, y],
+                     color='black', linewidth=0.8)
+        for ex_start, ex_end in zip(*genes.exons(row)):
+            gene_ax.add_patch(Rectangle((ex_start, y - 0.3), ex_end - ex_start, 0.6, color='black'))
+        arrow = '→' if gene['strand'] == '+' else '←'
+        gene_ax.text(max(gene['start'], locus.start), y + 0.35, f"{gene['gene_name']} {arrow}",
+                     fontsize=8, va='bottom')
+    gene_ax.set_ylim(-max(len(rows[:6]), 1) + 0.4, 1)
+    gene_ax.set_yticks([])
+    gene_ax.set_xlim(locus.start, locus.end)
+    gene_ax.set_xlabel(f"{locus.chrom}:{locus.start:,}-{locus.end:,}")
+    for ax in (peak_ax, gene_ax):
+        ax.spines[['top', 'right', 'left']].set_visible(False)
+
+    fig.suptitle(locus.title, fontweight='bold')
+    return save_figure(os.path.join(outdir, f"locus_{locus.name}.png"), fig)[0]
+
+
+def _render_batch(loci, outdir):
+    return [render_locus(locus, outdir) for locus in loci]
+
+
+def render_loci(loci, signal_paths, gtf_path, outdir, peaks_path=None, workers=None,
+                n_pixels=DEFAULT_PIXELS, max_tiles=64):
+    """Render loci in a process pool, contiguous runs of loci per task"""
+    os.makedirs(outdir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    n_batches = min(len(loci), workers * 4) or 1
+    batches = [list(b) for b in np.array_split(np.array(loci, dtype=object), n_batches) if len(b)]
+    init_args = (signal_paths, peaks_path, gtf_path, n_pixels, max_tiles)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as pool:
+        return [path for paths in pool.map(_render_batch, batches, [outdir] * len(batches))
+                for path in paths]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch locus plots for candidate genes")
+    genes = parser.add_mutually_exclusive_group(required=True)
+    genes.add_argument('--genes', nargs='+', help="Gene names")
+    genes.add_argument('--candidates', help="Candidate table (e.g. down_candidates.tsv) or gene list")
+    parser.add_argument('--top', type=int, help="Only the first N candidates")
+    parser.add_argument('--gtf', required=True)
+    signals = parser.add_mutually_exclusive_group(required=True)
+    signals.add_argument('--bigwigs', nargs='+')
+    signals.add_argument('--coverage', nargs='+', help="chipseq.coverage .bins directories")
+    parser.add_argument('--peaks', help="Peak BED or HOMER file to overlay")
+    parser.add_argument('--flank', type=int, default=DEFAULT_FLANK)
+    parser.add_argument('--pixels', type=int, default=DEFAULT_PIXELS, help="Signal bins per panel")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--outdir', default='results/loci')
+    args = parser.parse_args(argv)
+
+    names, info = (args.genes, None) if args.genes else read_candidates(args.candidates, args.top)
+    loci, missing = resolve_loci(names, GeneModels.from_gtf(args.gtf), args.flank, info)
+    if missing:
+        print(f"Not in the GTF, skipped: {', '.join(missing)}")
+    paths = render_loci(loci, args.bigwigs or args.coverage, args.gtf, args.outdir, args.peaks,
+                        args.workers, args.pixels)
+    print(f"Rendered {len(paths)} locus plot(s) in {args.outdir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+"""Factor-style ChIP-seq peak calling, an alternative to HOMER findPeaks.
+
+Two passes, each with one process per chromosome:
+
+1. Tags.  Read 5' ends from a sorted, indexed BAM are reduced to
+   ``<name>.tags/<chrom>.{plus,minus}.npy`` (distinct positions, int32) with
+   per-position read counts alongside, which is all HOMER's tag directory
+   holds for this purpose.  Strand cross-correlation sums from
+   ``chipseq.bam_qc`` are collected on the way for the fragment length.
+2. Scan.  Tags are shifted by half a fragment towards the fragment center.
+   Because the position arrays are sorted, ``searchsorted`` gives the
+   cumulative tag count at any coordinate, so the count in a fixed-width
+   window around every tag, and in the local and control windows around a
+   peak, is a difference of two lookups.  Windows above a loose count floor
+   are merged into regions closer than the minimum peak distance and each
+   region keeps its highest window.
+
+Statistics are computed on all chromosomes together, following HOMER's
+factor style: a genome-wide Poisson tag threshold chosen for the requested
+FDR, then fold and Poisson p-value filters against the library-size scaled
+control (local lambda: the largest of the control window, the control local
+region and the genome background) and against the IP local region, and a
+clonality filter.  The output is HOMER peak text, which ``pos2bed.pl`` and
+the downstream steps read unchanged, and optionally the equivalent BED.
+
+``--ip`` and ``--control`` also take ``.tags`` directories built earlier
+with ``--tags-only``, so a control shared by several IPs is read once.
+
+Usage:
+    python -m chipseq.peak_caller --ip IP_rep1.sorted.bam --control INPUT_rep1.sorted.bam \\
+        -o IP_rep1_peaks.txt --bed IP_rep1_peaks.bed
+    python -m chipseq.peak_caller --ip INPUT_rep1.sorted.bam --tags-only
+    python -m chipseq.peak_caller --ip IP_rep1.tags --control INPUT_rep1.tags -o IP_rep1_peaks.txt
+"""
+import argparse
+import json
+import os
+import shutil
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pysam
+from scipy.special import gammainc
+
+from chipseq.bam_qc import DEFAULT_MAX_SHIFT, StrandCrossCorrelation
+from chipseq.coverage import FLAG_REVERSE, FLAG_SKIP, sample_name
+
+# HOMER findPeaks -style factor defaults
+DEFAULT_GENOME_SIZE = 2_000_000_000
+DEFAULT_FDR = 0.001
+DEFAULT_LOCAL_SIZE = 10000
+DEFAULT_FOLD = 4.0
+DEFAULT_PVALUE = 1e-4
+DEFAULT_MAX_CLONAL = 2.0
+NORMALIZE_TO = 1e7
+# Windows scanned before the FDR threshold is known
+SCAN_PVALUE = 0.01
+
+PEAK_COLUMNS = ['PeakID', 'chr', 'start', 'end', 'strand', 'Normalized Tag Count', 'focus ratio',
+                'findPeaks Score', 'Total Tags (normalized to Control Experiment)', 'Control Tags',
+                'Fold Change vs Control', 'p-value vs Control', 'Fold Change vs Local',
+                'p-value vs Local', 'Clonal Fold Change']
+
+
+def read_chromosome_tags(bam_path, chrom, chrom_len, tags_dir, min_mapq, max_shift):
+    """Write the distinct 5' tag positions of one chromosome; returns its counts"""
+    starts, ends, reverse = array('q'), array('q'), array('b')
+    with pysam.AlignmentFile(bam_path, 'rb') as bam:
+        for read in bam.fetch(chrom):
+            if read.flag & FLAG_SKIP or read.mapping_quality < min_mapq:
+                continue
+            starts.append(read.reference_start)
+            ends.append(read.reference_end)
+            reverse.append(1 if read.flag & FLAG_REVERSE else 0)
+    starts = np.frombuffer(starts, dtype=np.int64) if len(starts) else np.empty(0, np.int64)
+    ends = np.frombuffer(ends, dtype=np.int64) if len(ends) else np.empty(0, np.int64)
+    reverse = np.frombuffer(reverse, dtype=np.int8).astype(bool) if len(reverse) else np.empty(0, bool)
+    five_prime = np.clip(np.where(reverse, ends - 1, starts), 0, chrom_len - 1)
+
+    xcorr = StrandCrossCorrelation(max_shift)
+    xcorr.add_chromosome(five_prime[~reverse], five_prime[reverse], chrom_len)
+    tags = 0
+    for strand, positions in (('plus', five_prime[~reverse]), ('minus', five_prime[reverse])):
+        distinct, counts = np.unique(positions, return_counts=True)
+        np.save(os.path.join(tags_dir, f"{chrom}.{strand}.npy"), distinct.astype(np.int32))
+        np.save(os.path.join(tags_dir, f"{chrom}.{strand}.counts.npy"),
+                np.minimum(counts, np.iinfo(np.uint16).max).astype(np.uint16))
+        tags += len(distinct)
+    lengths = (ends - starts)[:10000]
+    return {'tags': tags, 'reads': len(starts), 'lengths': lengths, 'xcorr': xcorr}
+
+
+def build_tags(bam_path, outdir, name=None, min_mapq=10, max_shift=DEFAULT_MAX_SHIFT, workers=None):
+    """Tag arrays for one BAM in ``<outdir>/<name>.tags``; returns the directory"""
+    name = name or sample_name(bam_path)
+    tags_dir = os.path.join(outdir, f"{name}.tags")
+    tmp_dir = tags_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    with pysam.AlignmentFile(bam_path, 'rb') as bam:
+        chrom_sizes = dict(zip(bam.references, bam.lengths))
+
+    xcorr = StrandCrossCorrelation(max_shift)
+    tags, reads, lengths = {}, 0, []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {chrom: pool.submit(read_chromosome_tags, bam_path, chrom, size, tmp_dir,
+                                      min_mapq, max_shift)
+                   for chrom, size in sorted(chrom_sizes.items(), key=lambda item: -item[1])}
+        for chrom, future in futures.items():
+            result = future.result()
+            tags[chrom] = result['tags']
+            reads += result['reads']
+            lengths.append(result['lengths'])
+            xcorr.merge(result['xcorr'])
+    lengths = np.concatenate(lengths)
+    read_length = int(np.median(lengths)) if len(lengths) else 0
+
+    meta = {'name': name, 'bam': os.path.basename(bam_path), 'min_mapq': min_mapq,
+            'reads': reads, 'tags': tags, 'read_length': read_length,
+            'chrom_sizes': chrom_sizes, **xcorr.summary(read_length)}
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(tags_dir, ignore_errors=True)
+    os.rename(tmp_dir, tags_dir)
+    return tags_dir
+
+
+def read_meta(tags_dir):
+    with open(os.path.join(tags_dir, 'meta.json')) as f:
+        return json.load(f)
+
+
+def tags_for(path, outdir, min_mapq=10, workers=None):
+    """``path`` when it is a ``.tags`` directory, else the tags built from the BAM into ``outdir``"""
+    if not os.path.isdir(path):
+        return build_tags(path, outdir, min_mapq=min_mapq, workers=workers)
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        raise ValueError(f"{path}: not a .tags directory (no meta.json)")
+    return path
+
+
+def load_tags(tags_dir, chrom, shift=0):
+    """Sorted tag positions of both strands, each moved ``shift`` bp downstream
+
+    Returns (positions, reads per position, strand) with strand +1/-1.
+    """
+    parts = []
+    for strand, sign in (('plus', 1), ('minus', -1)):
+        path = os.path.join(tags_dir, f"{chrom}.{strand}.npy")
+        if not os.path.exists(path):
+            continue
+        positions = np.load(path).astype(np.int64) + sign * shift
+        counts = np.load(os.path.join(tags_dir, f"{chrom}.{strand}.counts.npy"))
+        parts.append((positions, counts, np.full(len(positions), sign, dtype=np.int8)))
+    if not parts:
+        return np.empty(0, np.int64), np.empty(0, np.uint16), np.empty(0, np.int8)
+    positions, counts, strands = (np.concatenate(p) for p in zip(*parts))
+    order = np.argsort(positions, kind='stable')
+    return positions[order], counts[order], strands[order]
+
+
+def _window_counts(positions, lo, hi):
+    return np.searchsorted(positions, hi) - np.searchsorted(positions, lo)
+
+
+def scan_chromosome(ip_dir, control_dir, chrom, size, shift, min_distance, local_size, min_tags):
+    """Best window per merged candidate region of one chromosome, with its counts"""
+    positions, counts, strands = load_tags(ip_dir, chrom, shift)
+    half = size // 2
+    centers = np.unique(positions)
+    tags = _window_counts(positions, centers - half, centers - half + size)
+    keep = tags >= min_tags
+    centers, tags = centers[keep], tags[keep]
+    if len(centers) == 0:
+        return None
+
+    # Candidate windows closer than min_distance belong to one region
+    region = np.cumsum(np.r_[True, np.diff(centers) >= min_distance])
+    order = np.lexsort((centers, -tags, region))
+    best = order[np.r_[True, region[order][1:] != region[order][:-1]]]
+    centers, tags = centers[best], tags[best]
+    lo, hi = centers - half, centers - half + size
+
+    raw = np.r_[0, np.cumsum(counts, dtype=np.int64)]
+    raw_tags = raw[np.searchsorted(positions, hi)] - raw[np.searchsorted(positions, lo)]
+    # Focus: share of tags whose unshifted 5' end lies on the side facing the center
+    plus_pos = positions[strands > 0] - shift
+    minus_pos = positions[strands < 0] + shift
+    reach = half + shift
+    focused = (_window_counts(plus_pos, centers - reach, centers) +
+               _window_counts(minus_pos, centers, centers + reach))
+    nearby = (_window_counts(plus_pos, centers - reach, centers + reach) +
+              _window_counts(minus_pos, centers - reach, centers + reach))
+    result = {
+        'chr': np.full(len(centers), chrom, dtype=object),
+        'center': centers,
+        'tags': tags,
+        'raw_tags': raw_tags,
+        'focus': np.where(nearby > 0, focused / np.maximum(nearby, 1), 0.0),
+        'local_tags': _window_counts(positions, centers - local_size // 2, centers + local_size // 2),
+        'control_tags': np.zeros(len(centers), dtype=np.int64),
+        'control_local': np.zeros(len(centers), dtype=np.int64),
+    }
+    if control_dir:
+        control, _, _ = load_tags(control_dir, chrom, shift)
+        result['control_tags'] = _window_counts(control, lo, hi)
+        result['control_local'] = _window_counts(control, centers - local_size // 2,
+                                                 centers + local_size // 2)
+    return result
+
+
+def poisson_sf(k, lam):
+    """P(X >= k) for X ~ Poisson(lam), continuous in k"""
+    k = np.asarray(k, dtype=np.float64)
+    return np.where(k <= 0, 1.0, gammainc(np.maximum(k, 1e-12), lam))
+
+
+def fdr_threshold(tags, expected, n_windows, fdr):
+    """Smallest tag count at which expected chance windows <= fdr * observed peaks"""
+    ks = np.arange(1, int(tags.max(initial=0)) + 2)
+    observed = len(tags) - np.searchsorted(np.sort(tags), ks)
+    false = n_windows * poisson_sf(ks, expected)
+    ok = (observed > 0) & (false <= fdr * observed)
+    return int(ks[np.argmax(ok)]) if ok.any() else int(ks[-1])
+
+
+def call_peaks(ip_dir, control_dir=None, fragment_length=None, size=None, genome_size=DEFAULT_GENOME_SIZE,
+               fdr=DEFAULT_FDR, local_size=DEFAULT_LOCAL_SIZE, fold=DEFAULT_FOLD, pvalue=DEFAULT_PVALUE,
+               max_clonal=DEFAULT_MAX_CLONAL, workers=None):
+    """HOMER-style peak table plus a dict of the run's parameters and counts"""
+    ip_meta = read_meta(ip_dir)
+    fragment_length = fragment_length or ip_meta['fragment_length'] or 150
+    size = size or int(round(1.5 * fragment_length))
+    shift = fragment_length // 2
+    min_distance = 2 * size
+    total = sum(ip_meta['tags'].values())
+    expected = total / genome_size * size
+    min_tags = max(int(np.argmax(poisson_sf(np.arange(1000), expected) < SCAN_PVALUE)), 2)
+
+    chroms = sorted((c for c, n in ip_meta['tags'].items() if n), key=lambda c: -ip_meta['tags'][c])
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(scan_chromosome, ip_dir, control_dir, chrom, size, shift,
+                               min_distance, local_size, min_tags) for chrom in chroms]
+        parts = [r for r in (f.result() for f in futures) if r is not None]
+    peaks = pd.DataFrame({k: np.concatenate([p[k] for p in parts]) for k in parts[0]}) if parts else None
+
+    info = {'total_tags': total, 'fragment_length': fragment_length, 'size': size,
+            'min_distance': min_distance, 'genome_size': genome_size, 'fdr': fdr,
+            'expected': expected, 'putative': 0, 'threshold': None, 'filtered_control': 0,
+            'filtered_local': 0, 'filtered_clonal': 0}
+    if peaks is None:
+        return pd.DataFrame(columns=PEAK_COLUMNS), info
+
+    threshold = max(fdr_threshold(peaks['tags'].to_numpy(), expected, genome_size / size, fdr), min_tags)
+    peaks = peaks[peaks['tags'] >= threshold].reset_index(drop=True)
+    info.update(putative=len(peaks), threshold=threshold)
+    tags = peaks['tags'].to_numpy(np.float64)
+    keep = np.ones(len(peaks), dtype=bool)
+
+    if control_dir:
+        control_total = sum(read_meta(control_dir)['tags'].values())
+        # IP tags in control units, against the largest control-derived lambda
+        to_control = control_total / total
+        ip_scaled = tags * to_control
+        control_lambda = np.maximum.reduce([
+            peaks['control_tags'].to_numpy(np.float64),
+            peaks['control_local'].to_numpy(np.float64) * size / local_size,
+            np.full(len(peaks), control_total / genome_size * size)])
+        control_lambda = np.maximum(control_lambda, 1.0)
+        fold_control = ip_scaled / control_lambda
+        p_control = poisson_sf(ip_scaled, control_lambda)
+        passed = (fold_control >= fold) & (p_control <= pvalue)
+        info['filtered_control'] = int((~passed).sum())
+        keep &= passed
+    else:
+        ip_scaled = tags
+        fold_control = p_control = np.full(len(peaks), np.nan)
+
+    flank = np.maximum(peaks['local_tags'].to_numpy(np.float64) - tags, 0)
+    local_lambda = np.maximum(flank * size / (local_size - size), expected)
+    fold_local = tags / local_lambda
+    p_local = poisson_sf(tags, local_lambda)
+    passed = (fold_local >= fold) & (p_local <= pvalue)
+    info['filtered_local'] = int((keep & ~passed).sum())
+    keep &= passed
+
+    clonal = peaks['raw_tags'].to_numpy(np.float64) / np.maximum(tags, 1)
+    info['filtered_clonal'] = int((keep & (clonal > max_clonal)).sum())
+    keep &= clonal <= max_clonal
+
+    normalized = tags * NORMALIZE_TO / total
+    table = pd.DataFrame({
+        'PeakID': '',
+        'chr': peaks['chr'],
+        'start': peaks['center'] - size // 2 + 1,
+        'end': peaks['center'] - size // 2 + size,
+        'strand': '+',
+        'Normalized Tag Count': normalized,
+        'focus ratio': peaks['focus'],
+        'findPeaks Score': normalized,
+        'Total Tags (normalized to Control Experiment)': ip_scaled,
+        'Control Tags': peaks['control_tags'],
+        'Fold Change vs Control': fold_control,
+        'p-value vs Control': p_control,
+        'Fold Change vs Local': fold_local,
+        'p-value vs Local': p_local,
+        'Clonal Fold Change': clonal,
+    })[keep]
+    table = table.sort_values(['findPeaks Score', 'chr', 'start'], ascending=[False, True, True],
+                              kind='stable', ignore_index=True)
+    table['PeakID'] = table['chr'] + '-' + (table.groupby('chr').cumcount() + 1).astype(str)
+    return table, info
+
+
+def write_homer_peaks(table, info, filepath, command):
+    """HOMER findPeaks text: '#' header block, column names, one peak per line"""
+    header = [
+        'HOMER-compatible peaks (chipseq.peak_caller)',
+        'Peak finding parameters:',
+        f"total peaks = {len(table)}",
+        f"peak size = {info['size']}",
+        'peaks found using tags on both strands',
+        f"minimum distance between peaks = {info['min_distance']}",
+        f"fragment length = {info['fragment_length']}",
+        f"genome size = {info['genome_size']}",
+        f"Total tags = {float(info['total_tags'])}",
+        f"expected tags per peak = {info['expected']:.3f}",
+        'maximum tags considered per bp = 1.0',
+        f"effective number of tags used for normalization = {NORMALIZE_TO}",
+        'Peaks have been centered at maximum tag pile-up',
+        f"FDR rate threshold = {info['fdr']:.9f}",
+        f"FDR tag threshold = {info['threshold']}",
+        f"number of putative peaks = {info['putative']}",
+        f"Putative peaks filtered by input = {info['filtered_control']}",
+        f"Putative peaks filtered by local signal = {info['filtered_local']}",
+        f"Putative peaks filtered for being too clonal = {info['filtered_clonal']}",
+        '',
+        f"cmd = {command}",
+        '',
+        'Column Headers:',
+    ]
+    with open(filepath, 'w') as f:
+        f.write(''.join(f"# {line}\n" if line else "#\n" for line in header))
+        f.write('#' + '\t'.join(PEAK_COLUMNS) + '\n')
+        table.to_csv(f, sep='\t', header=False, index=False, float_format='%.6g', na_rep='NA')
+
+
+def write_bed(table, filepath):
+    """Peaks as BED6 (0-based starts), the layout pos2bed.pl produces"""
+    bed = pd.DataFrame({'chr': table['chr'], 'start': table['start'] - 1, 'end': table['end'],
+                        'PeakID': table['PeakID'], 'score': table['findPeaks Score'],
+                        'strand': table['strand']})
+    bed.to_csv(filepath, sep='\t', header=False, index=False, float_format='%.6g')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Factor-style peak calling with an input control")
+    parser.add_argument('--ip', required=True, help="Sorted, indexed IP BAM, or its .tags directory")
+    parser.add_argument('--control', help="Sorted, indexed input BAM, or its .tags directory")
+    parser.add_argument('--fragment-length', type=int,
+                        help="Default: estimated by strand cross-correlation")
+    parser.add_argument('--size', type=int, help="Peak width (default: 1.5 x fragment length)")
+    parser.add_argument('--genome-size', type=int, default=DEFAULT_GENOME_SIZE)
+    parser.add_argument('--fdr', type=float, default=DEFAULT_FDR)
+    parser.add_argument('--local-size', type=int, default=DEFAULT_LOCAL_SIZE)
+    parser.add_argument('--fold', type=float, default=DEFAULT_FOLD,
+                        help="Fold over control and over local signal required")
+    parser.add_argument('--pvalue', type=float, default=DEFAULT_PVALUE)
+    parser.add_argument('--max-clonal', type=float, default=DEFAULT_MAX_CLONAL)
+    parser.add_argument('--min-mapq', type=int, default=10)
+    parser.add_argument('--tags-dir', default='.', help="Where the .tags directories are written")
+    parser.add_argument('--tags-only', action='store_true',
+                        help="Only build the .tags directory of each BAM given")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('-o', '--output', help="HOMER-style peak file")
+    parser.add_argument('--bed', help="Also write the peaks as BED")
+    args = parser.parse_args(argv)
+    if not args.output and not args.tags_only:
+        parser.error("-o/--output is required unless --tags-only is given")
+
+    os.makedirs(args.tags_dir, exist_ok=True)
+    try:
+        ip_dir = tags_for(args.ip, args.tags_dir, args.min_mapq, args.workers)
+        control_dir = (tags_for(args.control, args.tags_dir, args.min_mapq, args.workers)
+                       if args.control else None)
+    except ValueError as err:
+        parser.error(str(err))
+    if args.tags_only:
+        print('\n'.join(path for path in (ip_dir, control_dir) if path))
+        return
+    table, info = call_peaks(ip_dir, control_dir, args.fragment_length, args.size, args.genome_size,
+                             args.fdr, args.local_size, args.fold, args.pvalue, args.max_clonal,
+                             args.workers)
+    command = f"chipseq.peak_caller --ip {args.ip}" + (f" --control {args.control}" if args.control else '')
+    write_homer_peaks(table, info, args.output, command)
+    if args.bed:
+        write_bed(table, args.bed)
+    print(f"{len(table):,} peaks (fragment length {info['fragment_length']}, "
+          f"size {info['size']}, tag threshold {info['threshold']}) written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""Streaming, chunked reader for BED and HOMER peak files.
+
+Peaks are yielded as fixed-size NumPy record batches (``PEAK_DTYPE``) instead
+of Python tuples, so memory stays bounded by the batch size whatever the file
+size.  Chromosome names are mapped to small integer ids through a
+``ChromVocab`` that can be shared between files, so batches from different
+files can be compared directly.
+"""
+import numpy as np
+import pandas as pd
+
+PEAK_DTYPE = np.dtype([
+    ('chrom', np.int32),
+    ('start', np.int32),
+    ('end', np.int32),
+    ('score', np.float32),
+    ('strand', np.int8),
+])
+
+DEFAULT_BATCH_SIZE = 100_000
+
+# Column positions of chrom, start, end, score, strand for each layout
+_LAYOUTS = {
+    'bed': (0, 1, 2, 4, 5),
+    'homer': (1, 2, 3, 5, 4),
+}
+
+
+class ChromVocab:
+    """Chromosome name <-> integer id mapping, grown as new names are seen"""
+
+    def __init__(self, names=()):
+        self.names = []
+        self._ids = {}
+        for name in names:
+            self.id(name)
+
+    def id(self, name):
+        code = self._ids.get(name)
+        if code is None:
+            code = self._ids[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def encode(self, names):
+        """Vectorized ``id`` over an array of names"""
+        uniques, inverse = np.unique(np.asarray(names, dtype=object), return_inverse=True)
+        codes = np.array([self.id(name) for name in uniques], dtype=np.int32)
+        return codes[inverse.reshape(-1)]
+
+    def decode(self, codes):
+        return np.asarray(self.names, dtype=object)[codes]
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _detect_layout(filepath):
+    """'homer' if the first data line has a PeakID column first, otherwise 'bed'
+
+    pos2bed.pl keeps the HOMER '#' header in its BED output, so only the
+    first uncommented line is inspected.
+    """
+    with open(filepath, 'r') as f:
+        for line in f:
+            if line.startswith('PeakID'):
+                return 'homer'
+            if line.startswith('#') or line.strip() == '':
+                continue
+            parts = line.split('\t')
+            return 'bed' if len(parts) > 2 and parts[1].strip().isdigit() else 'homer'
+    return 'bed'
+
+
+def _encode_strand(values):
+    strand = np.zeros(len(values), dtype=np.int8)
+    values = np.asarray(values, dtype=object)
+    strand[values == '+'] = 1
+    strand[values == '-'] = -1
+    return strand
+
+
+def iter_peak_batches(filepath, vocab=None, batch_size=DEFAULT_BATCH_SIZE, layout=None):
+    """Yield ``PEAK_DTYPE`` record arrays of at most ``batch_size`` peaks.
+
+    ``layout`` is 'bed' (chrom, start, end, name, score, strand) or 'homer'
+    (PeakID, chr, start, end, strand, score, ...); it is detected from the
+    file when not given.  HOMER '#' header blocks and the annotatePeaks.pl
+    column-name line are skipped.
+    """
+    vocab = vocab if vocab is not None else ChromVocab()
+    layout = layout or _detect_layout(filepath)
+    chrom_col, start_col, end_col, score_col, strand_col = _LAYOUTS[layout]
+
+    try:
+        reader = pd.read_csv(filepath, sep='\t', comment='#', header=None,
+                             dtype=str, chunksize=batch_size)
+    except pd.errors.EmptyDataError:
+        return
+    for chunk in reader:
+        if layout == 'homer':
+            chunk = chunk[~chunk[0].str.startswith('PeakID')]
+        if len(chunk) == 0:
+            continue
+        batch = np.empty(len(chunk), dtype=PEAK_DTYPE)
+        batch['chrom'] = vocab.encode(chunk[chrom_col].to_numpy())
+        batch['start'] = chunk[start_col].astype(np.int64).to_numpy()
+        batch['end'] = chunk[end_col].astype(np.int64).to_numpy()
+        if score_col in chunk.columns:
+            batch['score'] = pd.to_numeric(chunk[score_col], errors='coerce').to_numpy(np.float32)
+        else:
+            batch['score'] = np.nan
+        if strand_col in chunk.columns:
+            batch['strand'] = _encode_strand(chunk[strand_col].to_numpy())
+        else:
+            batch['strand'] = 0
+        yield batch
+
+
+def read_peak_array(filepath, vocab=None, batch_size=DEFAULT_BATCH_SIZE, layout=None):
+    """Read a whole peak file into one compact ``PEAK_DTYPE`` array"""
+    batches = list(iter_peak_batches(filepath, vocab, batch_size, layout))
+    if not batches:
+        return np.empty(0, dtype=PEAK_DTYPE)
+    return np.concatenate(batches)
+
+
+class PeakSummary:
+    """Count, width and score summary accumulated batch by batch"""
+
+    def __init__(self):
+        self.count = 0
+        self.width_sum = 0
+        self.width_min, self.width_max = np.inf, -np.inf
+        self.score_sum, self.score_count = 0.0, 0
+        self.per_chrom = np.zeros(0, dtype=np.int64)
+
+    def add(self, batch):
+        if len(batch) == 0:
+            return
+        widths = batch['end'].astype(np.int64) - batch['start']
+        self.count += len(batch)
+        self.width_sum += int(widths.sum())
+        self.width_min = min(self.width_min, int(widths.min()))
+        self.width_max = max(self.width_max, int(widths.max()))
+        scores = batch['score'][~np.isnan(batch['score'])]
+        self.score_sum += float(scores.sum(dtype=np.float64))
+        self.score_count += len(scores)
+        chrom_counts = np.bincount(batch['chrom'])
+        if len(chrom_counts) > len(self.per_chrom):
+            self.per_chrom = np.pad(self.per_chrom, (0, len(chrom_counts) - len(self.per_chrom)))
+        self.per_chrom[:len(chrom_counts)] += chrom_counts
+
+    def passing(self, batches):
+        """Yield ``batches`` unchanged, adding each one on the way, for a one-pass consumer"""
+        for batch in batches:
+            self.add(batch)
+            yield batch
+
+    def result(self):
+        count = self.count
+        return {
+            'count': count,
+            'mean_width': self.width_sum / count if count else float('nan'),
+            'min_width': int(self.width_min) if count else 0,
+            'max_width': int(self.width_max) if count else 0,
+            'mean_score': self.score_sum / self.score_count if self.score_count else float('nan'),
+            'per_chrom_counts': self.per_chrom,
+        }
+
+
+def summarize_peaks(batches):
+    """``PeakSummary`` of a whole stream of batches"""
+    summary = PeakSummary()
+    for batch in batches:
+        summary.add(batch)
+    return summary.result()
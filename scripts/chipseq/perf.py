@@ -0,0 +1,320 @@
+"""Performance instrumentation and the per-run performance report.
+
+``measure`` (a context manager) and ``instrumented`` (a decorator) record
+wall time, CPU time, peak RSS and bytes read/written for a block of Python
+work.  The runner wraps every analysis stage in ``measure`` and writes the
+records to ``results/logs/stage_metrics.json``.
+
+On Linux, peak RSS is reset at the start of each block through
+``/proc/self/clear_refs``, so a worker process that runs several stages
+still reports each stage's own peak, and I/O comes from ``/proc/self/io``
+(``rchar``/``wchar``, the same counters as the Nextflow trace).  Elsewhere
+peak RSS is the process lifetime peak and I/O is not recorded.
+
+``report`` joins the Nextflow trace (one row per task: queueing, run time,
+CPU, memory, I/O) with the stage metrics into ``performance.json`` and
+``performance.html``, and compares each process/stage with the previous
+report found in the same directory.
+
+Usage:
+    python -m chipseq.perf report --trace results/pipeline_info/trace.txt \\
+        --stages results/logs/stage_metrics.json --outdir results/pipeline_info
+"""
+import argparse
+import contextlib
+import functools
+import json
+import os
+import resource
+import sys
+import time
+
+import pandas as pd
+
+REPORT_FORMAT = 1
+
+# Nextflow trace fields the report reads; nextflow.config requests these with trace.raw
+TRACE_FIELDS = ['task_id', 'process', 'tag', 'name', 'status', 'exit', 'submit', 'start',
+                'complete', 'duration', 'realtime', '%cpu', 'peak_rss', 'rchar', 'wchar']
+
+
+def _proc_io():
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _reset_peak_rss():
+    """Reset the kernel's high-water mark so the next peak is this block's; False if unsupported"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process since start or the last reset"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+@contextlib.contextmanager
+def measure(name, sink=None):
+    """Record wall/CPU time, peak RSS and I/O of the block into a dict
+
+    The dict is yielded up front and filled in on exit; it is also appended
+    to ``sink`` (a list) when one is given.
+    """
+    record = {'name': name}
+    _reset_peak_rss()
+    io_start = _proc_io()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    record['started'] = time.time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = time.perf_counter() - wall_start
+        record['cpu_s'] = time.process_time() - cpu_start
+        record['peak_rss'] = peak_rss_bytes()
+        io_end = _proc_io()
+        if io_start and io_end:
+            record['rchar'] = io_end[0] - io_start[0]
+            record['wchar'] = io_end[1] - io_start[1]
+        if sink is not None:
+            sink.append(record)
+
+
+def instrumented(name=None, sink=None):
+    """Decorator form of ``measure``; records go to ``sink`` or ``func.metrics``"""
+    def decorate(func):
+        records = sink if sink is not None else []
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(name or func.__qualname__, records):
+                return func(*args, **kwargs)
+        wrapper.metrics = records
+        return wrapper
+    return decorate
+
+
+def write_stage_metrics(records, path):
+    """Merge ``records`` into the stage metrics file, replacing earlier records of the same stage"""
+    existing = read_stage_metrics(path) if os.path.exists(path) else []
+    names = {record['name'] for record in records}
+    merged = [record for record in existing if record['name'] not in names] + list(records)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(merged, f, indent=2)
+
+
+def read_stage_metrics(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _number(values):
+    """Raw trace values ('1234', '98.5%', '-') as floats"""
+    return pd.to_numeric(values.astype(str).str.rstrip('%'), errors='coerce')
+
+
+def read_trace(path):
+    """Nextflow trace (``trace.raw = true``) with times in seconds and sizes in bytes"""
+    trace = pd.read_csv(path, sep='\t', dtype=str)
+    missing = [field for field in TRACE_FIELDS if field not in trace.columns]
+    if missing:
+        raise ValueError(f"{path}: trace is missing field(s) {', '.join(missing)}")
+    for col in ['submit', 'start', 'complete', 'duration', 'realtime', '%cpu', 'peak_rss', 'rchar', 'wchar']:
+        trace[col] = _number(trace[col])
+    for col in ['submit', 'start', 'complete', 'duration', 'realtime']:
+        trace[col] = trace[col] / 1000
+    # Time between submission and start is scheduler queueing (plus staging of inputs);
+    # what duration has beyond queue and realtime is unstaging and publishing overhead
+    trace['queue'] = (trace['start'] - trace['submit']).clip(lower=0)
+    trace['overhead'] = (trace['duration'] - trace['queue'] - trace['realtime']).clip(lower=0)
+    trace['cpu'] = trace['realtime'] * trace['%cpu'] / 100
+    return trace
+
+
+def summarize_trace(trace):
+    """Per-process totals from a trace table; cached tasks are counted but not timed"""
+    ran = trace[trace['status'] != 'CACHED']
+    grouped = ran.groupby('process')
+    table = pd.DataFrame({
+        'tasks': grouped.size(),
+        'wall_s': grouped['realtime'].sum(),
+        'max_task_s': grouped['realtime'].max(),
+        'cpu_s': grouped['cpu'].sum(),
+        'queue_s': grouped['queue'].sum(),
+        'overhead_s': grouped['overhead'].sum(),
+        'peak_rss': grouped['peak_rss'].max(),
+        'rchar': grouped['rchar'].sum(),
+        'wchar': grouped['wchar'].sum(),
+    }).reindex(pd.unique(trace['process']))
+    table['tasks'] = table['tasks'].fillna(0).astype(int)
+    by_process = trace.groupby('process')['status']
+    table['cached'] = by_process.apply(lambda s: int((s == 'CACHED').sum())).reindex(table.index)
+    table['failed'] = by_process.apply(lambda s: int((s == 'FAILED').sum())).reindex(table.index)
+    return table.rename_axis('name').reset_index().assign(source='nextflow')
+
+
+def summarize_stages(records):
+    """Stage metrics records as a table in the same columns as ``summarize_trace``"""
+    table = pd.DataFrame(records)
+    if table.empty:
+        return table
+    table['source'] = 'analysis'
+    table['tasks'] = 1
+    table['max_task_s'] = table['wall_s']
+    for col in ['rchar', 'wchar']:
+        if col not in table.columns:
+            table[col] = float('nan')
+    return table[['name', 'source', 'tasks', 'wall_s', 'max_task_s', 'cpu_s', 'peak_rss', 'rchar', 'wchar']]
+
+
+def build_report(trace_path=None, stages_path=None):
+    """Report document from a Nextflow trace and/or stage metrics"""
+    tables, run = [], {}
+    if trace_path and os.path.exists(trace_path):
+        trace = read_trace(trace_path)
+        tables.append(summarize_trace(trace))
+        ran = trace[trace['status'] != 'CACHED']
+        if len(ran):
+            run.update({
+                'span_s': ran['complete'].max() - ran['submit'].min(),
+                'tasks': int(len(ran)),
+                'cached_tasks': int((trace['status'] == 'CACHED').sum()),
+                'task_wall_s': ran['realtime'].sum(),
+                'cpu_s': ran['cpu'].sum(),
+                'queue_s': ran['queue'].sum(),
+                'overhead_s': ran['overhead'].sum(),
+            })
+    if stages_path and os.path.exists(stages_path):
+        stages = summarize_stages(read_stage_metrics(stages_path))
+        if len(stages):
+            tables.append(stages)
+            run['analysis_wall_s'] = stages['wall_s'].sum()
+    if not tables:
+        raise SystemExit("Neither a trace nor stage metrics were found")
+    table = pd.concat(tables, ignore_index=True)
+    return {
+        'format': REPORT_FORMAT,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'trace': trace_path,
+        'stages': stages_path,
+        'run': run,
+        'rows': json.loads(table.to_json(orient='records')),
+    }
+
+
+def compare_reports(current, previous):
+    """Rows of ``current`` with wall time and peak RSS ratios against ``previous``"""
+    table = pd.DataFrame(current['rows'])
+    if previous is None or not previous.get('rows'):
+        return table
+    before = pd.DataFrame(previous['rows']).set_index(['source', 'name'])
+    key = pd.MultiIndex.from_frame(table[['source', 'name']])
+    for col in ['wall_s', 'peak_rss']:
+        old = before[col].reindex(key).to_numpy()
+        table[f'prev_{col}'] = old
+        table[f'{col}_ratio'] = (table[col].to_numpy() / old).round(2)
+    return table
+
+
+def _fmt_bytes(n):
+    if pd.isna(n):
+        return ''
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(n) < 1024 or unit == 'TB':
+            return f"{n:,.1f} {unit}"
+        n /= 1024
+
+
+def _fmt_seconds(s):
+    if pd.isna(s):
+        return ''
+    return f"{s:,.1f}s" if s < 120 else f"{s / 60:,.1f}m"
+
+
+def render_html(report, table):
+    """Self-contained HTML page for the report"""
+    shown = table.copy()
+    for col in [c for c in shown.columns if c.endswith('_s')]:
+        shown[col] = shown[col].map(_fmt_seconds)
+    for col in [c for c in shown.columns if c in ('peak_rss', 'prev_peak_rss', 'rchar', 'wchar')]:
+        shown[col] = shown[col].map(_fmt_bytes)
+    run = ''.join(f"<tr><th>{k}</th><td>{_fmt_seconds(v) if k.endswith('_s') else v}</td></tr>"
+                  for k, v in report['run'].items())
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Pipeline performance report</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; margin-bottom: 2em; }}
+th, td {{ border: 1px solid #ccc; padding: 3px 8px; text-align: right; }}
+th {{ background: #f0f0f0; }}
+</style></head><body>
+<h1>Pipeline performance report</h1>
+<p>Created {report['created']} from {report['trace'] or 'no trace'} and {report['stages'] or 'no stage metrics'}.
+Queue is time from submission to start; overhead is the rest of a task's duration beyond its run
+time (staging, unstaging and publishing outputs).</p>
+<h2>Run</h2><table>{run}</table>
+<h2>Processes and analysis stages</h2>
+{shown.to_html(index=False, na_rep='')}
+</body></html>
+"""
+
+
+def write_report(report, outdir):
+    """Write performance.json/.html, comparing with and then replacing the previous report"""
+    os.makedirs(outdir, exist_ok=True)
+    json_path = os.path.join(outdir, 'performance.json')
+    previous = None
+    if os.path.exists(json_path):
+        with open(json_path) as f:
+            previous = json.load(f)
+        os.replace(json_path, os.path.join(outdir, 'performance.previous.json'))
+    table = compare_reports(report, previous)
+    with open(json_path, 'w') as f:
+        json.dump(dict(report, previous=previous['created'] if previous else None,
+                       rows=json.loads(table.to_json(orient='records'))), f, indent=2)
+    html_path = os.path.join(outdir, 'performance.html')
+    with open(html_path, 'w') as f:
+        f.write(render_html(report, table))
+    return json_path, html_path, table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pipeline performance report")
+    sub = parser.add_subparsers(dest='command', required=True)
+    report_parser = sub.add_parser('report', help="Join the Nextflow trace and stage metrics")
+    report_parser.add_argument('--trace', default='results/pipeline_info/trace.txt')
+    report_parser.add_argument('--stages', default='results/logs/stage_metrics.json')
+    report_parser.add_argument('--outdir', default='results/pipeline_info')
+    args = parser.parse_args(argv)
+
+    report = build_report(args.trace, args.stages)
+    json_path, html_path, table = write_report(report, args.outdir)
+    slowest = table.sort_values('wall_s', ascending=False).head(10).round(2)
+    slowest['peak_rss'] = slowest['peak_rss'].map(_fmt_bytes)
+    columns = [c for c in ['source', 'name', 'tasks', 'wall_s', 'queue_s', 'peak_rss', 'wall_s_ratio']
+               if c in slowest.columns]
+    print(slowest[columns].to_string(index=False))
+    print(f"Wrote {json_path} and {html_path}")
+
+
+if __name__ == '__main__':
+    main()
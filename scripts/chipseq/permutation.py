@@ -0,0 +1,250 @@
+"""Permutation null for RUNX1 binding at up- vs down-regulated genes.
+
+Peaks are shuffled within their own chromosome, keeping their widths and
+avoiding blacklist regions, and the fraction of up- and down-regulated genes
+with a peak within ``window`` bp of a TSS is recomputed.  Permutations run in
+batches: every batch is one vectorized overlap over all of its shuffled peak
+sets (each permutation gets its own block of the global coordinate axis),
+and batches are spread over a ``ProcessPoolExecutor``.  Sampling stops early
+once every p-value is resolved: either enough null statistics have been at
+least as extreme as observed (Besag & Clifford 1991) or the p-value's
+confidence interval lies clear of ``alpha``.  Batches are seeded and checked
+in order, so a seed gives the same result with any number of workers.
+
+Usage:
+    python -m chipseq.permutation --peaks results/homer/annotations/RUNX1/annotated_peaks.txt \\
+        --rnaseq results/GSE75070_MCF7_shRUNX1_shNS_RNAseq_log2_foldchange.txt \\
+        --genes-bed refs/hg38_genes.bed --chrom-sizes refs/hg38.chrom.sizes \\
+        --blacklist refs/hg38-blacklist.v2.bed -o results/figure_2F_permutation.tsv
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from chipseq.assets import load_blacklist
+from chipseq.overlap import any_overlap, global_coords
+from chipseq.peak_reader import PEAK_DTYPE, ChromVocab, read_peak_array
+
+STATISTICS = ['up_bound', 'down_bound', 'difference']
+
+
+def read_chrom_sizes(filepath, vocab):
+    """Chromosome lengths (chrom.sizes or .fai) indexed by vocab id"""
+    table = pd.read_csv(filepath, sep='\t', header=None, usecols=[0, 1], dtype={0: str})
+    sizes = np.zeros(len(vocab) + len(table), dtype=np.int64)
+    codes = vocab.encode(table[0].to_numpy())
+    sizes[codes] = table[1].to_numpy(np.int64)
+    return sizes[:len(vocab)]
+
+
+def read_gene_tss(filepath, vocab):
+    """TSS per BED6 gene record: (names, chrom ids, TSS positions)"""
+    genes = pd.read_csv(filepath, sep='\t', header=None, comment='#', dtype={0: str, 3: str})
+    strand = genes[5] if genes.shape[1] > 5 else pd.Series('+', index=genes.index)
+    tss = np.where(strand.to_numpy() == '-', genes[2].to_numpy() - 1, genes[1].to_numpy())
+    return genes[3].to_numpy(dtype=object), vocab.encode(genes[0].to_numpy()), tss.astype(np.int64)
+
+
+def allowed_segments(chrom_sizes, blacklist):
+    """Per chromosome, the [start, end) segments left after removing the blacklist"""
+    segments = {}
+    for code, size in enumerate(chrom_sizes):
+        if size <= 0:
+            continue
+        bl = blacklist[blacklist['chrom'] == code]
+        bl = bl[np.argsort(bl['start'], kind='stable')]
+        starts = np.r_[0, bl['end']].astype(np.int64)
+        ends = np.r_[bl['start'], size].astype(np.int64)
+        # Overlapping blacklist entries can give empty or inverted gaps
+        starts = np.maximum.accumulate(starts)
+        keep = ends > starts
+        segments[code] = (starts[keep], ends[keep])
+    return segments
+
+
+class BindingNull:
+    """Everything a worker needs to score one batch of shuffled peak sets"""
+
+    def __init__(self, peaks, gene_codes, gene_chroms, gene_tss, groups, segments, window):
+        self.peak_chroms = peaks['chrom'].astype(np.int64)
+        self.peak_widths = (peaks['end'] - peaks['start']).astype(np.int64)
+        self.gene_codes = gene_codes
+        self.gene_chroms = gene_chroms.astype(np.int64)
+        self.gene_tss = gene_tss
+        self.groups = groups
+        self.segments = segments
+        self.window = window
+        self.n_chroms = max(int(self.peak_chroms.max(initial=0)), int(self.gene_chroms.max(initial=0))) + 1
+        self.n_genes = int(gene_codes.max(initial=-1)) + 1
+
+    def bound_fractions(self, peak_starts, peak_ends):
+        """Bound fraction per group for peak sets stacked as rows of the start/end arrays"""
+        n_sets, per_set = peak_starts.shape
+        p_codes = np.arange(n_sets)[:, None] * self.n_chroms + self.peak_chroms[None, :]
+        p_start, p_end = global_coords(p_codes.ravel(), peak_starts.ravel(), peak_ends.ravel())
+
+        n_tss = len(self.gene_tss)
+        g_codes = np.arange(n_sets)[:, None] * self.n_chroms + self.gene_chroms[None, :]
+        g_start, g_end = global_coords(g_codes.ravel(),
+                                       np.tile(self.gene_tss - self.window, n_sets),
+                                       np.tile(self.gene_tss + self.window + 1, n_sets))
+        tss_bound = any_overlap(g_start, g_end, p_start, p_end)
+
+        # A gene is bound if any of its TSSs is
+        gene_bound = np.zeros((n_sets, self.n_genes), dtype=bool)
+        set_idx = np.repeat(np.arange(n_sets), n_tss)
+        gene_bound[set_idx[tss_bound], np.tile(self.gene_codes, n_sets)[tss_bound]] = True
+        return {name: gene_bound[:, codes].mean(axis=1) for name, codes in self.groups.items()}
+
+    def shuffle(self, rng, n_sets):
+        """Random starts keeping each peak's chromosome and width"""
+        starts = np.empty((n_sets, len(self.peak_chroms)), dtype=np.int64)
+        for code in np.unique(self.peak_chroms):
+            in_chrom = np.flatnonzero(self.peak_chroms == code)
+            seg_start, seg_end = self.segments[code]
+            widths = self.peak_widths[in_chrom]
+            # Sample within segments long enough for the widest peak on the chromosome
+            usable = np.maximum(seg_end - seg_start - widths.max(), 0)
+            cumulative = np.cumsum(usable)
+            draws = rng.integers(0, cumulative[-1], size=(n_sets, len(in_chrom)))
+            segment = np.searchsorted(cumulative, draws, side='right')
+            offset = draws - (cumulative[segment] - usable[segment])
+            starts[:, in_chrom] = seg_start[segment] + offset
+        return starts, starts + self.peak_widths
+
+    def run_batch(self, seed, n_sets):
+        rng = np.random.default_rng(seed)
+        starts, ends = self.shuffle(rng, n_sets)
+        fractions = self.bound_fractions(starts, ends)
+        return np.column_stack([fractions['up'], fractions['down'], fractions['up'] - fractions['down']])
+
+
+def _extreme(null, observed):
+    """Null values at least as extreme: one-sided for fractions, two-sided for the difference"""
+    return np.column_stack([null[:, 0] >= observed[0],
+                            null[:, 1] >= observed[1],
+                            np.abs(null[:, 2]) >= abs(observed[2])])
+
+
+def _resolved(n_extreme, n_done, alpha, min_extreme, z=2.576):
+    if n_extreme >= min_extreme:
+        return True
+    p = (n_extreme + 1) / (n_done + 1)
+    half_width = z * np.sqrt(p * (1 - p) / n_done)
+    return p - half_width > alpha or p + half_width < alpha
+
+
+def permutation_test(null_model, observed, n_permutations=10000, batch_size=100, workers=None,
+                     seed=None, alpha=0.05, min_extreme=20):
+    """Permutation p-values for ``observed`` (up, down, up - down bound fractions)"""
+    n_batches = -(-n_permutations // batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(n_batches)
+    sizes = [min(batch_size, n_permutations - i * batch_size) for i in range(n_batches)]
+    n_extreme = np.zeros(len(STATISTICS), dtype=np.int64)
+    null_sum = np.zeros(len(STATISTICS))
+    n_done = 0
+    workers = workers or os.cpu_count() or 1
+    resolved = False
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Submit one round per worker at a time so early stopping wastes little.  Batches
+        # are taken in seed order and the stop is checked after each one, discarding the
+        # rest of the round, so the result does not depend on the worker count
+        for round_start in range(0, n_batches, workers):
+            round_end = round_start + workers
+            for null in pool.map(null_model.run_batch, seeds[round_start:round_end],
+                                 sizes[round_start:round_end]):
+                n_extreme += _extreme(null, observed).sum(axis=0)
+                null_sum += null.sum(axis=0)
+                n_done += len(null)
+                resolved = all(_resolved(n, n_done, alpha, min_extreme) for n in n_extreme)
+                if resolved:
+                    break
+            if resolved:
+                break
+
+    return pd.DataFrame({
+        'statistic': STATISTICS,
+        'observed': observed,
+        'null_mean': null_sum / n_done,
+        'p_value': (n_extreme + 1) / (n_done + 1),
+        'permutations': n_done,
+    })
+
+
+def build_null_model(peaks_path, rnaseq_path, genes_bed, chrom_sizes_path, blacklist_path=None,
+                     window=5000, padj=0.01, log2fc=1.0):
+    """Load inputs and return (null model, observed statistics)"""
+    vocab = ChromVocab()
+    peaks = read_peak_array(peaks_path, vocab=vocab)
+    names, gene_chroms, gene_tss = read_gene_tss(genes_bed, vocab)
+    chrom_sizes = read_chrom_sizes(chrom_sizes_path, vocab)
+    blacklist = (load_blacklist(blacklist_path, vocab)
+                 if blacklist_path else np.empty(0, dtype=PEAK_DTYPE))
+    segments = allowed_segments(chrom_sizes, blacklist)
+
+    # A peak is shuffled into a blacklist-free segment of its chromosome longer than
+    # itself; peaks with no such segment (chromosome without a size, e.g. unplaced
+    # contigs, or fully blacklisted) are left out
+    longest = np.zeros(len(vocab), dtype=np.int64)
+    for code, (seg_start, seg_end) in segments.items():
+        if len(seg_start):
+            longest[code] = (seg_end - seg_start).max()
+    shufflable = longest[peaks['chrom']] > peaks['end'].astype(np.int64) - peaks['start']
+    if not shufflable.all():
+        chroms = ', '.join(sorted(set(vocab.decode(peaks['chrom'][~shufflable]))))
+        print(f"Warning: {(~shufflable).sum():,} peak(s) left out, with no blacklist-free "
+              f"segment in the chromosome sizes wider than the peak: {chroms}")
+        peaks = peaks[shufflable]
+    if len(peaks) == 0:
+        raise ValueError(f"{peaks_path}: no peak can be shuffled; check --chrom-sizes and --blacklist")
+
+    rnaseq = pd.read_csv(rnaseq_path, sep='\t').dropna(subset=['padj'])
+    sig = rnaseq[(rnaseq['padj'] < padj) & (rnaseq['log2FoldChange'].abs() > log2fc)]
+    gene_index = pd.Index(pd.unique(names))
+    groups = {
+        'up': gene_index.get_indexer(pd.unique(sig.loc[sig['log2FoldChange'] > log2fc, 'genename'])),
+        'down': gene_index.get_indexer(pd.unique(sig.loc[sig['log2FoldChange'] < -log2fc, 'genename'])),
+    }
+    groups = {name: codes[codes >= 0] for name, codes in groups.items()}
+
+    model = BindingNull(peaks, gene_index.get_indexer(names), gene_chroms, gene_tss,
+                        groups, segments, window)
+    fractions = model.bound_fractions(peaks['start'].astype(np.int64)[None, :],
+                                      peaks['end'].astype(np.int64)[None, :])
+    observed = np.array([fractions['up'][0], fractions['down'][0],
+                         fractions['up'][0] - fractions['down'][0]])
+    return model, observed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Permutation test for peak-DE gene association")
+    parser.add_argument('--peaks', required=True, help="Peak BED or HOMER peak/annotation file")
+    parser.add_argument('--rnaseq', required=True, help="Fold-change table (genename, log2FoldChange, padj)")
+    parser.add_argument('--genes-bed', required=True, help="BED6 gene models named by gene symbol")
+    parser.add_argument('--chrom-sizes', required=True, help="chrom.sizes or .fai file")
+    parser.add_argument('--blacklist', help="Regions peaks may not be shuffled into")
+    parser.add_argument('--window', type=int, default=5000)
+    parser.add_argument('--permutations', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('-o', '--output', default='results/figure_2F_permutation.tsv')
+    args = parser.parse_args(argv)
+
+    try:
+        model, observed = build_null_model(args.peaks, args.rnaseq, args.genes_bed, args.chrom_sizes,
+                                           args.blacklist, args.window)
+    except ValueError as err:
+        parser.error(str(err))
+    result = permutation_test(model, observed, args.permutations, args.batch_size,
+                              args.workers, args.seed, args.alpha)
+    result.to_csv(args.output, sep='\t', index=False)
+    print(result.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
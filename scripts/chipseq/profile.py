@@ -0,0 +1,320 @@
+"""Scale-regions signal profiles over gene bodies.
+
+Native replacement for ``computeMatrix scale-regions`` + ``plotProfile``.
+Each gene becomes a row of bins: ``upstream`` bp before the TSS in
+``bin_size`` bins, the gene body scaled to ``body_length / bin_size`` bins,
+and ``downstream`` bp after the TES, oriented by strand.
+
+A bigWig (or a ``chipseq.coverage`` bin array) is read one chromosome at a
+time as a piecewise-constant signal.  The running integral of that signal at
+every bin edge of every gene on the chromosome gives all bin means in one
+vectorized step (a ``reduceat`` over bin edges that also handles the
+fractional edges of scaled gene bodies).
+Bases without a bigWig interval count as zero; bins entirely off the
+chromosome are NaN.
+
+Per-gene profiles are cached as one float32 ``.npy`` per bigWig under the
+cache directory, keyed on the bigWig, gene BED and layout, so regrouping or
+restyling never touches the signal again.  Meta-profiles are reduced from
+the memory-mapped cache in row chunks, per group (e.g. up/down/unchanged
+genes from the GSE75070 fold-change table), without loading the whole
+gene x bin matrix.
+
+Usage:
+    python -m chipseq.profile --bigwigs IP_rep1.bw IP_rep2.bw --genes refs/hg38_genes.bed \\
+        -b 2000 -a 2000 --rnaseq results/GSE75070_MCF7_shRUNX1_shNS_RNAseq_log2_foldchange.txt \\
+        -o results/profile_data.tsv --plot results/profile_plot.png
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from chipseq.cache import default_cache_dir, file_digest
+
+DEFAULT_BIN_SIZE = 10
+DEFAULT_BODY_LENGTH = 1000
+DEFAULT_CHUNK_GENES = 4096
+DE_GROUPS = ['up', 'down', 'unchanged']
+
+
+class BigWigSignal:
+    """bigWig intervals per chromosome or region (requires pyBigWig)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.label = os.path.basename(path).rsplit('.', 1)[0]
+        self._bw = None
+
+    def __getstate__(self):
+        # Open handles stay in the process that opened them
+        return {**self.__dict__, '_bw': None}
+
+    def _open(self):
+        if self._bw is None:
+            import pyBigWig
+            self._bw = pyBigWig.open(self.path)
+        return self._bw
+
+    def digest(self):
+        return file_digest(self.path)
+
+    def chroms(self):
+        return dict(self._open().chroms())
+
+    def intervals(self, chrom):
+        """Sorted (starts, ends, values) arrays for one chromosome"""
+        return self.region(chrom, 0, self.chroms().get(chrom, 0))
+
+    def region(self, chrom, start, end):
+        """Intervals clipped to [start, end), read through the bigWig's own index"""
+        bw = self._open()
+        records = bw.intervals(chrom, start, end) if chrom in bw.chroms() and end > start else None
+        if not records:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float64)
+        table = np.asarray(records, dtype=np.float64)
+        return (np.maximum(table[:, 0].astype(np.int64), start),
+                np.minimum(table[:, 1].astype(np.int64), end), table[:, 2])
+
+
+class ProfileLayout:
+    """Bin layout of one scaled region: upstream flank, scaled body, downstream flank"""
+
+    def __init__(self, upstream=2000, downstream=2000, body_length=DEFAULT_BODY_LENGTH,
+                 bin_size=DEFAULT_BIN_SIZE):
+        self.upstream = upstream
+        self.downstream = downstream
+        self.body_length = body_length
+        self.bin_size = bin_size
+        self.up_bins = upstream // bin_size
+        self.body_bins = max(body_length // bin_size, 1)
+        self.down_bins = downstream // bin_size
+
+    @property
+    def n_bins(self):
+        return self.up_bins + self.body_bins + self.down_bins
+
+    def key(self):
+        return [self.upstream, self.downstream, self.body_length, self.bin_size]
+
+    def edges(self, starts, ends, minus):
+        """Ascending genomic bin edges, shape (genes, n_bins + 1)"""
+        starts = np.asarray(starts, dtype=np.float64)[:, None]
+        ends = np.asarray(ends, dtype=np.float64)[:, None]
+        body = starts + (ends - starts) * np.linspace(0, 1, self.body_bins + 1)[None, :]
+        # On the minus strand the upstream flank lies to the right of the gene
+        left_bins = np.where(minus, self.down_bins, self.up_bins)[:, None]
+        left = np.arange(-max(self.up_bins, self.down_bins), 0)[None, :]
+        out = np.empty((len(starts), self.n_bins + 1))
+        for n_left in np.unique(left_bins):
+            rows = left_bins[:, 0] == n_left
+            n_right = self.n_bins - self.body_bins - n_left
+            out[rows] = np.hstack([
+                starts[rows] + left[:, left.shape[1] - n_left:] * self.bin_size,
+                body[rows],
+                ends[rows] + np.arange(1, n_right + 1)[None, :] * self.bin_size,
+            ])
+        return out
+
+    def tick_positions(self):
+        """(bin positions, labels) for TSS/TES style x-axis ticks"""
+        return ([0, self.up_bins, self.up_bins + self.body_bins, self.n_bins],
+                [f"-{self.upstream / 1000:.1f}kb", 'TSS', 'TES', f"{self.downstream / 1000:.1f}kb"])
+
+
+def signal_integral(starts, ends, values, x):
+    """Area under a piecewise-constant signal from 0 to each position ``x``"""
+    if len(starts) == 0:
+        return np.zeros(np.shape(x))
+    lengths = ends - starts
+    cumulative = np.r_[0.0, np.cumsum(values * lengths)]
+    i = np.searchsorted(starts, x, side='right') - 1
+    safe = np.maximum(i, 0)
+    inside = np.clip(x - starts[safe], 0, lengths[safe])
+    return np.where(i >= 0, cumulative[safe] + values[safe] * inside, 0.0)
+
+
+def bin_means(signal, edges, chrom_len):
+    """Mean signal per bin for rows of ascending bin edges"""
+    clipped = np.clip(edges, 0, chrom_len)
+    area = signal_integral(*signal, clipped)
+    width = np.diff(clipped, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.diff(area, axis=1) / width
+    means[width <= 0] = np.nan
+    return means
+
+
+def read_gene_regions(filepath):
+    """Gene BED (BED6 or wider) as a DataFrame of chrom, start, end, name, strand"""
+    genes = pd.read_csv(filepath, sep='\t', header=None, comment='#', dtype={0: str, 3: str})
+    strand = genes[5] if genes.shape[1] > 5 else '+'
+    return pd.DataFrame({'chrom': genes[0], 'start': genes[1].astype(np.int64),
+                         'end': genes[2].astype(np.int64), 'name': genes[3], 'strand': strand})
+
+
+def compute_profiles(signal, genes, layout, out_path, chunk_genes=DEFAULT_CHUNK_GENES):
+    """Write the (genes, bins) profile matrix for one signal to ``out_path``"""
+    chrom_sizes = signal.chroms()
+    out_dir = os.path.dirname(out_path)
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, prefix='.tmp-', suffix='.npy')
+    os.close(fd)
+    matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                       shape=(len(genes), layout.n_bins))
+    chroms = genes['chrom'].to_numpy()
+    for chrom in pd.unique(chroms):
+        rows = np.flatnonzero(chroms == chrom)
+        if chrom not in chrom_sizes:
+            matrix[rows] = np.nan
+            continue
+        intervals = signal.intervals(chrom)
+        for lo in range(0, len(rows), chunk_genes):
+            block = rows[lo:lo + chunk_genes]
+            minus = genes['strand'].to_numpy()[block] == '-'
+            means = bin_means(intervals, layout.edges(genes['start'].to_numpy()[block],
+                                                      genes['end'].to_numpy()[block], minus),
+                              chrom_sizes[chrom])
+            means[minus] = means[minus, ::-1]
+            matrix[block] = means
+    matrix.flush()
+    del matrix
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def _profile_path(signal, genes_path, layout, cache_dir):
+    key = json.dumps([signal.digest(), file_digest(genes_path), layout.key()])
+    digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    return os.path.join(cache_dir, f"profile-{signal.label}-{digest}.npy")
+
+
+def load_profiles(signals, genes_path, layout, cache_dir=None, workers=None):
+    """Memory-mapped per-gene profiles for each signal, computing cache misses in parallel"""
+    cache_dir = cache_dir or default_cache_dir()
+    genes = read_gene_regions(genes_path)
+    paths = [_profile_path(signal, genes_path, layout, cache_dir) for signal in signals]
+    missing = [(signal, path) for signal, path in zip(signals, paths) if not os.path.exists(path)]
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(compute_profiles, [s for s, _ in missing], [genes] * len(missing),
+                          [layout] * len(missing), [p for _, p in missing]))
+    return genes, {signal.label: np.load(path, mmap_mode='r') for signal, path in zip(signals, paths)}
+
+
+def de_groups(gene_names, rnaseq, padj=0.01, log2fc=1.0):
+    """'up'/'down'/'unchanged' per gene (by symbol or RefSeq id), NaN if not tested"""
+    tested = rnaseq.dropna(subset=['padj'])
+    status = np.where((tested['padj'] < padj) & (tested['log2FoldChange'] > log2fc), 'up',
+                      np.where((tested['padj'] < padj) & (tested['log2FoldChange'] < -log2fc),
+                               'down', 'unchanged'))
+    by_symbol = pd.Series(status, index=np.asarray(tested['genename'], dtype=object))
+    transcripts = pd.DataFrame({'transcript': np.asarray(tested['transcript'], dtype=object),
+                                'status': status})
+    transcripts['transcript'] = transcripts['transcript'].str.split(',')
+    by_transcript = transcripts.explode('transcript').set_index('transcript')['status']
+    lookup = pd.concat([by_symbol, by_transcript])
+    lookup = lookup[~lookup.index.duplicated()]
+    return pd.Series(np.asarray(gene_names, dtype=object)).map(lookup).to_numpy()
+
+
+def meta_profiles(matrix, groups=None, chunk_genes=DEFAULT_CHUNK_GENES):
+    """NaN-aware mean profile per group, reduced over row chunks of ``matrix``.
+
+    Returns (group names, means of shape (groups, bins), genes per group).
+    """
+    if groups is None:
+        groups = np.full(matrix.shape[0], 'all', dtype=object)
+    names = [g for g in pd.unique(groups) if isinstance(g, str)]
+    names = [g for g in DE_GROUPS if g in names] + [g for g in names if g not in DE_GROUPS]
+    codes = pd.Index(names).get_indexer(groups)
+    sums = np.zeros((len(names), matrix.shape[1]))
+    counts = np.zeros((len(names), matrix.shape[1]))
+    for lo in range(0, matrix.shape[0], chunk_genes):
+        block = np.asarray(matrix[lo:lo + chunk_genes], dtype=np.float64)
+        code = codes[lo:lo + chunk_genes]
+        one_hot = np.zeros((len(block), len(names)))
+        valid = code >= 0
+        one_hot[np.flatnonzero(valid), code[valid]] = 1
+        observed = ~np.isnan(block)
+        sums += one_hot.T @ np.where(observed, block, 0)
+        counts += one_hot.T @ observed
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+    return names, means, np.bincount(codes[codes >= 0], minlength=len(names))
+
+
+def profile_table(profiles, layout, groups=None):
+    """Long table: sample, group, genes, bin, mean"""
+    frames = []
+    for label, matrix in profiles.items():
+        names, means, sizes = meta_profiles(matrix, groups)
+        for name, mean, size in zip(names, means, sizes):
+            frames.append(pd.DataFrame({'sample': label, 'group': name, 'genes': size,
+                                        'bin': np.arange(layout.n_bins), 'mean': mean}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def plot_profiles(table, layout, filepath, title="Signal Profile across Gene Body"):
+    """One line per sample, or one panel per sample with a line per group"""
+    from chipseq.render import save_figure
+    import matplotlib.pyplot as plt
+
+    samples = list(pd.unique(table['sample']))
+    grouped = table['group'].nunique() > 1
+    n_panels = len(samples) if grouped else 1
+    fig, axes = plt.subplots(1, n_panels, figsize=(5 * n_panels, 4), sharey=True, squeeze=False)
+    for i, sample in enumerate(samples):
+        ax = axes[0, i if grouped else 0]
+        for group, rows in table[table['sample'] == sample].groupby('group', sort=False):
+            label = f"{group} (n={rows['genes'].iat[0]:,})" if grouped else sample
+            ax.plot(rows['bin'], rows['mean'], label=label)
+        ticks, labels = layout.tick_positions()
+        ax.set_xticks(ticks)
+        ax.set_xticklabels(labels)
+        ax.set_title(sample if grouped else title)
+        ax.legend(frameon=False)
+    axes[0, 0].set_ylabel('Mean signal')
+    if grouped:
+        fig.suptitle(title)
+    save_figure(filepath, fig)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scale-regions signal profiles over genes")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--bigwigs', nargs='+')
+    source.add_argument('--coverage', nargs='+', help="chipseq.coverage .bins directories (CPM)")
+    parser.add_argument('--genes', required=True, help="Gene BED (BED6 or wider)")
+    parser.add_argument('-b', '--upstream', type=int, default=2000)
+    parser.add_argument('-a', '--downstream', type=int, default=2000)
+    parser.add_argument('--body-length', type=int, default=DEFAULT_BODY_LENGTH)
+    parser.add_argument('--bin-size', type=int, default=DEFAULT_BIN_SIZE)
+    parser.add_argument('--rnaseq', help="Fold-change table; groups genes into up/down/unchanged")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('-o', '--output', default='results/profile_data.tsv')
+    parser.add_argument('--plot', help="Profile plot path")
+    args = parser.parse_args(argv)
+
+    layout = ProfileLayout(args.upstream, args.downstream, args.body_length, args.bin_size)
+    if args.coverage:
+        from chipseq.coverage import BinnedCoverage
+        signals = [BinnedCoverage(path) for path in args.coverage]
+    else:
+        signals = [BigWigSignal(path) for path in args.bigwigs]
+    genes, profiles = load_profiles(signals, args.genes, layout, workers=args.workers)
+    groups = de_groups(genes['name'], pd.read_csv(args.rnaseq, sep='\t')) if args.rnaseq else None
+    table = profile_table(profiles, layout, groups)
+    table.to_csv(args.output, sep='\t', index=False)
+    print(table.groupby(['sample', 'group'], sort=False)['genes'].first().to_string())
+    if args.plot:
+        plot_profiles(table, layout, args.plot)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Headless figure rendering with draft/publication profiles.
+
+Importing this module switches matplotlib to the non-interactive Agg backend
+unless the code is running inside IPython/Jupyter or ``MPLBACKEND`` is set,
+so batch runs on headless nodes never block on ``plt.show()``.
+
+The profile picks DPI and output formats:
+
+    CHIPSEQ_RENDER_PROFILE=draft         PNG at 100 dpi
+    CHIPSEQ_RENDER_PROFILE=publication   PNG at 300 dpi (default)
+    CHIPSEQ_RENDER_PROFILE=print         PNG, PDF and SVG at 300 dpi
+
+``CHIPSEQ_FIGURE_FORMATS=png,svg`` overrides the formats of any profile.
+Independent figures are rendered in parallel by running their scripts as
+stages of ``chipseq.runner`` (``chipseq-analysis run --all --profile draft``).
+"""
+import os
+
+import matplotlib
+
+PROFILES = {
+    'draft': {'dpi': 100, 'formats': ['png']},
+    'publication': {'dpi': 300, 'formats': ['png']},
+    'print': {'dpi': 300, 'formats': ['png', 'pdf', 'svg']},
+}
+DEFAULT_PROFILE = 'publication'
+
+
+def in_notebook():
+    try:
+        from IPython import get_ipython
+    except ImportError:
+        return False
+    return get_ipython() is not None
+
+
+def configure_backend():
+    """Use Agg unless a backend was chosen explicitly or we are in IPython"""
+    if 'MPLBACKEND' not in os.environ and not in_notebook():
+        matplotlib.use('Agg', force=True)
+
+
+def is_interactive():
+    return matplotlib.get_backend().lower() != 'agg'
+
+
+def get_profile(name=None):
+    name = name or os.environ.get('CHIPSEQ_RENDER_PROFILE', DEFAULT_PROFILE)
+    if name not in PROFILES:
+        raise ValueError(f"Unknown render profile '{name}' (choose from {', '.join(PROFILES)})")
+    profile = dict(PROFILES[name])
+    formats = os.environ.get('CHIPSEQ_FIGURE_FORMATS')
+    if formats:
+        profile['formats'] = [f.strip().lower() for f in formats.split(',') if f.strip()]
+    return profile
+
+
+def save_figure(path, fig=None, profile=None):
+    """Save ``fig`` (default: current figure) in every format of the profile.
+
+    ``path`` names the primary output; other formats swap its extension.
+    The figure is shown on interactive backends and closed afterwards so
+    long batch runs don't accumulate open figures.  Returns the written paths.
+    """
+    import matplotlib.pyplot as plt
+
+    fig = fig or plt.gcf()
+    settings = get_profile(profile)
+    base, _ = os.path.splitext(path)
+    written = []
+    for fmt in settings['formats']:
+        out = f"{base}.{fmt}"
+        fig.savefig(out, dpi=settings['dpi'], bbox_inches='tight', format=fmt)
+        written.append(out)
+    if is_interactive():
+        plt.show()
+    plt.close(fig)
+    return written
+
+
+def show_image(path):
+    """Display an image inline in notebooks; elsewhere just report the path"""
+    if in_notebook():
+        from IPython.display import Image, display
+        display(Image(path))
+    else:
+        print(f"  {path}")
+
+
+configure_backend()
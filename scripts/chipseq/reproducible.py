@@ -0,0 +1,156 @@
+"""In-process replacement for the BEDTOOLS_INTERSECT + BEDTOOLS_REMOVE steps.
+
+Keeps each replicate-1 peak at most once if it overlaps a replicate-2 peak,
+optionally requiring a minimum overlap fraction (bedtools ``-f``, or ``-f -r``
+for reciprocal) and consistent score ranks between the matched peaks
+(an IDR-like filter).  Peaks touching the blacklist are then dropped
+(bedtools ``-v``) and the surviving rows of the replicate-1 BED are written
+unchanged.
+
+Replicate 2 and the blacklist are held in memory; replicate 1 is filtered
+in ``chipseq.peak_reader`` batches and its rows are written as each batch
+is decided, so memory does not grow with its size.
+
+Usage:
+    python -m chipseq.reproducible -a rep1.bed -b rep2.bed \\
+        --blacklist hg38-blacklist.v2.bed -o filtered_peaks.bed
+"""
+import argparse
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from chipseq.assets import load_blacklist
+from chipseq.overlap import any_overlap, global_coords, overlap_pairs
+from chipseq.peak_reader import DEFAULT_BATCH_SIZE, ChromVocab, iter_peak_batches, read_peak_array
+
+
+def read_bed_table(filepath):
+    """All columns of a BED file as strings, HOMER '#' headers skipped"""
+    try:
+        return pd.read_csv(filepath, sep='\t', comment='#', header=None, dtype=str)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame(columns=[0, 1, 2])
+
+
+def _data_lines(filepath):
+    """Lines of a BED holding peaks, in the order ``iter_peak_batches`` yields them"""
+    with open(filepath) as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                yield line
+
+
+def _peak_coords(peaks):
+    return global_coords(peaks['chrom'], peaks['start'], peaks['end'])
+
+
+def _rank_fraction(scores):
+    """Score rank scaled to [0, 1], 1 = strongest; ties share their mean rank"""
+    if len(scores) < 2:
+        return np.ones(len(scores))
+    return (pd.Series(scores).rank(method='average').to_numpy() - 1) / (len(scores) - 1)
+
+
+def score_ranks(filepath, score_col):
+    """Rank fraction of every peak by column ``score_col``, reading only that column"""
+    read = dict(sep='\t', comment='#', header=None, dtype=str)
+    try:
+        column = pd.read_csv(filepath, usecols=[score_col], **read)[score_col]
+    except pd.errors.EmptyDataError:
+        return np.ones(0)
+    except ValueError:
+        # No such column: every peak scores 0
+        column = pd.read_csv(filepath, usecols=[0], **read)[0].map(lambda _: '0')
+    return _rank_fraction(pd.to_numeric(column, errors='coerce').fillna(0).to_numpy())
+
+
+def reproducible_mask(peaks_a, peaks_b, min_overlap=0.0, reciprocal=False,
+                      max_rank_diff=None, rank_a=None, rank_b=None):
+    """Which of ``peaks_a`` are supported by a peak in ``peaks_b`` (``PEAK_DTYPE``, one ChromVocab).
+
+    ``min_overlap`` is the fraction of the A peak (and of the B peak too when
+    ``reciprocal``) that must be covered.  With ``max_rank_diff`` the best
+    matching B peak must also sit within that many rank fractions of the A
+    peak; ``rank_a`` and ``rank_b`` are the peaks' score rank fractions within
+    their whole replicate.
+    """
+    a_start, a_end = _peak_coords(peaks_a)
+    b_start, b_end = _peak_coords(peaks_b)
+    ia, ib = overlap_pairs(a_start, a_end, b_start, b_end)
+
+    overlap_bp = np.minimum(a_end[ia], b_end[ib]) - np.maximum(a_start[ia], b_start[ib])
+    keep = overlap_bp >= min_overlap * (a_end[ia] - a_start[ia])
+    if reciprocal:
+        keep &= overlap_bp >= min_overlap * (b_end[ib] - b_start[ib])
+    ia, ib, overlap_bp = ia[keep], ib[keep], overlap_bp[keep]
+
+    if max_rank_diff is not None and len(ia):
+        # Match each A peak to the B peak it overlaps most, then compare ranks
+        order = np.lexsort((-overlap_bp, ia))
+        ia, ib = ia[order], ib[order]
+        best = np.r_[True, ia[1:] != ia[:-1]]
+        ia, ib = ia[best], ib[best]
+        ia = ia[np.abs(rank_a[ia] - rank_b[ib]) <= max_rank_diff]
+
+    mask = np.zeros(len(peaks_a), dtype=bool)
+    mask[ia] = True
+    return mask
+
+
+def blacklist_mask(peaks, blacklist):
+    """True for ``peaks`` that do not touch any blacklist interval"""
+    start, end = _peak_coords(peaks)
+    bl_start, bl_end = _peak_coords(blacklist)
+    return ~any_overlap(start, end, bl_start, bl_end)
+
+
+def filter_reproducible_peaks(bed_a, bed_b, output, blacklist=None, min_overlap=0.0, reciprocal=False,
+                              max_rank_diff=None, score_col=4, batch_size=DEFAULT_BATCH_SIZE):
+    """Write the reproducible, blacklist-filtered rows of ``bed_a`` to ``output``; returns their count"""
+    vocab = ChromVocab()
+    peaks_b = read_peak_array(bed_b, vocab=vocab, layout='bed')
+    bl = load_blacklist(blacklist, vocab) if blacklist is not None else None
+    rank_a = rank_b = None
+    if max_rank_diff is not None:
+        rank_a, rank_b = score_ranks(bed_a, score_col), score_ranks(bed_b, score_col)
+
+    lines = _data_lines(bed_a)
+    n_done = n_kept = 0
+    with open(output, 'w') as out:
+        for batch in iter_peak_batches(bed_a, vocab, batch_size, layout='bed'):
+            batch_ranks = rank_a[n_done:n_done + len(batch)] if rank_a is not None else None
+            keep = reproducible_mask(batch, peaks_b, min_overlap, reciprocal,
+                                     max_rank_diff, batch_ranks, rank_b)
+            if bl is not None:
+                keep &= blacklist_mask(batch, bl)
+            out.writelines(line for line, kept in zip(islice(lines, len(batch)), keep) if kept)
+            n_done += len(batch)
+            n_kept += int(keep.sum())
+    return n_kept
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reproducible, blacklist-filtered peaks")
+    parser.add_argument('-a', required=True, help="Replicate 1 peaks (rows kept in output)")
+    parser.add_argument('-b', required=True, help="Replicate 2 peaks")
+    parser.add_argument('--blacklist', help="BED of regions to exclude")
+    parser.add_argument('-f', '--min-overlap', type=float, default=0.0,
+                        help="Minimum overlap as a fraction of the A peak (default: 1 bp)")
+    parser.add_argument('-r', '--reciprocal', action='store_true',
+                        help="Require --min-overlap of the B peak as well")
+    parser.add_argument('--max-rank-diff', type=float,
+                        help="Maximum score-rank difference (0-1) between matched peaks")
+    parser.add_argument('--score-col', type=int, default=5,
+                        help="1-based column holding the peak score (default: 5)")
+    parser.add_argument('-o', '--output', required=True)
+    args = parser.parse_args(argv)
+
+    n_kept = filter_reproducible_peaks(args.a, args.b, args.output, args.blacklist, args.min_overlap,
+                                       args.reciprocal, args.max_rank_diff, args.score_col - 1)
+    print(f"Wrote {n_kept:,} reproducible peaks to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
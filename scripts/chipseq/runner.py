@@ -0,0 +1,278 @@
+"""Run the analysis scripts as one dependency-ordered, parallel pipeline.
+
+Each figure/table script in ``scripts/`` is a stage with declared inputs,
+outputs and upstream stages.  Shared inputs (the HOMER annotation table and
+the RNA-seq fold changes) are loaded once in the parent through
+``chipseq.cache``; stages then run in a process pool whose workers inherit
+those tables when the platform forks.  Independent stages run concurrently,
+and a stage is skipped when its script, inputs and upstream stages are
+unchanged since its last successful run and its outputs still exist.
+
+Each stage is run under ``chipseq.perf.measure``; wall/CPU time, peak RSS
+and bytes read and written per stage go to ``results/logs/stage_metrics.json``
+for ``python -m chipseq.perf report``.
+
+Per-experiment results (``results/peaks/<experiment>/``,
+``results/homer/annotations/<experiment>/``) are read for the experiment
+given with ``--experiment`` (``$CHIPSEQ_EXPERIMENT`` in the scripts), or
+for the only one published when there is a single experiment.
+
+Usage (from the project directory):
+    chipseq-analysis run --all
+    chipseq-analysis run figure_2f s2c_venn --force
+    chipseq-analysis run --all --profile draft
+    chipseq-analysis run --all --experiment RUNX1
+    chipseq-analysis list
+"""
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import runpy
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from chipseq.cache import file_digest, load_homer_annotation, load_rnaseq
+from chipseq.perf import measure, write_stage_metrics
+from chipseq.render import PROFILES, get_profile
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ANNOTATION = 'results/homer/annotations/{experiment}/annotated_peaks.txt'
+REPRODUCIBLE_PEAKS = 'results/peaks/{experiment}/reproducible_peaks.bed'
+RNASEQ = 'results/GSE75070_MCF7_shRUNX1_shNS_RNAseq_log2_foldchange.txt'
+
+
+def experiment_path(template, experiment=None):
+    """``template`` for one experiment: ``experiment``, else ``$CHIPSEQ_EXPERIMENT``, else the
+    only experiment with results; the flat single-experiment path when there are none"""
+    experiment = experiment or os.environ.get('CHIPSEQ_EXPERIMENT')
+    if experiment:
+        return template.format(experiment=experiment)
+    found = sorted(glob.glob(template.format(experiment='*')))
+    if len(found) > 1:
+        names = ', '.join(os.path.basename(os.path.dirname(path)) for path in found)
+        raise ValueError(f"results for several experiments ({names}); choose one with --experiment")
+    return found[0] if found else template.replace('{experiment}/', '')
+
+
+class Stage:
+    """One analysis script with its inputs, outputs and upstream stages"""
+
+    def __init__(self, name, script, inputs=(), outputs=(), depends=()):
+        self.name = name
+        self.script = script
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.depends = list(depends)
+
+    def input_files(self):
+        """Input paths with glob patterns expanded, sorted for a stable key"""
+        files = []
+        for pattern in self.inputs:
+            if '{experiment}' in pattern:
+                pattern = experiment_path(pattern)
+            files.extend(sorted(glob.glob(pattern)) or [pattern])
+        return files
+
+
+STAGES = [
+    Stage('s2a_table', 'AlignmentStatistics.py',
+          inputs=['results/qc/*_qc.json', 'results/flagstat/*_flagstat.txt'],
+          outputs=['results/supp_figure_S2A_table.png']),
+    Stage('s2b_correlation', 'SpearmanCorrelation.py',
+          inputs=['results/correlation_matrix.tab', 'results/correlation_matrix_bootstrap.tsv']),
+    Stage('s2c_venn', 'PeakOverlap.py',
+          inputs=['results/IP_rep1_peaks.bed', 'results/IP_rep2_peaks.bed',
+                  REPRODUCIBLE_PEAKS],
+          outputs=['results/supp_figure_S2C_venn.png']),
+    Stage('peak_statistics', 'PeaksStatistics.py',
+          inputs=[ANNOTATION, RNASEQ]),
+    Stage('figure_2f', 'OverlapChIPvsRNA.py',
+          inputs=[ANNOTATION, RNASEQ, 'results/figure_2F_permutation.tsv'],
+          outputs=['results/figure_2F_accurate.png', 'results/figure_2F_distance_response.tsv']),
+    Stage('enrichment_genes', 'AnnotatePeaksAnalysis.py',
+          inputs=[ANNOTATION, 'refs/gmt/*.gmt'],
+          outputs=['results/genes_for_enrichr.txt']),
+    Stage('enrichment_plot', 'DisplayENRICHRresults.py',
+          inputs=['results/enrichment/*_table.txt'],
+          outputs=['results/enrichment_top_pathways_figure.png'],
+          depends=['enrichment_genes']),
+]
+
+STATE_FILE = os.path.join('results', '.cache', 'runner_state.json')
+LOG_DIR = os.path.join('results', 'logs')
+METRICS_FILE = os.path.join(LOG_DIR, 'stage_metrics.json')
+
+
+class AnalysisContext:
+    """Shared inputs loaded once per run, plus the per-stage run state"""
+
+    def __init__(self, scripts_dir=SCRIPTS_DIR, state_file=STATE_FILE):
+        self.scripts_dir = scripts_dir
+        self.state_file = state_file
+        self.state = {}
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                self.state = json.load(f)
+
+    def preload(self):
+        """Parse/map shared tables in this process so forked stages inherit them"""
+        annotation = experiment_path(ANNOTATION)
+        if os.path.exists(annotation):
+            load_homer_annotation(annotation)
+        if os.path.exists(RNASEQ):
+            load_rnaseq(RNASEQ)
+
+    def stage_key(self, stage, upstream_keys):
+        """Digest of everything that can change a stage's result"""
+        parts = {'script': file_digest(os.path.join(self.scripts_dir, stage.script))}
+        for path in stage.input_files():
+            parts[path] = file_digest(path) if os.path.isfile(path) else 'missing'
+        parts['upstream'] = [upstream_keys[name] for name in stage.depends]
+        # Figures differ between render profiles
+        parts['render'] = get_profile()
+        return json.dumps(parts, sort_keys=True)
+
+    def is_current(self, stage, key):
+        return (self.state.get(stage.name) == key and
+                all(os.path.exists(path) for path in stage.outputs))
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        with open(self.state_file, 'w') as f:
+            json.dump(self.state, f, indent=2)
+
+
+def run_script(scripts_dir, script, log_path, name=None):
+    """Execute one analysis script in this process, logging its output; returns its metrics"""
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    if scripts_dir not in sys.path:
+        sys.path.insert(0, scripts_dir)
+    with open(log_path, 'w') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log), \
+            measure(name or script) as metrics:
+        runpy.run_path(os.path.join(scripts_dir, script), run_name='__main__')
+    metrics['script'] = script
+    return metrics
+
+
+def resolve_stages(names):
+    """Requested stages plus everything upstream of them, in declaration order"""
+    by_name = {stage.name: stage for stage in STAGES}
+    unknown = [name for name in names if name not in by_name]
+    if unknown:
+        raise SystemExit(f"Unknown stage(s): {', '.join(unknown)}")
+    selected = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(by_name[name].depends)
+    return [stage for stage in STAGES if stage.name in selected]
+
+
+def run(stage_names=None, jobs=None, force=False, scripts_dir=SCRIPTS_DIR, profile=None,
+        experiment=None):
+    """Run stages concurrently in dependency order; returns {stage: status}"""
+    if experiment:
+        # Inherited by the worker processes, read through experiment_path
+        os.environ['CHIPSEQ_EXPERIMENT'] = experiment
+    if profile:
+        # Inherited by the worker processes, read by chipseq.render
+        get_profile(profile)
+        os.environ['CHIPSEQ_RENDER_PROFILE'] = profile
+    stages = resolve_stages(stage_names) if stage_names else list(STAGES)
+    context = AnalysisContext(scripts_dir)
+    context.preload()
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    status, keys, running, metrics = {}, {}, {}, []
+    remaining = list(stages)
+    # Fork where available so workers share the preloaded tables
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context(method)) as pool:
+        while remaining or running:
+            for stage in list(remaining):
+                waiting = {s.name for s in remaining} | set(running.values())
+                if any(dep in waiting for dep in stage.depends):
+                    continue
+                remaining.remove(stage)
+                if any(status.get(dep) == 'failed' for dep in stage.depends):
+                    status[stage.name] = 'failed'
+                    print(f"  ✗ {stage.name}: skipped, upstream stage failed")
+                    continue
+                keys[stage.name] = context.stage_key(stage, keys)
+                if not force and context.is_current(stage, keys[stage.name]):
+                    status[stage.name] = 'up to date'
+                    print(f"  - {stage.name}: up to date")
+                    continue
+                log_path = os.path.join(LOG_DIR, f"{stage.name}.log")
+                future = pool.submit(run_script, scripts_dir, stage.script, log_path, stage.name)
+                running[future] = stage.name
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    record = future.result()
+                except BaseException as exc:
+                    status[name] = 'failed'
+                    print(f"  ✗ {name}: {type(exc).__name__}: {exc} (see {LOG_DIR}/{name}.log)")
+                else:
+                    status[name] = 'done'
+                    context.state[name] = keys[name]
+                    metrics.append(record)
+                    print(f"  ✓ {name} ({record['wall_s']:.1f}s, {record['peak_rss'] / 2**20:,.0f} MB peak)")
+    context.save_state()
+    if metrics:
+        write_stage_metrics(metrics, METRICS_FILE)
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='chipseq-analysis',
+                                     description="Regenerate ChIP-seq analysis figures and tables")
+    parser.add_argument('--project-dir', default='.',
+                        help="Directory holding results/ (default: current directory)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Run selected stages and their upstream stages")
+    run_parser.add_argument('stages', nargs='*', help="Stage names (see 'list')")
+    run_parser.add_argument('--all', action='store_true', help="Run every stage")
+    run_parser.add_argument('-j', '--jobs', type=int, help="Parallel stages (default: CPU count)")
+    run_parser.add_argument('--force', action='store_true', help="Rerun stages even if up to date")
+    run_parser.add_argument('--profile', choices=sorted(PROFILES),
+                            help="Figure render profile (default: publication)")
+    run_parser.add_argument('--experiment',
+                            help="Experiment whose peaks and annotation to use "
+                                 "(default: the only one in results/)")
+
+    subparsers.add_parser('list', help="List stages")
+    args = parser.parse_args(argv)
+    os.chdir(args.project_dir)
+
+    if args.command == 'list':
+        for stage in STAGES:
+            after = f" (after {', '.join(stage.depends)})" if stage.depends else ''
+            print(f"{stage.name:18s} {stage.script}{after}")
+        return
+
+    if not args.all and not args.stages:
+        parser.error("give stage names or --all")
+    try:
+        experiment_path(ANNOTATION, args.experiment)
+    except ValueError as err:
+        parser.error(str(err))
+    status = run(None if args.all else args.stages, args.jobs, args.force, profile=args.profile,
+                 experiment=args.experiment)
+    if 'failed' in status.values():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
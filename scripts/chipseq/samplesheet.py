@@ -0,0 +1,146 @@
+"""Samplesheet validation for multi-experiment runs.
+
+One row per sequenced library:
+
+* ``sample``: unique id, used in every output file name
+* ``fastq``: reads, absolute or relative to the samplesheet
+* ``experiment``: IP group whose replicates are merged into one consensus
+  peak set (blank for controls)
+* ``antibody``: target of the IP; blank or ``input`` marks a control
+* ``replicate``: replicate number within the experiment
+* ``control``: sample id of the INPUT the IP is called against.  Several IPs,
+  also of different experiments, may name the same INPUT; it is then
+  trimmed, aligned and tag-dir'd once and reused.
+
+Every problem in the sheet is reported at once.  The validated sheet adds a
+``type`` column (IP or INPUT) and absolute fastq paths; the workflow reads
+that instead of parsing sample names.  Two-column ``name,path`` sheets
+(``IP_rep1``, ``INPUT_rep1``, ...) are converted: ``IP_repN`` becomes
+replicate N of experiment ``IP`` with control ``INPUT_repN``.
+
+Usage:
+    python -m chipseq.samplesheet samplesheet.csv -o samplesheet.valid.csv
+"""
+import argparse
+import os
+import re
+
+import pandas as pd
+
+COLUMNS = ['sample', 'fastq', 'experiment', 'antibody', 'replicate', 'control']
+VALID_COLUMNS = ['sample', 'type', 'experiment', 'antibody', 'replicate', 'control', 'fastq']
+LEGACY_COLUMNS = ['name', 'path']
+CONTROL_ANTIBODIES = {'', 'input', 'igg', 'none'}
+SAFE_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]*$')
+
+
+def from_legacy(sheet):
+    """``name,path`` rows named <IP|INPUT>_rep<N>[_subset] in the current schema"""
+    rows = []
+    for name, path in zip(sheet['name'], sheet['path']):
+        name = re.sub(r'_subset$', '', name)
+        condition, _, replicate = name.partition('_')
+        replicate = re.sub(r'^rep', '', replicate)
+        is_ip = condition.upper() != 'INPUT'
+        rows.append({
+            'sample': name,
+            'fastq': path,
+            'experiment': condition if is_ip else '',
+            'antibody': condition if is_ip else 'input',
+            'replicate': replicate,
+            'control': f"INPUT_rep{replicate}" if is_ip else '',
+        })
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def validate(sheet, base_dir='.', check_files=False):
+    """Validated sheet in ``VALID_COLUMNS`` order; raises ValueError listing every problem"""
+    if set(LEGACY_COLUMNS) <= set(sheet.columns) and 'sample' not in sheet.columns:
+        sheet = from_legacy(sheet)
+    missing = [c for c in COLUMNS if c not in sheet.columns]
+    if missing:
+        raise ValueError(f"samplesheet needs column(s) {', '.join(missing)}")
+    sheet = sheet[COLUMNS].fillna('').astype(str).apply(lambda col: col.str.strip())
+
+    errors = []
+    for row, sample in enumerate(sheet['sample'], start=2):
+        if not SAFE_NAME.match(sample):
+            errors.append(f"line {row}: sample {sample!r} must be letters, digits, '_', '.' or '-'")
+    for sample in sheet['sample'][sheet['sample'].duplicated()].unique():
+        errors.append(f"sample {sample!r} appears more than once")
+
+    is_control = sheet['antibody'].str.lower().isin(CONTROL_ANTIBODIES) & (sheet['control'] == '')
+    controls = set(sheet['sample'][is_control])
+    for row, rec in zip(range(2, len(sheet) + 2), sheet.itertuples(index=False)):
+        where = f"line {row} ({rec.sample})"
+        if not rec.fastq:
+            errors.append(f"{where}: fastq is empty")
+        elif check_files and not os.path.exists(os.path.join(base_dir, rec.fastq)):
+            errors.append(f"{where}: {rec.fastq} does not exist")
+        if not rec.replicate.isdigit() or int(rec.replicate) < 1:
+            errors.append(f"{where}: replicate {rec.replicate!r} is not a positive integer")
+        if rec.sample in controls:
+            continue
+        if not rec.experiment:
+            errors.append(f"{where}: IP sample needs an experiment")
+        elif not SAFE_NAME.match(rec.experiment):
+            errors.append(f"{where}: experiment {rec.experiment!r} must be letters, digits, '_', '.' or '-'")
+        if not rec.control:
+            errors.append(f"{where}: IP sample needs a control")
+        elif rec.control not in controls:
+            kind = 'an IP sample' if rec.control in set(sheet['sample']) else 'not in the samplesheet'
+            errors.append(f"{where}: control {rec.control!r} is {kind}")
+
+    ips = sheet[~is_control]
+    for (experiment, replicate), group in ips.groupby(['experiment', 'replicate']):
+        if len(group) > 1:
+            errors.append(f"experiment {experiment!r} has replicate {replicate} more than once: "
+                          + ', '.join(group['sample']))
+    for experiment, group in ips.groupby('experiment'):
+        if experiment and group['antibody'].nunique() > 1:
+            errors.append(f"experiment {experiment!r} mixes antibodies: "
+                          + ', '.join(sorted(group['antibody'].unique())))
+    unused = controls - set(sheet['control'])
+    if errors:
+        raise ValueError('\n'.join(errors))
+    if unused:
+        print(f"Warning: control(s) not referenced by any IP: {', '.join(sorted(unused))}")
+
+    valid = sheet.copy()
+    valid['type'] = ['INPUT' if c else 'IP' for c in is_control]
+    valid['replicate'] = valid['replicate'].astype(int)
+    valid['fastq'] = [os.path.abspath(os.path.join(base_dir, path)) for path in valid['fastq']]
+    return valid[VALID_COLUMNS]
+
+
+def read_samplesheet(filepath, base_dir=None, check_files=False):
+    """Validated CSV/TSV samplesheet; relative fastq paths resolve against ``base_dir``
+    (default: the samplesheet's directory)"""
+    sep = '\t' if filepath.endswith(('.tsv', '.txt')) else ','
+    sheet = pd.read_csv(filepath, sep=sep, dtype=str, keep_default_na=False)
+    return validate(sheet, base_dir or os.path.dirname(os.path.abspath(filepath)), check_files)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate a multi-experiment ChIP-seq samplesheet")
+    parser.add_argument('samplesheet')
+    parser.add_argument('--base-dir', help="Resolve relative fastq paths against this directory "
+                                           "(default: the samplesheet's directory)")
+    parser.add_argument('--check-files', action='store_true', help="Also require every fastq to exist")
+    parser.add_argument('-o', '--output', help="Write the validated sheet here")
+    args = parser.parse_args(argv)
+
+    try:
+        valid = read_samplesheet(args.samplesheet, args.base_dir, args.check_files)
+    except ValueError as err:
+        parser.exit(1, f"{args.samplesheet}:\n{err}\n")
+
+    if args.output:
+        valid.to_csv(args.output, index=False)
+    n_ip = (valid['type'] == 'IP').sum()
+    print(f"{len(valid)} samples: {n_ip} IP in {valid['experiment'][valid['type'] == 'IP'].nunique()} "
+          f"experiment(s), {len(valid) - n_ip} INPUT")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from chipseq.correlation import BinMatrix, compute, main
+
+LABELS = ['IP_rep1', 'IP_rep2', 'INPUT_rep1']
+
+
+@pytest.fixture
+def summary(tmp_path):
+    """multiBigwigSummary output: an npz with only matrix and labels, plus its raw counts table"""
+    rng = np.random.default_rng(5)
+    signal = rng.gamma(2.0, 1.0, 400)
+    matrix = np.column_stack([signal + rng.normal(0, 0.3, 400), signal + rng.normal(0, 0.3, 400),
+                              rng.gamma(2.0, 1.0, 400)])
+    matrix[:20] = 0
+    npz = tmp_path / 'multibw_summary.npz'
+    np.savez_compressed(npz, matrix=matrix, labels=np.array(LABELS))
+    counts = tmp_path / 'multibw_summary.tab'
+    with open(counts, 'w') as f:
+        f.write("#'chr'\t'start'\t'end'\t" + '\t'.join(f"'{label}'" for label in LABELS) + '\n')
+        for i, row in enumerate(matrix):
+            chrom, start = ('chr1', i * 1000) if i < 200 else ('chr2', (i - 200) * 1000)
+            f.write(f"{chrom}\t{start}\t{start + 1000}\t" + '\t'.join(map(str, row)) + '\n')
+    blacklist = tmp_path / 'blacklist.bed'
+    blacklist.write_text('chr2\t0\t50000\n')
+    return matrix, str(npz), str(counts), str(blacklist), str(tmp_path / 'cache')
+
+
+def test_npz_without_regions(summary):
+    matrix, npz, _, blacklist, cache = summary
+    bins = BinMatrix.from_npz(npz, cache_dir=cache)
+    assert bins.labels == LABELS
+    assert bins.chroms is None
+    np.testing.assert_allclose(bins.values, matrix.astype(np.float32))
+
+    corr, _, n_used = compute(bins, 'pearson', skip_zeros=True)
+    assert n_used == len(matrix) - 20
+    np.testing.assert_allclose(corr.to_numpy(), np.corrcoef(matrix[20:].T), atol=1e-5)
+    with pytest.raises(ValueError, match='--regions'):
+        compute(bins, 'pearson', blacklist=blacklist)
+
+
+def test_npz_with_raw_counts_regions(summary):
+    matrix, npz, counts, blacklist, cache = summary
+    bins = BinMatrix.from_npz(npz, counts, cache_dir=cache)
+    assert list(bins.chroms[[0, 200]]) == ['chr1', 'chr2']
+    _, _, n_used = compute(bins, 'spearman', skip_zeros=True, blacklist=blacklist)
+    assert n_used == len(matrix) - 20 - 50
+
+
+def test_cli_blacklist_needs_regions(summary, tmp_path):
+    _, npz, _, blacklist, _ = summary
+    with pytest.raises(SystemExit):
+        main(['--npz', npz, '--blacklist', blacklist, '-o', str(tmp_path / 'corr.tab')])
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+pytest.importorskip('pysam')
+from chipseq.peak_caller import fdr_threshold, poisson_sf, scan_chromosome  # noqa: E402
+
+CHROM = 'chr1'
+SITES = [20_000, 55_000, 90_000]
+
+
+def write_tags(tags_dir, plus, minus):
+    """Tag directory in the layout build_tags writes, from raw 5' end positions"""
+    tags_dir.mkdir()
+    for strand, positions in (('plus', plus), ('minus', minus)):
+        distinct, counts = np.unique(positions, return_counts=True)
+        np.save(tags_dir / f"{CHROM}.{strand}.npy", distinct.astype(np.int32))
+        np.save(tags_dir / f"{CHROM}.{strand}.counts.npy", counts.astype(np.uint16))
+    return str(tags_dir)
+
+
+def simulate(rng, length=120_000, background=600, per_site=80, fragment=200):
+    """Uniform background plus, at each site, reads on both strands a half fragment away"""
+    plus = [rng.integers(0, length, background)]
+    minus = [rng.integers(0, length, background)]
+    for site in SITES:
+        plus.append(site - fragment // 2 + rng.integers(-30, 31, per_site))
+        minus.append(site + fragment // 2 + rng.integers(-30, 31, per_site))
+    return np.concatenate(plus), np.concatenate(minus)
+
+
+def test_poisson_sf_matches_scipy():
+    rng = np.random.default_rng(1)
+    lam = rng.uniform(0.1, 50, 200)
+    k = rng.integers(1, 80, 200)
+    np.testing.assert_allclose(poisson_sf(k, lam), stats.poisson.sf(k - 1, lam), rtol=1e-9, atol=1e-300)
+    assert np.all(poisson_sf([0, -3], 2.0) == 1.0)
+
+
+def test_fdr_threshold_is_smallest_count_meeting_fdr():
+    rng = np.random.default_rng(2)
+    expected, n_windows, fdr = 1.5, 200_000, 0.01
+    tags = np.r_[rng.poisson(expected, 5000), rng.integers(15, 40, 300)]
+    threshold = fdr_threshold(tags, expected, n_windows, fdr)
+
+    def meets(k):
+        observed = (tags >= k).sum()
+        return observed > 0 and n_windows * stats.poisson.sf(k - 1, expected) <= fdr * observed
+
+    assert meets(threshold)
+    assert not any(meets(k) for k in range(1, threshold))
+    # Nothing can pass: the threshold is past the largest count
+    assert fdr_threshold(np.array([1, 2, 3]), 5.0, 1e9, 1e-6) == 4
+
+
+def test_scan_chromosome_finds_sites(tmp_path):
+    rng = np.random.default_rng(3)
+    ip = write_tags(tmp_path / 'ip.tags', *simulate(rng))
+    control_plus = rng.integers(0, 120_000, 800)
+    control = write_tags(tmp_path / 'input.tags', control_plus, rng.integers(0, 120_000, 800))
+    size, shift, local_size = 300, 100, 10_000
+
+    result = scan_chromosome(ip, control, CHROM, size, shift, 2 * size, local_size, min_tags=20)
+    assert result is not None
+    centers = result['center']
+    assert len(centers) == len(SITES)
+    assert np.all(np.abs(centers - np.array(SITES)) <= size // 2)
+
+    # Window counts against a direct count over the distinct, shifted 5' ends
+    plus, minus = simulate(np.random.default_rng(3))
+    shifted = np.r_[np.unique(plus) + shift, np.unique(minus) - shift]
+    for center, tags in zip(centers, result['tags']):
+        lo = center - size // 2
+        assert tags == ((shifted >= lo) & (shifted < lo + size)).sum()
+    assert np.all(result['focus'] > 0.5)
+    assert np.all(result['control_tags'] < result['tags'])
+    assert np.all(result['local_tags'] >= result['tags'])
+
+
+def test_scan_chromosome_without_candidates(tmp_path):
+    rng = np.random.default_rng(4)
+    ip = write_tags(tmp_path / 'ip.tags', rng.integers(0, 1_000_000, 50), rng.integers(0, 1_000_000, 50))
+    assert scan_chromosome(ip, None, CHROM, 300, 100, 600, 10_000, min_tags=5) is None
@@ -0,0 +1,33 @@
+import numpy as np
+
+from chipseq.permutation import build_null_model, permutation_test
+
+
+def write_inputs(tmp_path):
+    rng = np.random.default_rng(6)
+    genes = [f"G{i}" for i in range(300)]
+    with open(tmp_path / 'peaks.bed', 'w') as f:
+        for i in range(200):
+            start = int(rng.integers(0, 990_000))
+            f.write(f"chr1\t{start}\t{start + 300}\tpeak{i}\t1\t+\n")
+    with open(tmp_path / 'genes.bed', 'w') as f:
+        for i, gene in enumerate(genes):
+            start = int(rng.integers(0, 990_000))
+            f.write(f"chr1\t{start}\t{start + 2000}\t{gene}\t0\t{'+-'[i % 2]}\n")
+    with open(tmp_path / 'rnaseq.tsv', 'w') as f:
+        f.write('genename\tlog2FoldChange\tpadj\n')
+        for gene in genes:
+            f.write(f"{gene}\t{rng.normal(0, 2):.3f}\t{rng.uniform(0, 0.02):.4f}\n")
+    (tmp_path / 'chrom.sizes').write_text('chr1\t1000000\n')
+    (tmp_path / 'blacklist.bed').write_text('chr1\t500000\t510000\n')
+    return [str(tmp_path / name) for name in
+            ('peaks.bed', 'rnaseq.tsv', 'genes.bed', 'chrom.sizes', 'blacklist.bed')]
+
+
+def test_result_does_not_depend_on_workers(tmp_path):
+    model, observed = build_null_model(*write_inputs(tmp_path))
+    results = [permutation_test(model, observed, n_permutations=1000, batch_size=50,
+                                workers=workers, seed=1, min_extreme=5)
+               for workers in (1, 4)]
+    assert results[0]['permutations'].iloc[0] < 1000
+    assert results[0].equals(results[1])
@@ -2,54 +2,84 @@
 nextflow.enable.dsl=2
 
 // Import modules
+include { SAMPLESHEET_CHECK } from './modules/samplesheet_check/main.nf'
 include { FASTQC as FASTQC_RAW } from './modules/fastqc/main.nf'
 include { TRIMMOMATIC } from './modules/trimmomatic/main.nf'
 include { FASTQC as FASTQC_TRIMMED } from './modules/fastqc/main.nf'
+include { REFERENCE_DIGEST } from './modules/reference_digest/main.nf'
 include { BOWTIE2_BUILD } from './modules/bowtie2_build/main.nf'
 include { BOWTIE2_ALIGN } from './modules/bowtie2_align/main.nf'
+include { FASTQ_SPLIT } from './modules/fastq_split/main.nf'
+include { BOWTIE2_ALIGN_CHUNK } from './modules/bowtie2_align_chunk/main.nf'
 include { SAMTOOLS_SORT } from './modules/samtools_sort/main.nf'
 include { SAMTOOLS_INDEX } from './modules/samtools_index/main.nf'
-include { SAMTOOLS_FLAGSTAT } from './modules/samtools_flagstat/main.nf'
+include { SAMTOOLS_MERGE } from './modules/samtools_merge/main.nf'
+include { CHIP_QC } from './modules/chip_qc/main.nf'
 include { DEEPTOOLS_BAMCOVERAGE } from './modules/deeptools_bamcoverage/main.nf'
+include { COVERAGE_TRACKS } from './modules/coverage_tracks/main.nf'
 include { MULTIQC } from './modules/multiqc/main.nf'
 
 include { DEEPTOOLS_MULTIBWSUMMARY } from './modules/deeptools_multibwsummary/main.nf'
 include { DEEPTOOLS_PLOTCORRELATION } from './modules/deeptools_plotcorrelation/main.nf'
+include { BIN_CORRELATION } from './modules/bin_correlation/main.nf'
 include { HOMER_MAKETAGDIR } from './modules/homer_maketagdir/main.nf'
 include { HOMER_FINDPEAKS } from './modules/homer_findpeaks/main.nf'
+include { PEAK_TAGS } from './modules/peak_tags/main.nf'
+include { CALL_PEAKS } from './modules/call_peaks/main.nf'
 include { HOMER_POS2BED } from './modules/homer_pos2bed/main.nf'
 include { BEDTOOLS_INTERSECT } from './modules/bedtools_intersect/main.nf'
 include { BEDTOOLS_REMOVE } from './modules/bedtools_remove/main.nf'
+include { REPRODUCIBLE_PEAKS } from './modules/reproducible_peaks/main.nf'
+include { CONSENSUS_PEAKS } from './modules/consensus_peaks/main.nf'
+include { DIFF_BINDING } from './modules/diff_binding/main.nf'
 include { HOMER_ANNOTATEPEAKS } from './modules/homer_annotatepeaks/main.nf'
+include { ANNOTATE_PEAKS } from './modules/annotate_peaks/main.nf'
 
 include { DEEPTOOLS_COMPUTEMATRIX } from './modules/deeptools_computematrix/main.nf'
 include { DEEPTOOLS_PLOTPROFILE } from './modules/deeptools_plotprofile/main.nf'
+include { SIGNAL_PROFILE } from './modules/signal_profile/main.nf'
 include { HOMER_FINDMOTIFSGENOME } from './modules/homer_findmotifsgenome/main.nf'
+include { MOTIF_SCAN } from './modules/motif_scan/main.nf'
+
+if (params.motif_engine == 'native' && !params.known_motifs) {
+    error "--motif_engine native needs --known_motifs, a HOMER motif file (e.g. HOMER's data/knownTFs/vertebrates/known.motifs)"
+}
 
 workflow {
-    // Create input channel from samplesheet
-    // Both subsampled and full datasets are single-end
-    // Parse sample name to extract condition and replicate info
-    Channel
-        .fromPath(params.samplesheet)
+    // Validate the samplesheet (sample, fastq, experiment, antibody, replicate,
+    // control) and read one row per library. An INPUT shared by several IPs is
+    // one row, so it is trimmed, aligned and tag-dir'd once and reused
+    SAMPLESHEET_CHECK(Channel.fromPath(params.samplesheet), file(params.samplesheet).parent.toString())
+    SAMPLESHEET_CHECK.out.csv
         .splitCsv(header: true)
-        .map { row -> 
-            def sample_name = row.name
-            // Remove _subset suffix if present
-            def clean_name = sample_name.replaceAll('_subset$', '')
-            def parts = clean_name.tokenize('_')
-            def condition = parts[0]  // IP or INPUT
-            def replicate = parts[1]  // rep1 or rep2
-            
-            tuple(
-                clean_name,
-                condition,
-                replicate,
-                file(row.path)
-            )
-        }
+        .set { samples }
+
+    samples
+        .map { row -> tuple(row.sample, row.type, row.replicate, file(row.fastq)) }
         .set { reads_ch }
 
+    // IP sample -> experiment and control sample
+    samples
+        .filter { row -> row.type == 'IP' }
+        .map { row -> tuple(row.sample, row.experiment, row.control) }
+        .set { ip_design }
+
+    // Replicates per experiment, so each experiment's peaks move on as soon as they are called
+    ip_design
+        .map { ip_sample, experiment, control -> tuple(experiment, ip_sample) }
+        .groupTuple()
+        .map { experiment, ip_samples -> tuple(experiment, ip_samples.size()) }
+        .set { experiment_sizes }
+
+    samples
+        .filter { row -> row.type == 'IP' }
+        .map { row -> row.sample }
+        .collect()
+        .map { ids -> [ids] }
+        .set { ip_ids }
+
+    blacklist = Channel.value(file(params.blacklist))
+
     // ========== WEEK 1: QC, Alignment, and Coverage ==========
 
     // 1. FastQC on raw reads
@@ -61,146 +91,319 @@ workflow {
     // 3. FastQC on trimmed reads
     FASTQC_TRIMMED(TRIMMOMATIC.out.trimmed_reads)
 
-    // 4. Build Bowtie2 index (run once for reference genome)
-    genome_fasta = Channel.fromPath(params.genome)
-    BOWTIE2_BUILD(genome_fasta)
+    // 4. Bowtie2 index: a prebuilt --bowtie2_index, or built once per genome
+    //    content hash in the reference asset store
+    if (params.bowtie2_index) {
+        Channel.fromPath(params.bowtie2_index, type: 'dir').set { bowtie2_index }
+    } else {
+        REFERENCE_DIGEST(Channel.fromPath(params.genome))
+        BOWTIE2_BUILD(REFERENCE_DIGEST.out.digest)
+        BOWTIE2_BUILD.out.index.set { bowtie2_index }
+    }
+
+    if (params.align_scatter) {
+        // 5-7. Scatter-gather: split trimmed reads into chunks, align and sort
+        //      each chunk in one pipe, then k-way merge and index per sample
+        FASTQ_SPLIT(TRIMMOMATIC.out.trimmed_reads)
+
+        FASTQ_SPLIT.out.chunks
+            .map { sample_id, condition, replicate, chunks ->
+                tuple(sample_id, chunks instanceof List ? chunks.size() : 1)
+            }
+            .set { chunk_counts }
+
+        FASTQ_SPLIT.out.chunks
+            .transpose()
+            .combine(bowtie2_index)
+            .set { chunks_with_index }
+
+        BOWTIE2_ALIGN_CHUNK(chunks_with_index)
+
+        // Release each sample to the merge as soon as all of its chunks are aligned
+        BOWTIE2_ALIGN_CHUNK.out.bam
+            .combine(chunk_counts, by: 0)
+            .map { sample_id, condition, replicate, bam, n_chunks ->
+                tuple(groupKey(sample_id, n_chunks), condition, replicate, bam)
+            }
+            .groupTuple()
+            .map { sample_id, conditions, replicates, bams ->
+                tuple(sample_id.toString(), conditions[0], replicates[0], bams)
+            }
+            .set { chunk_bams }
+
+        SAMTOOLS_MERGE(chunk_bams)
+        SAMTOOLS_MERGE.out.sorted_bam.set { sorted_bams }
+        SAMTOOLS_MERGE.out.bam_index.set { bam_indexes }
+    } else {
+        // 5. Align trimmed reads to reference genome
+        // Combine trimmed reads with bowtie2 index
+        TRIMMOMATIC.out.trimmed_reads
+            .combine(bowtie2_index)
+            .set { reads_with_index }
+        
+        BOWTIE2_ALIGN(reads_with_index)
+
+        // 6. Sort BAM files
+        SAMTOOLS_SORT(BOWTIE2_ALIGN.out.bam)
+
+        // 7. Index sorted BAM files
+        SAMTOOLS_INDEX(SAMTOOLS_SORT.out.sorted_bam)
+        SAMTOOLS_SORT.out.sorted_bam.set { sorted_bams }
+        SAMTOOLS_INDEX.out.bam_index.set { bam_indexes }
+    }
+
+    // 8. Generate bigWig coverage tracks
+    sorted_bams
+        .join(bam_indexes.map { sample_id, condition, replicate, bai ->
+            tuple(sample_id, bai)
+        })
+        .set { indexed_bams }
+
+    // Each IP with its experiment and the BAM of the control it names; combine
+    // rather than join so one INPUT pairs with every IP that references it
+    indexed_bams
+        .map { sample_id, condition, replicate, bam, bai -> tuple(sample_id, bam, bai) }
+        .set { bams_by_sample }
+
+    ip_design
+        .join(bams_by_sample)
+        .map { ip_id, experiment, control, bam, bai -> tuple(control, experiment, ip_id, bam, bai) }
+        .combine(bams_by_sample, by: 0)
+        .map { input_id, experiment, ip_id, ip_bam, ip_bai, input_bam, input_bai ->
+            tuple(experiment, ip_id, ip_bam, ip_bai, input_id, input_bam, input_bai)
+        }
+        .set { paired_bams }
+
+    if (params.coverage_engine == 'deeptools') {
+        indexed_bams
+            .map { sample_id, condition, replicate, bam, bai ->
+                tuple(sample_id, bam, bai)
+            }
+            .set { bam_with_index }
+
+        DEEPTOOLS_BAMCOVERAGE(bam_with_index)
+        DEEPTOOLS_BAMCOVERAGE.out.bigwig.set { bigwigs }
+        bigwigs.set { signal_tracks }
+    } else {
+        // Normalized IP and INPUT tracks plus log2(IP/INPUT) per IP, one task per
+        // INPUT with all of the IPs it controls
+        paired_bams
+            .map { experiment, ip_id, ip_bam, ip_bai, input_id, input_bam, input_bai ->
+                tuple(input_id, input_bam, input_bai, ip_id, ip_bam, ip_bai)
+            }
+            .groupTuple(by: [0, 1, 2])
+            .set { bams_by_control }
+
+        COVERAGE_TRACKS(bams_by_control)
+        COVERAGE_TRACKS.out.bigwig
+            .flatten()
+            .filter { bw -> !bw.name.endsWith('.log2ratio.bw') }
+            .set { bigwigs }
+        // Correlation and profiles read the int32 bin arrays, not the bigWigs
+        COVERAGE_TRACKS.out.bins.flatten().set { signal_tracks }
+    }
 
-    // 5. Align trimmed reads to reference genome
-    // Combine trimmed reads with bowtie2 index
-    TRIMMOMATIC.out.trimmed_reads
-        .combine(BOWTIE2_BUILD.out.index)
-        .set { reads_with_index }
+    // ========== WEEK 2: Peak Calling and Annotation ==========
     
-    BOWTIE2_ALIGN(reads_with_index)
-
-    // 6. Sort BAM files
-    SAMTOOLS_SORT(BOWTIE2_ALIGN.out.bam)
-
-    // 7. Index sorted BAM files
-    SAMTOOLS_INDEX(SAMTOOLS_SORT.out.sorted_bam)
+    // 12-13. Correlation between samples: native engine over coverage bins or
+    //        multiBigwigSummary bins, or plotCorrelation with --correlation_engine deeptools
+    if (params.correlation_engine == 'deeptools' || params.coverage_engine == 'deeptools') {
+        bigwigs
+            .collect()
+            .set { all_bigwigs }
+
+        DEEPTOOLS_MULTIBWSUMMARY(all_bigwigs)
+
+        if (params.correlation_engine == 'deeptools') {
+            DEEPTOOLS_PLOTCORRELATION(DEEPTOOLS_MULTIBWSUMMARY.out.matrix)
+        } else {
+            BIN_CORRELATION(DEEPTOOLS_MULTIBWSUMMARY.out.matrix.concat(DEEPTOOLS_MULTIBWSUMMARY.out.counts).collect(),
+                            blacklist)
+        }
+    } else {
+        BIN_CORRELATION(signal_tracks.collect(), blacklist)
+    }
+
+    if (params.peak_caller == 'homer') {
+        // 14. HOMER makeTagDirectory for all samples
+        HOMER_MAKETAGDIR(sorted_bams)
+
+        // 15. Pair each IP tag directory with its control's
+        HOMER_MAKETAGDIR.out.tagdir
+            .map { sample_id, condition, replicate, tagdir -> tuple(sample_id, tagdir) }
+            .set { tagdirs }
+
+        ip_design
+            .join(tagdirs)
+            .map { ip_sample, experiment, control, ip_tagdir -> tuple(control, ip_sample, experiment, ip_tagdir) }
+            .combine(tagdirs, by: 0)
+            .map { control, ip_sample, experiment, ip_tagdir, input_tagdir ->
+                tuple(ip_sample, experiment, ip_tagdir, input_tagdir)
+            }
+            .set { paired_tagdirs }
+
+        // 16. HOMER findPeaks - call peaks for each IP against its control
+        HOMER_FINDPEAKS(paired_tagdirs)
+        HOMER_FINDPEAKS.out.peaks.set { called_peaks }
+    } else {
+        // 14. Tag arrays once per sample, so a shared INPUT is read once
+        PEAK_TAGS(bams_by_sample)
+        PEAK_TAGS.out.tags.set { sample_tags }
+
+        // 15. Pair each IP's tags with its control's
+        ip_design
+            .join(sample_tags)
+            .map { ip_id, experiment, control, ip_tags -> tuple(control, experiment, ip_id, ip_tags) }
+            .combine(sample_tags, by: 0)
+            .map { input_id, experiment, ip_id, ip_tags, input_tags ->
+                tuple(experiment, ip_id, ip_tags, input_id, input_tags)
+            }
+            .set { paired_tags }
+
+        // 16. Native factor-style caller, one process per chromosome, writing
+        //     HOMER peak text
+        CALL_PEAKS(paired_tags)
+        CALL_PEAKS.out.peaks.set { called_peaks }
+    }
 
-    // 8. Calculate alignment statistics with flagstat
-    SAMTOOLS_FLAGSTAT(SAMTOOLS_SORT.out.sorted_bam)
+    // 17. Convert peaks to BED format
+    HOMER_POS2BED(called_peaks)
 
-    // 9. Generate bigWig coverage tracks
-    SAMTOOLS_SORT.out.sorted_bam
-        .map { sample_id, condition, replicate, bam ->
-            tuple(sample_id, bam)
-        }
-        .join(SAMTOOLS_INDEX.out.bam_index.map { sample_id, condition, replicate, bai ->
-            tuple(sample_id, bai)
-        })
-        .map { sample_id, bam, bai ->
-            tuple(sample_id, bam, bai)
+    // 18. Get reproducible peaks per experiment: N-way consensus with k-of-n
+    //     support (default), or the two-replicate native/bedtools intersect with
+    //     --peak_filter. Replicates are sorted by name so the result does not
+    //     depend on task order
+    HOMER_POS2BED.out.bed
+        .combine(experiment_sizes, by: 0)
+        .map { experiment, bed, n_reps -> tuple(groupKey(experiment, n_reps), bed) }
+        .groupTuple()
+        .map { experiment, beds -> tuple(experiment.toString(), beds.sort { it.name }) }
+        .set { experiment_peak_beds }
+
+    if (params.peak_filter == 'consensus') {
+        CONSENSUS_PEAKS(experiment_peak_beds, blacklist)
+        CONSENSUS_PEAKS.out.filtered_peaks.set { filtered_peaks }
+    } else {
+        experiment_peak_beds
+            .map { experiment, beds ->
+                if (beds.size() != 2) {
+                    error "--peak_filter ${params.peak_filter} needs exactly 2 replicates, experiment ${experiment} has ${beds.size()}; use --peak_filter consensus"
+                }
+                tuple(experiment, beds[0], beds[1])
+            }
+            .set { peak_pairs }
+
+        if (params.peak_filter == 'bedtools') {
+            BEDTOOLS_INTERSECT(peak_pairs)
+
+            // 19. Remove blacklist regions from peaks
+            BEDTOOLS_REMOVE(BEDTOOLS_INTERSECT.out.reproducible_peaks, blacklist)
+            BEDTOOLS_REMOVE.out.filtered_peaks.set { filtered_peaks }
+        } else {
+            // 18-19. Intersect, dedupe and blacklist-filter in one native step
+            REPRODUCIBLE_PEAKS(peak_pairs, blacklist)
+            REPRODUCIBLE_PEAKS.out.filtered_peaks.set { filtered_peaks }
         }
-        .set { bam_with_index }
+    }
+
+    // 20. Annotate each experiment's filtered peaks to nearest genomic features
+    //     (native nearest-TSS index, or annotatePeaks.pl with --annotation_engine homer)
+    gtf_annot = Channel.value(file(params.gtf))
+    if (params.annotation_engine == 'homer') {
+        HOMER_ANNOTATEPEAKS(filtered_peaks, Channel.value(file(params.genome)), gtf_annot)
+    } else {
+        ANNOTATE_PEAKS(filtered_peaks, gtf_annot)
+    }
+
+    // 9. Single-pass alignment QC: flagstat counts, duplication, NRF/PBC,
+    //    FRiP and strand cross-correlation. IPs are scored against their
+    //    experiment's peaks, an INPUT against the peaks of every experiment it controls
+    ip_design
+        .map { ip_sample, experiment, control -> tuple(experiment, ip_sample, control) }
+        .combine(filtered_peaks, by: 0)
+        .set { ip_peaks }
+
+    ip_peaks
+        .map { experiment, ip_sample, control, peaks -> tuple(control, experiment, peaks) }
+        .unique()
+        .collectFile { control, experiment, peaks -> ["${control}_peaks.bed", peaks.text] }
+        .map { peaks -> tuple(peaks.name - ~/_peaks\.bed$/, peaks) }
+        .set { control_peaks }
+
+    ip_peaks
+        .map { experiment, ip_sample, control, peaks -> tuple(ip_sample, peaks) }
+        .mix(control_peaks)
+        .set { qc_peaks }
+
+    CHIP_QC(sorted_bams.join(qc_peaks))
+
+    // Differential binding between conditions: reads of every sorted BAM counted
+    // into the filtered (consensus) peaks of all experiments, voom-style
+    // moderated t-tests per peak
+    if (params.diffbind_design) {
+        DIFF_BINDING(
+            sorted_bams.map { sample_id, condition, replicate, bam -> bam }.collect(),
+            filtered_peaks.map { experiment, peaks -> peaks }.collect(),
+            Channel.fromPath(params.diffbind_design)
+        )
+    }
 
-    DEEPTOOLS_BAMCOVERAGE(bam_with_index)
-    
     // 10. Collect all QC outputs for MultiQC
     FASTQC_RAW.out.fastqc_zip
         .mix(FASTQC_TRIMMED.out.fastqc_zip)
         .mix(TRIMMOMATIC.out.log)
-        .mix(SAMTOOLS_FLAGSTAT.out.flagstat)
+        .mix(CHIP_QC.out.mqc)
         .collect()
         .set { multiqc_input }
 
     // 11. Run MultiQC to aggregate all QC metrics
     MULTIQC(multiqc_input)
 
-    // ========== WEEK 2: Peak Calling and Annotation ==========
-    
-    // 12. Correlation analysis of bigWigs
-    DEEPTOOLS_BAMCOVERAGE.out.bigwig
-        .collect()
-        .set { all_bigwigs }
-    
-    DEEPTOOLS_MULTIBWSUMMARY(all_bigwigs)
-    
-    // 13. Plot correlation between samples
-    DEEPTOOLS_PLOTCORRELATION(DEEPTOOLS_MULTIBWSUMMARY.out.matrix)
-
-    // 14. HOMER makeTagDirectory for all samples
-    HOMER_MAKETAGDIR(SAMTOOLS_SORT.out.sorted_bam)
-
-    // 15. Pair IP and INPUT samples for peak calling
-    HOMER_MAKETAGDIR.out.tagdir
-        .branch {
-            ip: it[1] == 'IP'
-            input: it[1] == 'INPUT'
-        }
-        .set { tagdirs_branched }
-
-    tagdirs_branched.ip
-        .map { sample_id, condition, replicate, tagdir -> 
-            tuple(replicate, sample_id, tagdir)
-        }
-        .set { ip_tagdirs }
-
-    tagdirs_branched.input
-        .map { sample_id, condition, replicate, tagdir -> 
-            tuple(replicate, tagdir)
-        }
-        .set { input_tagdirs }
-
-    ip_tagdirs
-        .join(input_tagdirs)
-        .map { replicate, ip_sample, ip_tagdir, input_tagdir ->
-            tuple(ip_sample, replicate, ip_tagdir, input_tagdir)
-        }
-        .set { paired_tagdirs }
-
-    // 16. HOMER findPeaks - call peaks for each replicate pair
-    HOMER_FINDPEAKS(paired_tagdirs)
-
-    // 17. Convert peaks to BED format
-    HOMER_POS2BED(HOMER_FINDPEAKS.out.peaks)
-
-    // 18. Get reproducible peaks via bedtools intersect
-    HOMER_POS2BED.out.bed
-        .map { replicate, bed -> bed }
-        .collect()
-        .set { all_peak_beds }
-
-    all_peak_beds
-        .map { beds -> tuple(beds[0], beds[1]) }
-        .set { peak_pair }
-
-    BEDTOOLS_INTERSECT(peak_pair.map { it[0] }, peak_pair.map { it[1] })
-
-    // 19. Remove blacklist regions from peaks
-    blacklist = Channel.fromPath(params.blacklist)
-    BEDTOOLS_REMOVE(BEDTOOLS_INTERSECT.out.reproducible_peaks, blacklist)
-
-    // 20. Annotate filtered peaks to nearest genomic features
-    genome_fasta_annot = Channel.fromPath(params.genome)
-    gtf_annot = Channel.fromPath(params.gtf)
-    HOMER_ANNOTATEPEAKS(BEDTOOLS_REMOVE.out.filtered_peaks, genome_fasta_annot, gtf_annot)
-
     // ========== WEEK 3: Signal Profiling and Motif Analysis ==========
     
     // 21. Filter bigwigs to only IP samples for gene body analysis
-    DEEPTOOLS_BAMCOVERAGE.out.bigwig
-        .filter { bw_file ->
-            bw_file.name.contains('IP_') && !bw_file.name.contains('INPUT')
-        }
+    bigwigs
+        .combine(ip_ids)
+        .filter { bw_file, ids -> bw_file.baseName in ids }
+        .map { bw_file, ids -> bw_file }
         .collect()
         .set { ip_bigwigs }
 
-    // 22. computeMatrix - calculate signal across gene regions
-    ucsc_genes_bed = Channel.fromPath(params.ucsc_genes)
-    DEEPTOOLS_COMPUTEMATRIX(ip_bigwigs, ucsc_genes_bed)
-
-    // 23. plotProfile - visualize the signal profile across genes
-    DEEPTOOLS_PLOTPROFILE(DEEPTOOLS_COMPUTEMATRIX.out.matrix)
+    signal_tracks
+        .combine(ip_ids)
+        .filter { track, ids -> track.baseName in ids }
+        .map { track, ids -> track }
+        .collect()
+        .set { ip_signal_tracks }
 
-    // 24. Motif enrichment analysis on filtered peaks
-    genome_fasta_motif = Channel.fromPath(params.genome)
-    HOMER_FINDMOTIFSGENOME(BEDTOOLS_REMOVE.out.filtered_peaks, genome_fasta_motif)
+    ucsc_genes_bed = Channel.fromPath(params.ucsc_genes)
+    if (params.profile_engine == 'deeptools') {
+        // 22. computeMatrix - calculate signal across gene regions
+        DEEPTOOLS_COMPUTEMATRIX(ip_bigwigs, ucsc_genes_bed)
+
+        // 23. plotProfile - visualize the signal profile across genes
+        DEEPTOOLS_PLOTPROFILE(DEEPTOOLS_COMPUTEMATRIX.out.matrix)
+    } else {
+        // 22-23. Scale-regions profiles, optionally split by DE status
+        SIGNAL_PROFILE(ip_signal_tracks, ucsc_genes_bed, Channel.fromPath(params.rnaseq))
+    }
+
+    // 24. Motif enrichment analysis on each experiment's filtered peaks:
+    //     findMotifsGenome.pl (known and de novo), or with --motif_engine native
+    //     a scan of --known_motifs with central enrichment against a GC-matched
+    //     background
+    if (params.motif_engine == 'homer') {
+        HOMER_FINDMOTIFSGENOME(filtered_peaks, Channel.value(file(params.genome)))
+    } else {
+        MOTIF_SCAN(filtered_peaks, Channel.value(file(params.genome)),
+                   Channel.value(file(params.known_motifs, checkIfExists: true)), blacklist)
+    }
 }
 
 workflow.onComplete {
     println "Pipeline completed at: $workflow.complete"
     println "Execution status: ${ workflow.success ? 'SUCCESS' : 'FAILED' }"
     println "Execution duration: $workflow.duration"
+    println "Task trace: ${params.outdir}/pipeline_info/trace.txt"
+    println "Performance report: PYTHONPATH=${params.scripts_dir} python -m chipseq.perf report --trace ${params.outdir}/pipeline_info/trace.txt --outdir ${params.outdir}/pipeline_info"
 }